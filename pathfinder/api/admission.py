@@ -0,0 +1,121 @@
+""" Admission control for the REST API.
+
+The gevent `WSGIServer` starts a greenlet for every request. Under overload they all compete for
+the event loop: every request gets slower, and the ingestion of received messages starves.
+
+`AdmissionController` wraps the WSGI app and runs at most `limit` requests of every
+`AdmissionBudget` at once. Further requests wait in a queue of at most `queue_size` requests,
+each for at most `timeout` seconds:
+
+- Requests arriving at a full queue are rejected right away with `429 Too Many Requests`.
+- Requests still waiting at their deadline are rejected with `503 Service Unavailable`.
+
+Both rejections have a `Retry-After` header. Path queries and balance or fee updates have
+separate budgets, so a flood of one does not hold up the other.
+"""
+import json
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from gevent.lock import BoundedSemaphore
+from werkzeug.wsgi import ClosingIterator
+
+from pathfinder.config import ADMISSION_QUEUE_SIZE_DEFAULT, ADMISSION_TIMEOUT_DEFAULT
+
+RETRY_AFTER_SECONDS = 1
+
+
+class AdmissionBudget:
+    """ The concurrency limit and wait queue shared by a group of endpoints. """
+
+    def __init__(
+        self,
+        limit: int,
+        queue_size: int = ADMISSION_QUEUE_SIZE_DEFAULT,
+        timeout: float = ADMISSION_TIMEOUT_DEFAULT,
+    ) -> None:
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.slots = BoundedSemaphore(limit)
+        self.waiting = 0
+
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    @property
+    def running(self) -> int:
+        return self.limit - self.slots.counter
+
+    def stats(self) -> Dict[str, int]:
+        return dict(
+            running=self.running,
+            waiting=self.waiting,
+            admitted=self.admitted,
+            rejected=self.rejected,
+            timed_out=self.timed_out,
+        )
+
+
+class AdmissionController:
+    """ WSGI middleware admitting the requests of `app`, see the module docs.
+
+    `classify` returns the name of the budget in `budgets` for the WSGI environment of a request,
+    requests without a budget are always admitted. """
+
+    def __init__(
+        self,
+        app: Callable,
+        budgets: Dict[str, AdmissionBudget],
+        classify: Callable[[Dict[str, Any]], Optional[str]],
+    ) -> None:
+        self.app = app
+        self.budgets = budgets
+        self.classify = classify
+
+    def __call__(self, environ: Dict[str, Any], start_response: Callable) -> Iterable[bytes]:
+        budget_name = self.classify(environ)
+        budget = self.budgets.get(budget_name) if budget_name is not None else None
+        if budget is None:
+            return self.app(environ, start_response)
+
+        if not budget.slots.acquire(blocking=False):
+            if budget.waiting >= budget.queue_size:
+                budget.rejected += 1
+                return self._reject(
+                    start_response,
+                    '429 Too Many Requests',
+                    'Too many {} requests queued, retry later'.format(budget_name),
+                )
+
+            budget.waiting += 1
+            try:
+                admitted = budget.slots.acquire(timeout=budget.timeout)
+            finally:
+                budget.waiting -= 1
+            if not admitted:
+                budget.timed_out += 1
+                return self._reject(
+                    start_response,
+                    '503 Service Unavailable',
+                    'Timed out waiting to serve {} request, retry later'.format(budget_name),
+                )
+
+        budget.admitted += 1
+        try:
+            response = self.app(environ, start_response)
+        except BaseException:
+            budget.slots.release()
+            raise
+        # the slot is held until the response is sent, also for streamed responses
+        return ClosingIterator(response, budget.slots.release)
+
+    @staticmethod
+    def _reject(start_response: Callable, status: str, error: str) -> Iterable[bytes]:
+        body = json.dumps({'error': error}).encode()
+        start_response(status, [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(body))),
+            ('Retry-After', str(RETRY_AFTER_SECONDS)),
+        ])
+        return [body]
@@ -1,22 +1,74 @@
-from typing import Optional, Tuple, Dict, List
+import logging
+from typing import Any, Iterator, Optional, Tuple, Dict, List, Type
 
 import gevent
-from eth_utils import is_address, is_checksum_address, is_same_address
-from flask import Flask, request
+from eth_utils import is_same_address
+from flask import Flask, Response, request
 from flask_restful import Api, Resource, reqparse
 from gevent import Greenlet
 from gevent.pywsgi import WSGIServer
-from networkx.exception import NetworkXNoPath
+from networkx.exception import NetworkXNoPath, NodeNotFound
 from jsonschema.exceptions import ValidationError
 from raiden_libs.messages import FeeInfo, Message, BalanceProof
 from raiden_libs.exceptions import MessageTypeError
 from raiden_libs.types import Address
-
-from pathfinder.config import API_DEFAULT_PORT, API_HOST, API_PATH
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import quote_etag
+
+from pathfinder.api.admission import AdmissionBudget, AdmissionController
+from pathfinder.api.encoding import dumps, loads, output_json
+from pathfinder.config import (
+    ADMISSION_PATHS_LIMIT_DEFAULT,
+    ADMISSION_QUEUE_SIZE_DEFAULT,
+    ADMISSION_TIMEOUT_DEFAULT,
+    ADMISSION_UPDATES_LIMIT_DEFAULT,
+    API_DEFAULT_PORT,
+    API_HOST,
+    API_PATH,
+    MAX_MESSAGES_PER_BATCH,
+    MAX_QUERIES_PER_BATCH,
+    PATH_STRATEGY_DEFAULT,
+    PATHS_MAX_TIME_MS_DEFAULT,
+)
+from pathfinder.model.token_network import PATH_STRATEGIES
 from pathfinder.pathfinding_service import PathfindingService
+from pathfinder.utils.address import is_address, is_checksum_address
+
+log = logging.getLogger(__name__)
+
+# name, type and default of the url parameters of `PathsResource`
+PATHS_ARGUMENTS: Tuple[Tuple[str, type, Any], ...] = (
+    ('from', str, None),
+    ('to', str, None),
+    ('value', int, None),
+    ('num_paths', int, None),
+    ('strategy', str, PATH_STRATEGY_DEFAULT),
+    ('max_time_ms', int, PATHS_MAX_TIME_MS_DEFAULT),
+)
+
+
+def parse_query_args(arguments: Tuple[Tuple[str, type, Any], ...]) -> reqparse.Namespace:
+    """ Reads the url parameters of the request like a `reqparse.RequestParser` with the same
+    `arguments`, without building the parser for every request.
+
+    Raises `ValueError` for values that cannot be converted to the type of their argument. """
+    query = request.args
+    args = reqparse.Namespace()
+    for name, argument_type, default in arguments:
+        value = query.get(name)
+        if value is None:
+            args[name] = default
+            continue
+        try:
+            args[name] = argument_type(value)
+        except ValueError:
+            raise ValueError('Invalid value for {}: {}'.format(name, value))
+    return args
 
 
 class PathfinderResource(Resource):
+    # the `AdmissionBudget` of the endpoint, see `ServiceApi`
+    admission_budget: Optional[str] = None
 
     def __init__(self, pathfinding_service: PathfindingService) -> None:
         self.pathfinding_service = pathfinding_service
@@ -53,8 +105,17 @@ class PathfinderResource(Resource):
 
         return None
 
+    @staticmethod
+    def _read_json_body() -> Any:
+        """ The decoded JSON body, `None` if it is missing or invalid. """
+        try:
+            return loads(request.get_data())
+        except ValueError:
+            return None
+
 
 class ChannelBalanceResource(PathfinderResource):
+    admission_budget = 'updates'
 
     def put(self, token_network_address: str, channel_id: str):
         token_network_error = self._validate_token_network_argument(token_network_address)
@@ -65,7 +126,9 @@ class ChannelBalanceResource(PathfinderResource):
         if channel_id_error is not None:
             return channel_id_error
 
-        body = request.json
+        body = self._read_json_body()
+        if not isinstance(body, dict):
+            return {'error': 'Required body: JSON BalanceProof message'}, 400
         try:
             balance_proof: BalanceProof = Message.deserialize(body, BalanceProof)
         except MessageTypeError:
@@ -104,6 +167,7 @@ class ChannelBalanceResource(PathfinderResource):
 
 
 class ChannelFeeResource(PathfinderResource):
+    admission_budget = 'updates'
 
     def put(self, token_network_address: str, channel_id: str):
         token_network_error = self._validate_token_network_argument(token_network_address)
@@ -114,7 +178,9 @@ class ChannelFeeResource(PathfinderResource):
         if channel_id_error is not None:
             return channel_id_error
 
-        body = request.json
+        body = self._read_json_body()
+        if not isinstance(body, dict):
+            return {'error': 'Required body: JSON FeeInfo message'}, 400
         try:
             fee_info: FeeInfo = Message.deserialize(body, FeeInfo)
         except MessageTypeError:
@@ -146,7 +212,119 @@ class ChannelFeeResource(PathfinderResource):
         self.pathfinding_service.on_fee_info_message(fee_info)
 
 
+class MessageBatchResource(PathfinderResource):
+    """ Applies many messages to a token network in one request.
+
+    The body is either a JSON array of the messages accepted by the single message endpoint, or
+    one message per line with the content type `application/x-ndjson`. The token network is
+    validated once for the whole batch, and all valid messages are applied in one pass, see
+    `PathfindingService.apply_messages`. Every message gets either a `status` or an `error` in
+    the returned list.
+    """
+    admission_budget = 'updates'
+    message_type: Type[Message]
+    message_name: str
+
+    @staticmethod
+    def _read_messages() -> Optional[List[Any]]:
+        """ The decoded messages of the body, or `None` if it is neither a JSON array nor
+        NDJSON. Undecodable NDJSON lines are returned as their `ValueError`. """
+        if request.mimetype != 'application/x-ndjson':
+            body = request.get_json(silent=True)
+            return body if isinstance(body, list) else None
+
+        messages: List[Any] = []
+        for line in request.get_data(as_text=True).splitlines():
+            if not line.strip():
+                continue
+            try:
+                messages.append(loads(line))
+            except ValueError as error:
+                messages.append(error)
+        return messages
+
+    def post(self, token_network_address: str):
+        token_network_error = self._validate_token_network_argument(token_network_address)
+        if token_network_error is not None:
+            return token_network_error
+
+        bodies = self._read_messages()
+        if bodies is None:
+            return {'error': 'Required body: JSON array or NDJSON of {} messages'.format(
+                self.message_name
+            )}, 400
+        if len(bodies) > MAX_MESSAGES_PER_BATCH:
+            return {'error': 'At most {} messages per batch allowed'.format(
+                MAX_MESSAGES_PER_BATCH
+            )}, 400
+
+        results: List[Optional[Dict]] = [None] * len(bodies)
+        valid_indices = []
+        messages = []
+        for index, body in enumerate(bodies):
+            if isinstance(body, ValueError):
+                results[index] = {'error': 'Invalid JSON: {}'.format(body)}
+                continue
+            if not isinstance(body, dict):
+                results[index] = {'error': 'Message must be an object: {}'.format(body)}
+                continue
+
+            try:
+                message = Message.deserialize(body, self.message_type)
+            except MessageTypeError:
+                results[index] = {'error': 'Not a {} message'.format(self.message_name)}
+                continue
+            except ValidationError as val_err:
+                results[index] = {'error': val_err.message}
+                continue
+
+            if not is_same_address(token_network_address, message.token_network_address):
+                error = 'The token network address from the message ({}) ' \
+                        'and the request ({}) do not match'
+                results[index] = {
+                    'error': error.format(message.token_network_address, token_network_address)
+                }
+                continue
+
+            valid_indices.append(index)
+            messages.append(message)
+
+        errors = self.pathfinding_service.apply_messages(messages)
+        for index, message_error in zip(valid_indices, errors):
+            if message_error is None:
+                results[index] = {'status': 'ok'}
+            else:
+                results[index] = {'error': message_error}
+
+        return {'result': results}, 200
+
+
+class ChannelBalanceBatchResource(MessageBatchResource):
+    message_type = BalanceProof
+    message_name = 'BalanceProof'
+
+
+class ChannelFeeBatchResource(MessageBatchResource):
+    message_type = FeeInfo
+    message_name = 'FeeInfo'
+
+
 class PathsResource(PathfinderResource):
+    """ Answers a path query given by the url parameters.
+
+    Complete results carry an `ETag` of the form `<epoch>-<version>-<fingerprint>`:
+
+    - `epoch` is the `TokenNetwork.epoch`, as network versions start over after a restart.
+      Snapshot readers share the epoch of the service that wrote the snapshots.
+    - `version` is the `TokenNetwork.version` the result was found on. A request with this tag
+      in `If-None-Match` is answered with `304 Not Modified` without a search, as long as the
+      network did not change.
+    - `fingerprint` is the `TokenNetwork.paths_fingerprint` of the result. After the network
+      changed, the query is answered again, and with `304 Not Modified` if the fingerprint is
+      still the same, that is if no channel on the returned paths changed.
+    """
+    admission_budget = 'paths'
+
     @staticmethod
     def _validate_args(args):
         required_args = ['from', 'to', 'value', 'num_paths']
@@ -171,41 +349,225 @@ class PathsResource(PathfinderResource):
         if args.num_paths <= 0:
             return {'error': 'Number of paths must be positive: {}'.format(args.num_paths)}, 400
 
+        if args.strategy not in PATH_STRATEGIES:
+            return {'error': 'Unknown path strategy: {}'.format(args.strategy)}, 400
+
+        if args.max_time_ms <= 0:
+            return {'error': 'Time budget must be positive: {}'.format(args.max_time_ms)}, 400
+
         return None
 
-    # url parameters are used because json bodies for GET requests are uncommon
-    def get(self, token_network_address: str):
+    def _query_args(
+        self,
+        token_network_address: str,
+    ) -> Tuple[Optional[reqparse.Namespace], Optional[Tuple[Dict, int]]]:
+        """ The validated url parameters of the request, or the error response. """
         token_network_error = self._validate_token_network_argument(token_network_address)
         if token_network_error is not None:
-            return token_network_error
+            return None, token_network_error
 
-        parser = reqparse.RequestParser()
-        parser.add_argument('from', type=str, help='Payment initiator address.')
-        parser.add_argument('to', type=str, help='Payment target address.')
-        parser.add_argument('value', type=int, help='Maximum payment value.')
-        parser.add_argument('num_paths', type=int, help='Number of paths requested.')
-
-        args = parser.parse_args()
+        try:
+            args = parse_query_args(PATHS_ARGUMENTS)
+        except ValueError as value_error:
+            return None, ({'error': str(value_error)}, 400)
         error = self._validate_args(args)
+        if error is not None:
+            return None, error
+        return args, None
+
+    @staticmethod
+    def _search_kwargs(args: reqparse.Namespace) -> Dict[str, Any]:
+        return dict(
+            source=args['from'],
+            target=args['to'],
+            value=args.value,
+            k=args.num_paths,
+            strategy=args.strategy,
+            max_time_ms=args.max_time_ms
+        )
+
+    @staticmethod
+    def _search_error(error: Exception, args: reqparse.Namespace) -> Tuple[Dict, int]:
+        if isinstance(error, NodeNotFound):
+            return {'error': 'Initiator address has no channels: {}'.format(args['from'])}, 400
+        return {'error': 'No suitable path found for transfer from {} to {}.'.format(
+            args['from'], args['to']
+        )}, 400
+
+    # url parameters are used because json bodies for GET requests are uncommon
+    def get(self, token_network_address: str):
+        args, error = self._query_args(token_network_address)
         if error is not None:
             return error
 
         token_network = self.pathfinding_service.token_networks.get(
             Address(token_network_address)
         )
+        assert token_network is not None
+        version = token_network.version
+        tag_prefix = '{:x}-{}-'.format(token_network.epoch, version)
+        client_tags = list(request.if_none_match)
+        for client_tag in client_tags:
+            if client_tag.startswith(tag_prefix):
+                return self._not_modified(client_tag)
+
         try:
-            paths = token_network.get_paths(
-                source=args['from'],
-                target=args['to'],
-                value=args.value,
-                k=args.num_paths
-            )
-        except NetworkXNoPath:
-            return {'error': 'No suitable path found for transfer from {} to {}.'.format(
-                args['from'], args['to']
+            paths = self.pathfinding_service.get_paths(token_network, **self._search_kwargs(args))
+        except (NodeNotFound, NetworkXNoPath) as search_error:
+            return self._search_error(search_error, args)
+
+        result = {'result': paths, 'partial': paths.partial}
+        # partial results depend on timing, and paths found while the network changed can
+        # contain channels that are closed by now
+        if paths.partial or token_network.version != version:
+            return result, 200
+
+        fingerprint = token_network.paths_fingerprint(paths)
+        tag = tag_prefix + fingerprint
+        if any(client_tag.endswith('-' + fingerprint) for client_tag in client_tags):
+            return self._not_modified(tag)
+        return result, 200, {'ETag': quote_etag(tag)}
+
+    @staticmethod
+    def _not_modified(tag: str) -> Response:
+        return Response(status=304, headers={'ETag': quote_etag(tag)})
+
+
+class PathsStreamResource(PathsResource):
+    """ Answers a path query like `PathsResource`, as NDJSON with one line per path.
+
+    Every path is sent with its `estimated_fee` as soon as it is found, see
+    `TokenNetwork.iter_paths`, so clients can start a transfer on the first path while the
+    others are searched for. The last line holds `partial`. Errors are detected before the
+    first path and answered like by `PathsResource`. Should the search fail after the first
+    path was sent, the last line holds an `error` instead.
+    """
+
+    def get(self, token_network_address: str):
+        args, error = self._query_args(token_network_address)
+        if error is not None:
+            return error
+
+        token_network = self.pathfinding_service.token_networks.get(
+            Address(token_network_address)
+        )
+        assert token_network is not None
+        search = self.pathfinding_service.iter_paths(token_network, **self._search_kwargs(args))
+        try:
+            first_path = next(search)
+        except StopIteration as stop:
+            return Response(dumps({'partial': stop.value}), mimetype='application/x-ndjson')
+        except (NodeNotFound, NetworkXNoPath) as search_error:
+            return self._search_error(search_error, args)
+
+        def stream() -> Iterator[bytes]:
+            yield dumps(first_path)
+            while True:
+                try:
+                    path = next(search)
+                except StopIteration as stop:
+                    yield dumps({'partial': stop.value})
+                    return
+                except Exception:
+                    # the status was sent with the first path
+                    log.exception('Path search failed while streaming')
+                    yield dumps({'error': 'Path search failed'})
+                    return
+                yield dumps(path)
+
+        return Response(stream(), mimetype='application/x-ndjson')
+
+
+class PathsBatchResource(PathsResource):
+    """ Answers many path queries in one request, see `TokenNetwork.get_paths_batch`.
+
+    The body holds a `queries` list of objects with the url parameters of `PathsResource`, and
+    an optional `strategy` and `max_time_ms` for all of them. Every query gets either a
+    `result` and `partial` or an `error` in the returned list.
+    """
+
+    def post(self, token_network_address: str):
+        token_network_error = self._validate_token_network_argument(token_network_address)
+        if token_network_error is not None:
+            return token_network_error
+
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict) or not isinstance(body.get('queries'), list):
+            return {'error': 'Required body: {"queries": [...]}'}, 400
+
+        queries = body['queries']
+        if len(queries) > MAX_QUERIES_PER_BATCH:
+            return {'error': 'At most {} queries per batch allowed'.format(
+                MAX_QUERIES_PER_BATCH
             )}, 400
 
-        return {'result': paths}, 200
+        strategy = body.get('strategy', PATH_STRATEGY_DEFAULT)
+        if strategy not in PATH_STRATEGIES:
+            return {'error': 'Unknown path strategy: {}'.format(strategy)}, 400
+
+        max_time_ms = body.get('max_time_ms', PATHS_MAX_TIME_MS_DEFAULT)
+        if not isinstance(max_time_ms, int) or max_time_ms <= 0:
+            return {'error': 'Time budget must be positive: {}'.format(max_time_ms)}, 400
+
+        results: List[Optional[Dict]] = [None] * len(queries)
+        valid_indices = []
+        for index, query in enumerate(queries):
+            if not isinstance(query, dict):
+                results[index] = {'error': 'Query must be an object: {}'.format(query)}
+                continue
+
+            args = reqparse.Namespace(
+                {arg: query.get(arg) for arg in ['from', 'to', 'value', 'num_paths']},
+                strategy=strategy,
+                max_time_ms=max_time_ms
+            )
+            error = None
+            if not all(isinstance(args[arg], str) for arg in ['from', 'to']):
+                error = {'error': 'Parameters from and to must be strings'}, 400
+            elif not all(isinstance(args[arg], int) for arg in ['value', 'num_paths']):
+                error = {'error': 'Parameters value and num_paths must be integers'}, 400
+            if error is None:
+                error = self._validate_args(args)
+            if error is not None:
+                results[index] = error[0]
+                continue
+            valid_indices.append(index)
+
+        token_network = self.pathfinding_service.token_networks.get(
+            Address(token_network_address)
+        )
+        assert token_network is not None
+        batch_results = self.pathfinding_service.get_paths_batch(
+            token_network,
+            [
+                (
+                    queries[index]['from'],
+                    queries[index]['to'],
+                    queries[index]['value'],
+                    queries[index]['num_paths'],
+                )
+                for index in valid_indices
+            ],
+            strategy=strategy,
+            max_time_ms=max_time_ms
+        )
+
+        for index, paths in zip(valid_indices, batch_results):
+            query = queries[index]
+            if isinstance(paths, NodeNotFound):
+                results[index] = {
+                    'error': 'Initiator address has no channels: {}'.format(query['from'])
+                }
+            elif isinstance(paths, NetworkXNoPath):
+                results[index] = {
+                    'error': 'No suitable path found for transfer from {} to {}.'.format(
+                        query['from'], query['to']
+                    )
+                }
+            else:
+                results[index] = {'result': paths, 'partial': paths.partial}
+
+        return {'result': results}, 200
 
 
 class PaymentInfoResource(Resource):
@@ -213,23 +575,80 @@ class PaymentInfoResource(Resource):
 
 
 class ServiceApi:
-    def __init__(self, pathfinding_service: PathfindingService) -> None:
+    """ The REST API of a `PathfindingService` or `SnapshotPathfindingService`.
+
+    Path queries and balance or fee updates are admitted by an `AdmissionController`, with
+    separate concurrency limits of `paths_limit` and `updates_limit` requests. Requests beyond
+    them wait in queues of `admission_queue_size` requests for at most `admission_timeout`
+    seconds.
+    """
+
+    def __init__(
+        self,
+        pathfinding_service: PathfindingService,
+        paths_limit: int = ADMISSION_PATHS_LIMIT_DEFAULT,
+        updates_limit: int = ADMISSION_UPDATES_LIMIT_DEFAULT,
+        admission_queue_size: int = ADMISSION_QUEUE_SIZE_DEFAULT,
+        admission_timeout: float = ADMISSION_TIMEOUT_DEFAULT,
+    ) -> None:
         self.flask_app = Flask(__name__)
         self.api = Api(self.flask_app)
+        self.api.representations['application/json'] = output_json
         self.rest_server: WSGIServer = None
         self.server_greenlet: Greenlet = None
 
         resources: List[Tuple[str, Resource, Dict]] = [
-            ('/<token_network_address>/<channel_id>/balance', ChannelBalanceResource, {}),
-            ('/<token_network_address>/<channel_id>/fee', ChannelFeeResource, {}),
             ('/<token_network_address>/paths', PathsResource, {}),
+            ('/<token_network_address>/paths/batch', PathsBatchResource, {}),
+            ('/<token_network_address>/paths/stream', PathsStreamResource, {}),
             ('/<token_network_address>/payment/info', PaymentInfoResource, {})
         ]
-
+        # services answering from graph snapshots cannot apply updates
+        if not pathfinding_service.read_only:
+            resources += [
+                ('/<token_network_address>/<channel_id>/balance', ChannelBalanceResource, {}),
+                ('/<token_network_address>/<channel_id>/fee', ChannelFeeResource, {}),
+                ('/<token_network_address>/balance/batch', ChannelBalanceBatchResource, {}),
+                ('/<token_network_address>/fee/batch', ChannelFeeBatchResource, {}),
+            ]
+
+        # endpoint -> name of its admission budget
+        self.admission_budgets: Dict[str, str] = {}
         for endpoint_url, resource, kwargs in resources:
             endpoint_url = API_PATH + endpoint_url
+            endpoint = resource.__name__.lower()
             kwargs['pathfinding_service'] = pathfinding_service
-            self.api.add_resource(resource, endpoint_url, resource_class_kwargs=kwargs)
+            self.api.add_resource(
+                resource,
+                endpoint_url,
+                endpoint=endpoint,
+                resource_class_kwargs=kwargs,
+            )
+            budget = getattr(resource, 'admission_budget', None)
+            if budget is not None:
+                self.admission_budgets[endpoint] = budget
+
+        self.admission = AdmissionController(
+            self.flask_app.wsgi_app,
+            {
+                'paths': AdmissionBudget(paths_limit, admission_queue_size, admission_timeout),
+                'updates': AdmissionBudget(
+                    updates_limit,
+                    admission_queue_size,
+                    admission_timeout,
+                ),
+            },
+            self._admission_budget,
+        )
+        self.flask_app.wsgi_app = self.admission  # type: ignore
+
+    def _admission_budget(self, environ: Dict[str, Any]) -> Optional[str]:
+        try:
+            endpoint, _ = self.flask_app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            # unknown urls are answered by flask right away
+            return None
+        return self.admission_budgets.get(endpoint)
 
     def run(self, port: int = API_DEFAULT_PORT):
         self.rest_server = WSGIServer((API_HOST, port), self.flask_app)
@@ -6,7 +6,7 @@ monkey.patch_all()  # isort:skip # noqa
 
 import logging
 import sys
-from typing import List
+from typing import Any, Dict, List
 
 import click
 from raiden_libs.blockchain import BlockchainListener
@@ -17,6 +17,19 @@ from eth_utils import is_checksum_address
 from raiden_libs.no_ssl_patch import no_ssl_verification
 from raiden_libs.types import Address
 
+from pathfinder.config import (
+    COALESCE_INTERVAL_DEFAULT,
+    GRAPH_BACKEND_DEFAULT,
+    INGESTION_QUEUE_SIZE_DEFAULT,
+    NUM_LANDMARKS_DEFAULT,
+    OVERFLOW_POLICY_DEFAULT,
+    PATH_CACHE_SIZE_DEFAULT,
+    ROUTING_WORKERS_DEFAULT,
+    SIGNATURE_WORKERS_DEFAULT,
+)
+from pathfinder.ingestion import OVERFLOW_POLICIES
+from pathfinder.model.state_snapshot import load_checkpoints, token_network_resume_block
+from pathfinder.model.token_network import GRAPH_BACKENDS
 from pathfinder.pathfinding_service import PathfindingService
 from raiden_libs.transport import MatrixTransport
 
@@ -47,6 +60,15 @@ def check_supplied_token_network_addresses(
     return result
 
 
+def resume_block(checkpoints: Dict[str, Any], listener: str) -> int:
+    """ The block to start the sync of `listener` from, its checkpoint.
+
+    The listeners only report confirmed events, which are not reorged, so there is no need to
+    process blocks before the checkpoint again. Events of the checkpoint block that were
+    already processed are skipped by the `PathfindingService`. """
+    return checkpoints.get(listener, 0)
+
+
 @click.command()
 @click.option(
     '--eth-rpc',
@@ -76,6 +98,69 @@ def check_supplied_token_network_addresses(
     required=True,
     help='Matrix password'
 )
+@click.option(
+    '--graph-backend',
+    default=GRAPH_BACKEND_DEFAULT,
+    type=click.Choice(GRAPH_BACKENDS),
+    help='Graph backend used for routing'
+)
+@click.option(
+    '--num-landmarks',
+    default=NUM_LANDMARKS_DEFAULT,
+    type=click.IntRange(min=0),
+    help='Number of landmarks for goal directed routing, 0 disables them'
+)
+@click.option(
+    '--path-cache-size',
+    default=PATH_CACHE_SIZE_DEFAULT,
+    type=click.IntRange(min=0),
+    help='Number of path results cached per token network, 0 disables the cache'
+)
+@click.option(
+    '--routing-workers',
+    default=ROUTING_WORKERS_DEFAULT,
+    type=click.IntRange(min=0),
+    help='Number of worker processes answering path queries, 0 answers them in the main process'
+)
+@click.option(
+    '--signature-workers',
+    default=SIGNATURE_WORKERS_DEFAULT,
+    type=click.IntRange(min=0),
+    help='Number of worker processes recovering message signers, 0 recovers them in the main '
+         'process'
+)
+@click.option(
+    '--coalesce-interval',
+    default=COALESCE_INTERVAL_DEFAULT,
+    type=float,
+    help='Seconds to collect balance proofs and fee infos before applying the latest one of '
+         'every channel direction, 0 applies all of them right away'
+)
+@click.option(
+    '--ingestion-queue-size',
+    default=INGESTION_QUEUE_SIZE_DEFAULT,
+    type=click.IntRange(min=1),
+    help='Number of received messages queued for the recovery of their signers'
+)
+@click.option(
+    '--overflow-policy',
+    default=OVERFLOW_POLICY_DEFAULT,
+    type=click.Choice(OVERFLOW_POLICIES),
+    help='Drop the oldest queued message of the channel or pause the transport when the '
+         'ingestion queue is full'
+)
+@click.option(
+    '--snapshot-dir',
+    default=None,
+    type=click.Path(exists=True, file_okay=False, writable=True),
+    help='Directory to publish graph snapshots to, for read-only API processes'
+)
+@click.option(
+    '--state-dir',
+    default=None,
+    type=click.Path(exists=True, file_okay=False, writable=True),
+    help='Directory to save the token network state to and to restore it from on startup'
+)
 @click.argument(
     'token_network_addresses',
     nargs=-1
@@ -86,6 +171,16 @@ def main(
     matrix_homeserver,
     matrix_username,
     matrix_password,
+    graph_backend,
+    num_landmarks,
+    path_cache_size,
+    routing_workers,
+    signature_workers,
+    coalesce_interval,
+    ingestion_queue_size,
+    overflow_policy,
+    snapshot_dir,
+    state_dir,
     token_network_addresses,
 ):
     """Console script for pathfinder."""
@@ -105,6 +200,8 @@ def main(
     else:
         log.info('Following all networks.')
 
+    checkpoints = load_checkpoints(state_dir) if state_dir is not None else {}
+
     with no_ssl_verification():
         service = None
         try:
@@ -121,6 +218,11 @@ def main(
                 web3,
                 CONTRACT_MANAGER,
                 'TokenNetwork',
+                sync_start_block=token_network_resume_block(
+                    state_dir,
+                    checkpoints,
+                    token_network_addresses,
+                ) if state_dir is not None else 0,
             )
 
             log.info('Starting Pathfinding Service...')
@@ -129,20 +231,41 @@ def main(
                     CONTRACT_MANAGER,
                     transport,
                     token_network_listener,
-                    follow_networks=token_network_addresses)
+                    follow_networks=token_network_addresses,
+                    graph_backend=graph_backend,
+                    num_landmarks=num_landmarks,
+                    path_cache_size=path_cache_size,
+                    routing_workers=routing_workers,
+                    signature_workers=signature_workers,
+                    coalesce_interval=coalesce_interval,
+                    ingestion_queue_size=ingestion_queue_size,
+                    overflow_policy=overflow_policy,
+                    snapshot_dir=snapshot_dir,
+                    state_dir=state_dir)
             else:
                 log.info('Starting TokenNetworkRegistry Listener...')
                 token_network_registry_listener = BlockchainListener(
                     web3,
                     CONTRACT_MANAGER,
                     'TokenNetworkRegistry',
+                    sync_start_block=resume_block(checkpoints, 'token_network_registry'),
                 )
 
                 service = PathfindingService(
                     CONTRACT_MANAGER,
                     transport,
                     token_network_listener,
-                    token_network_registry_listener=token_network_registry_listener)
+                    token_network_registry_listener=token_network_registry_listener,
+                    graph_backend=graph_backend,
+                    num_landmarks=num_landmarks,
+                    path_cache_size=path_cache_size,
+                    routing_workers=routing_workers,
+                    signature_workers=signature_workers,
+                    coalesce_interval=coalesce_interval,
+                    ingestion_queue_size=ingestion_queue_size,
+                    overflow_policy=overflow_policy,
+                    snapshot_dir=snapshot_dir,
+                    state_dir=state_dir)
 
             service.run()
         except (KeyboardInterrupt, SystemExit):
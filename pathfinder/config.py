@@ -1,6 +1,10 @@
 API_PATH: str = '/api/1'
 API_HOST: str = 'localhost'
 API_DEFAULT_PORT: int = 5002
+ADMISSION_PATHS_LIMIT_DEFAULT: int = 32
+ADMISSION_UPDATES_LIMIT_DEFAULT: int = 16
+ADMISSION_QUEUE_SIZE_DEFAULT: int = 128
+ADMISSION_TIMEOUT_DEFAULT: float = 2
 
 WEB3_PROVIDER_DEFAULT: str = "http://127.0.0.1:8545"
 
@@ -10,3 +14,40 @@ DIVERSITY_PEN_DEFAULT: float = 0.001
 MAX_PATHS_PER_REQUEST: int = 25
 MIN_PATH_REDUNDANCY: int = 20
 PATH_REDUNDANCY_FACTOR: int = 4
+PATH_STRATEGY_DEFAULT: str = 'diversity'
+MAX_QUERIES_PER_BATCH: int = 100
+MAX_MESSAGES_PER_BATCH: int = 1000
+PATHS_MAX_TIME_MS_DEFAULT: int = 2000
+QUERY_STATS_INTERVAL: float = 60
+
+GRAPH_BACKEND_DEFAULT: str = 'networkx'
+CSR_COMPACTION_THRESHOLD: float = 0.25
+CSR_COMPACTION_MIN_EDGES: int = 1024
+
+NUM_LANDMARKS_DEFAULT: int = 0
+LANDMARK_MAX_SLACK: float = 0.001
+
+PATH_CACHE_SIZE_DEFAULT: int = 0
+
+ROUTING_WORKERS_DEFAULT: int = 0
+ROUTING_WORKER_TIMEOUT: float = 10
+
+SIGNATURE_WORKERS_DEFAULT: int = 0
+SIGNATURE_BATCH_SIZE: int = 1000
+SIGNER_CACHE_SIZE: int = 2 ** 16
+
+COALESCE_INTERVAL_DEFAULT: float = 0.1
+COALESCE_MAX_PENDING: int = 10000
+INGESTION_QUEUE_SIZE_DEFAULT: int = 10000
+INGESTION_CHUNK_SIZE: int = 100
+OVERFLOW_POLICY_DEFAULT: str = 'drop-oldest'
+INGESTION_STATS_INTERVAL: float = 60
+
+SNAPSHOT_INTERVAL_DEFAULT: float = 1
+SNAPSHOT_CHUNK_SIZE: int = 10000
+SNAPSHOT_REFRESH_INTERVAL_DEFAULT: float = 1
+STATE_SNAPSHOT_INTERVAL_DEFAULT: float = 60
+JOURNAL_COMPACTION_FACTOR: float = 4
+JOURNAL_COMPACTION_MIN_RECORDS: int = 4096
+
+ADDRESS_CACHE_SIZE: int = 2 ** 16
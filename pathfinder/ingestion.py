@@ -0,0 +1,289 @@
+""" The pipeline applying the balance proofs and fee infos received over the transport.
+
+The transport decodes the messages and hands them to `IngestionPipeline.put`. From there they
+pass two stages, each running in its own greenlet and connected by bounded queues:
+
+- verify: takes batches of received messages and recovers their signers, on the
+  `SignatureWorkerPool` if there is one. Of the valid messages only the one with the highest
+  nonce of every channel direction is kept, see `CoalescingQueue`.
+- apply: applies the kept messages once per `coalesce_interval`, or right away when
+  `max_pending` channel directions wait for it.
+
+The received queue holds at most `queue_size` messages. When a flood fills it, the overflow
+policy decides: `'drop-oldest'` drops the oldest queued message of the same channel, which the
+new one most likely supersedes, or the oldest queued message at all. `'pause'` blocks the
+transport until there is room again, which stops reading from it.
+
+Both stages yield to other greenlets after every `INGESTION_CHUNK_SIZE` messages, so path
+queries are answered in between instead of waiting for a whole batch.
+
+`IngestionPipeline.stop` verifies and applies all messages still in the pipeline before it
+returns, so they are part of the state saved afterwards.
+"""
+import logging
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional
+
+import gevent
+from gevent.event import Event
+from raiden_libs.messages import Message
+from raiden_libs.types import Address
+
+from pathfinder.config import (
+    COALESCE_INTERVAL_DEFAULT,
+    COALESCE_MAX_PENDING,
+    INGESTION_CHUNK_SIZE,
+    INGESTION_QUEUE_SIZE_DEFAULT,
+    OVERFLOW_POLICY_DEFAULT,
+    SIGNATURE_BATCH_SIZE,
+)
+from pathfinder.signature_pool import SignatureWorkerPool, recover_signer
+from pathfinder.utils.coalescing import CoalescingQueue
+
+log = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ('drop-oldest', 'pause')
+
+
+def channel_key(message: Message) -> Hashable:
+    """ Message type, token network and channel, known before the signer is recovered. """
+    return type(message), message.token_network_address, message.channel_identifier
+
+
+class ReceivedQueue:
+    """ FIFO of received messages holding at most `maxsize` of them, see the module docs for
+    the `overflow_policy`.
+
+    Dropped messages are only marked in their entry and skipped when they reach the front, so
+    dropping the oldest message of a channel does not search the queue. Once the marked
+    entries make up half of the queue they are removed in one pass. """
+
+    def __init__(self, maxsize: int, overflow_policy: str = OVERFLOW_POLICY_DEFAULT) -> None:
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError('Unknown overflow policy: {}'.format(overflow_policy))
+
+        self.maxsize = maxsize
+        self.overflow_policy = overflow_policy
+        # entries are [message, queued], `queued` is cleared when the message is dropped
+        self.entries: Deque[List[Any]] = deque()
+        # channel key -> entries of the channel still queued, oldest first
+        self.channels: Dict[Hashable, Deque[List[Any]]] = {}
+        self.size = 0
+        self.dropped = 0
+        self.not_empty = Event()
+        self.not_full = Event()
+        self.not_full.set()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def put(self, message: Message):
+        """ Queues `message`, blocks while the queue is full with the `'pause'` policy. """
+        key = channel_key(message)
+        if self.overflow_policy == 'pause':
+            while self.size >= self.maxsize:
+                self.not_full.clear()
+                self.not_full.wait()
+        elif self.size >= self.maxsize:
+            channel_entries = self.channels.get(key)
+            self._drop(channel_entries[0] if channel_entries else self._front())
+
+        if len(self.entries) >= 2 * self.maxsize:
+            self.entries = deque(entry for entry in self.entries if entry[1])
+        entry = [message, True]
+        self.entries.append(entry)
+        self.channels.setdefault(key, deque()).append(entry)
+        self.size += 1
+        self.not_empty.set()
+
+    def get_batch(self, max_size: int) -> List[Message]:
+        """ Removes and returns up to `max_size` of the oldest messages, waits for the first
+        one if the queue is empty. """
+        while self.size == 0:
+            self.not_empty.clear()
+            self.not_empty.wait()
+
+        messages: List[Message] = []
+        while self.size > 0 and len(messages) < max_size:
+            entry = self._front()
+            self._remove(entry)
+            messages.append(entry[0])
+        self.not_full.set()
+        return messages
+
+    def _front(self) -> List[Any]:
+        """ Removes the dropped entries from the front, the oldest queued one is then first. """
+        while not self.entries[0][1]:
+            self.entries.popleft()
+        return self.entries[0]
+
+    def _drop(self, entry: List[Any]):
+        self._remove(entry)
+        self.dropped += 1
+
+    def _remove(self, entry: List[Any]):
+        # `entry` is always the oldest queued one of its channel
+        key = channel_key(entry[0])
+        channel_entries = self.channels[key]
+        channel_entries.popleft()
+        if not channel_entries:
+            del self.channels[key]
+        entry[1] = False
+        self.size -= 1
+
+
+class IngestionPipeline:
+    """ Verifies and applies the received balance proofs and fee infos, see the module docs.
+
+    `apply_messages` is called with chunks of messages and their recovered signers and returns
+    `None` for every applied message and the reason for every rejected one, like
+    `PathfindingService.apply_messages`. """
+
+    def __init__(
+        self,
+        apply_messages: Callable[[List[Message], List[Optional[Address]]], List[Optional[str]]],
+        *,
+        signature_pool: Optional[SignatureWorkerPool] = None,
+        coalesce_interval: float = COALESCE_INTERVAL_DEFAULT,
+        queue_size: int = INGESTION_QUEUE_SIZE_DEFAULT,
+        overflow_policy: str = OVERFLOW_POLICY_DEFAULT,
+        max_pending: int = COALESCE_MAX_PENDING,
+    ) -> None:
+        self.apply_messages = apply_messages
+        self.signature_pool = signature_pool
+        self.coalesce_interval = coalesce_interval
+        self.max_pending = max_pending
+
+        self.received = ReceivedQueue(queue_size, overflow_policy)
+        # (message type, token network, channel, signer) -> latest message and its signer
+        self.pending = CoalescingQueue()
+        # messages taken from `received` that are not pending yet, oldest first
+        self.verifying: Deque[Message] = deque()
+        # chunks of updates taken from `pending` that are not applied yet
+        self.applying: Deque[List[Any]] = deque()
+        # set by the verify stage when there are pending messages, and when it waits for room
+        self.has_pending = Event()
+        self.flush_requested = Event()
+        self.flushed = Event()
+        self.greenlets: List[gevent.Greenlet] = []
+
+        self.num_received = 0
+        self.num_applied = 0
+        self.num_rejected = 0
+
+    def put(self, message: Message):
+        """ Called by the transport for every received balance proof and fee info. """
+        self.num_received += 1
+        self.received.put(message)
+
+    def start(self):
+        self.greenlets = [
+            gevent.spawn(self._verify_forever),
+            gevent.spawn(self._apply_forever),
+        ]
+
+    def stop(self):
+        """ Stops both stages, then verifies and applies the messages left in the pipeline. """
+        gevent.killall(self.greenlets)
+        self.greenlets = []
+
+        while len(self.received) > 0:
+            self.verifying.extend(self.received.get_batch(SIGNATURE_BATCH_SIZE))
+        self._verify(wait_for_room=False)
+        self._queue_updates(self.pending.take())
+        self._apply(yield_between_chunks=False)
+
+    def stats(self) -> Dict[str, int]:
+        return dict(
+            received=self.num_received,
+            queued=len(self.received),
+            dropped=self.received.dropped,
+            pending=len(self.pending),
+            superseded=self.pending.dropped,
+            applied=self.num_applied,
+            rejected=self.num_rejected,
+        )
+
+    def _recover_signers(self, messages: List[Message]) -> List[Optional[Address]]:
+        if self.signature_pool is not None:
+            return self.signature_pool.recover_signers(messages)
+
+        signers: List[Optional[Address]] = []
+        for start in range(0, len(messages), INGESTION_CHUNK_SIZE):
+            if start > 0:
+                gevent.sleep(0)
+            signers.extend(
+                recover_signer(message)
+                for message in messages[start:start + INGESTION_CHUNK_SIZE]
+            )
+        return signers
+
+    def _verify_forever(self):
+        while True:
+            self.verifying.extend(self.received.get_batch(SIGNATURE_BATCH_SIZE))
+            self._verify(wait_for_room=True)
+            if len(self.pending) > 0:
+                self.has_pending.set()
+
+    def _verify(self, wait_for_room: bool):
+        """ Moves the messages in `verifying` with a valid signature to `pending`. With
+        `wait_for_room`, waits for the apply stage while `max_pending` messages are pending. """
+        for signer in self._recover_signers(list(self.verifying)):
+            message = self.verifying[0]
+            if signer is None:
+                self.num_rejected += 1
+                log.debug('Rejected {}: Invalid signature'.format(type(message).__name__))
+                self.verifying.popleft()
+                continue
+
+            key = (
+                type(message),
+                message.token_network_address,
+                message.channel_identifier,
+                signer,
+            )
+            while (
+                wait_for_room and
+                key not in self.pending and
+                len(self.pending) >= self.max_pending
+            ):
+                # wait for the apply stage to take the pending messages
+                self.flushed.clear()
+                self.flush_requested.set()
+                self.has_pending.set()
+                self.flushed.wait()
+            self.pending.put(key, message.nonce, (message, signer))
+            self.verifying.popleft()
+
+    def _apply_forever(self):
+        while True:
+            self.has_pending.wait()
+            # collect messages for the interval, unless the verify stage waits for room
+            self.flush_requested.wait(timeout=self.coalesce_interval)
+            self.flush_requested.clear()
+            self.has_pending.clear()
+            self._queue_updates(self.pending.take())
+            self.flushed.set()
+            self._apply(yield_between_chunks=True)
+
+    def _queue_updates(self, updates: List[Any]):
+        self.applying.extend(
+            updates[start:start + INGESTION_CHUNK_SIZE]
+            for start in range(0, len(updates), INGESTION_CHUNK_SIZE)
+        )
+
+    def _apply(self, yield_between_chunks: bool):
+        """ Applies the chunks in `applying`, oldest first. """
+        while self.applying:
+            chunk = self.applying[0]
+            messages = [message for message, _ in chunk]
+            errors = self.apply_messages(messages, [signer for _, signer in chunk])
+            self.applying.popleft()
+            for message, error in zip(messages, errors):
+                if error is None:
+                    self.num_applied += 1
+                else:
+                    self.num_rejected += 1
+                    log.debug('Rejected {}: {}'.format(type(message).__name__, error))
+            if yield_between_chunks and self.applying:
+                gevent.sleep(0)
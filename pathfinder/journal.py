@@ -0,0 +1,258 @@
+""" Write-ahead journal of the balance proofs and fee updates applied to a token network.
+
+Between two state snapshots, see `pathfinder.model.state_snapshot`, the updates received over
+the transport only exist in memory. The journal appends every applied update as a fixed size
+binary record to a file next to the state snapshot, and replays them on top of the restored
+state on startup.
+
+Appending only queues a record. A single writer greenlet writes everything queued so far with
+one write and one fsync from a thread of the gevent threadpool, so the event loop never waits
+for the disk and the number of fsyncs stays bounded however many updates arrive. The updates
+of the batch being written when the process dies are lost.
+
+Only the latest update of every channel direction is needed for a replay. The journal keeps
+those records in memory and rewrites the file with only them once it grew
+`JOURNAL_COMPACTION_FACTOR` times larger, and after the state was saved.
+
+Updates of channels opened after the state was saved cannot be replayed on startup, the
+blockchain listener reports their `ChannelOpened` event again only later. They are deferred,
+kept in the journal and replayed by `Journal.replay_channel` once the channel is opened.
+"""
+import os
+import struct
+import zlib
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+import gevent
+from gevent.queue import Queue
+from raiden_libs.types import Address
+
+from pathfinder.config import JOURNAL_COMPACTION_FACTOR, JOURNAL_COMPACTION_MIN_RECORDS
+from pathfinder.model import TokenNetwork
+from pathfinder.utils.address import to_checksum_address
+from pathfinder.utils.files import atomic_write
+
+JOURNAL_SUFFIX = '.journal'
+
+# kind, channel id, signer, nonce, transferred amount, locked amount, fee, checksum
+RECORD = struct.Struct('<Bq20sQ32s32sdI')
+BALANCE_RECORD = 0
+FEE_RECORD = 1
+AMOUNT_SIZE = 32
+
+# messages to the writer greenlet besides records
+_COMPACT = 'compact'
+_STOP = 'stop'
+
+
+def journal_path(directory: str, token_network_address: Address) -> str:
+    return os.path.join(directory, token_network_address + JOURNAL_SUFFIX)
+
+
+def encode_record(method: str, args: Tuple) -> Optional[bytes]:
+    """ Encodes the mutation `method(*args)` of a `TokenNetwork`, `None` for mutations not
+    kept in the journal. """
+    if method == 'update_balance':
+        channel_identifier, signer, nonce, transferred_amount, locked_amount = args
+        fields = (
+            BALANCE_RECORD,
+            channel_identifier,
+            bytes.fromhex(signer[2:]),
+            nonce,
+            transferred_amount.to_bytes(AMOUNT_SIZE, 'big'),
+            locked_amount.to_bytes(AMOUNT_SIZE, 'big'),
+            0.0,
+        )
+    elif method == 'update_fee':
+        channel_identifier, signer, nonce, percentage_fee = args
+        fields = (
+            FEE_RECORD,
+            channel_identifier,
+            bytes.fromhex(signer[2:]),
+            nonce,
+            bytes(AMOUNT_SIZE),
+            bytes(AMOUNT_SIZE),
+            percentage_fee,
+        )
+    else:
+        return None
+
+    record = RECORD.pack(*fields, 0)
+    return record[:-4] + struct.pack('<I', zlib.crc32(record[:-4]))
+
+
+def decode_record(record: bytes) -> Tuple[str, Tuple]:
+    """ Returns the mutation encoded by `encode_record`. """
+    (
+        kind,
+        channel_identifier,
+        signer,
+        nonce,
+        transferred_amount,
+        locked_amount,
+        percentage_fee,
+        _,
+    ) = RECORD.unpack(record)
+    signer = to_checksum_address('0x' + signer.hex())
+    if kind == BALANCE_RECORD:
+        return 'update_balance', (
+            channel_identifier,
+            signer,
+            nonce,
+            int.from_bytes(transferred_amount, 'big'),
+            int.from_bytes(locked_amount, 'big'),
+        )
+    return 'update_fee', (channel_identifier, signer, nonce, percentage_fee)
+
+
+def _record_key(record: bytes) -> bytes:
+    """ Kind, channel id and signer, the updates with the same key replace each other. """
+    return record[:29]
+
+
+def read_records(path: str) -> Iterator[bytes]:
+    """ Yields the complete records in the journal at `path`.
+
+    Stops at the first record that is cut off or does not match its checksum, which is where
+    the last write before a crash ended. """
+    with open(path, 'rb') as journal_file:
+        while True:
+            record = journal_file.read(RECORD.size)
+            if len(record) < RECORD.size:
+                return
+            checksum, = struct.unpack_from('<I', record, RECORD.size - 4)
+            if zlib.crc32(record[:-4]) != checksum:
+                return
+            yield record
+
+
+class Journal:
+    """ The journal of a single token network at `path`.
+
+    Replay the existing journal into the network with `replay`, then `start` the writer and
+    register `on_mutation` as a mutation listener of the network. """
+
+    def __init__(
+        self,
+        path: str,
+        compaction_factor: float = JOURNAL_COMPACTION_FACTOR,
+        compaction_min_records: int = JOURNAL_COMPACTION_MIN_RECORDS,
+    ) -> None:
+        self.path = path
+        self.compaction_factor = compaction_factor
+        self.compaction_min_records = compaction_min_records
+        # record key -> latest record, everything a compacted journal has to contain
+        self.latest: Dict[bytes, bytes] = {}
+        # channel id -> record key -> record, for the channels not opened yet, see `replay`
+        self.deferred: Dict[int, Dict[bytes, bytes]] = {}
+        self.num_records = 0
+        self.queue: Queue = Queue()
+        self.journal_file: Optional[BinaryIO] = None
+        self.writer: Optional[gevent.Greenlet] = None
+
+    def replay(self, token_network: TokenNetwork) -> int:
+        """ Applies the updates in the journal to `token_network`, returns how many were new.
+
+        Updates already contained in the restored state are outdated and skipped. Updates of
+        channels unknown to `token_network` are deferred until `replay_channel`. """
+        if not os.path.exists(self.path):
+            return 0
+
+        num_applied = 0
+        for record in read_records(self.path):
+            method, args = decode_record(record)
+            key = _record_key(record)
+            channel_identifier = args[0]
+            if channel_identifier not in token_network.channel_id_to_addresses:
+                self.deferred.setdefault(channel_identifier, {})[key] = record
+                self.latest[key] = record
+                continue
+            try:
+                token_network.apply_mutation(method, args)
+            except (ValueError, KeyError):
+                continue
+            self.latest[key] = record
+            num_applied += 1
+        return num_applied
+
+    def replay_channel(self, token_network: TokenNetwork, channel_identifier: int) -> int:
+        """ Applies the deferred updates of a channel just opened in `token_network`, returns
+        how many were applied. """
+        records = self.deferred.pop(channel_identifier, {})
+        num_applied = 0
+        for key, record in records.items():
+            # applied updates are recorded again by `on_mutation`
+            self.latest.pop(key, None)
+            try:
+                token_network.apply_mutation(*decode_record(record))
+            except (ValueError, KeyError):
+                continue
+            num_applied += 1
+        return num_applied
+
+    def start(self):
+        # the file is rewritten from `latest`, which also drops a partial last record
+        self._rewrite(list(self.latest.values()))
+        self.writer = gevent.spawn(self._write_forever)
+
+    def stop(self):
+        """ Writes all queued records and closes the journal. """
+        if self.writer is None:
+            return
+        self.queue.put(_STOP)
+        self.writer.join()
+        self.writer = None
+
+    def on_mutation(self, method: str, args: Tuple):
+        record = encode_record(method, args)
+        if record is not None:
+            self.latest[_record_key(record)] = record
+            self.queue.put(record)
+
+    def reset(self):
+        """ Empties the journal, after the state of the network was saved. Deferred updates
+        are not part of the state and are kept. """
+        self.latest = {
+            key: record
+            for records in self.deferred.values()
+            for key, record in records.items()
+        }
+        self.queue.put(_COMPACT)
+
+    def _write_forever(self):
+        threadpool = gevent.get_hub().threadpool
+        while True:
+            batch = [self.queue.get()]
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            records = [message for message in batch if isinstance(message, bytes)]
+            if records:
+                threadpool.apply(self._append, (b''.join(records),))
+                self.num_records += len(records)
+
+            if _COMPACT in batch or (
+                self.num_records >= self.compaction_min_records and
+                self.num_records > self.compaction_factor * len(self.latest)
+            ):
+                # records queued from now on are appended to the rewritten journal
+                threadpool.apply(self._rewrite, (list(self.latest.values()),))
+
+            if _STOP in batch:
+                assert self.journal_file is not None
+                self.journal_file.close()
+                return
+
+    def _append(self, data: bytes):
+        assert self.journal_file is not None
+        self.journal_file.write(data)
+        self.journal_file.flush()
+        os.fsync(self.journal_file.fileno())
+
+    def _rewrite(self, records: List[bytes]):
+        if self.journal_file is not None:
+            self.journal_file.close()
+        with atomic_write(self.path) as journal_file:
+            journal_file.write(b''.join(records))
+        self.journal_file = open(self.path, 'ab')
+        self.num_records = len(records)
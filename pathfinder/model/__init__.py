@@ -1,7 +1,9 @@
 from .channel_view import ChannelView
+from .csr_graph import CSRGraph
 from .token_network import TokenNetwork
 
 __all__ = [
     'ChannelView',
+    'CSRGraph',
     'TokenNetwork',
 ]
@@ -1,15 +1,31 @@
 from enum import Enum
 
-from eth_utils import is_checksum_address
 from raiden_libs.types import Address, ChannelIdentifier
 
 from pathfinder.config import DEFAULT_PERCENTAGE_FEE
+from pathfinder.utils.address import is_checksum_address
 
 
 class ChannelView:
     """
     Unidirectional view of a bidirectional channel.
     """
+    # two views per channel are kept in memory, avoid a `__dict__` for each
+    __slots__ = (
+        'self',
+        'partner',
+        '_deposit',
+        '_transferred_amount',
+        '_received_amount',
+        '_locked_amount',
+        '_percentage_fee',
+        '_capacity',
+        'state',
+        'channel_id',
+        'balance_proof_nonce',
+        'fee_info_nonce',
+    )
+
     class State(Enum):
         OPEN = 1,
         SETTLING = 2,
@@ -60,9 +76,9 @@ class ChannelView:
         if locked_amount is not None:
             self._locked_amount = locked_amount
 
-        self._capacity = self.deposit - (
-            self.transferred_amount + self.locked_amount
-        ) + self.received_amount
+        self._capacity = self._deposit - (
+            self._transferred_amount + self._locked_amount
+        ) + self._received_amount
 
     def update_fee(self, nonce: int = None, percentage_fee: float = None):
         if nonce is not None:
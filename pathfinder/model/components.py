@@ -0,0 +1,59 @@
+from typing import Dict, Iterable, Optional, Tuple
+
+from raiden_libs.types import Address
+
+
+class ComponentIndex:
+    """ Union-find over the channel graph, answers whether two nodes can be connected at all.
+
+    Channels always connect both directions, so the weakly connected components are tracked.
+    Opening a channel merges two components in place. Closing one can split a component,
+    which union-find cannot express, so the index is only marked stale and rebuilt from the
+    open channels on the next lookup.
+    """
+
+    def __init__(self) -> None:
+        self.parents: Dict[Address, Address] = {}
+        self.sizes: Dict[Address, int] = {}
+        self.stale = False
+
+    def find(self, node: Address) -> Optional[Address]:
+        """ Returns the representative of the component of `node`, `None` if it has no
+        channels. """
+        parents = self.parents
+        if node not in parents:
+            return None
+
+        while parents[node] != node:
+            # path halving
+            parents[node] = parents[parents[node]]
+            node = parents[node]
+        return node
+
+    def union(self, node1: Address, node2: Address):
+        for node in (node1, node2):
+            if node not in self.parents:
+                self.parents[node] = node
+                self.sizes[node] = 1
+
+        root1, root2 = self.find(node1), self.find(node2)
+        if root1 == root2:
+            return
+        if self.sizes[root1] < self.sizes[root2]:
+            root1, root2 = root2, root1
+        self.parents[root2] = root1
+        self.sizes[root1] += self.sizes.pop(root2)
+
+    def connected(self, node1: Address, node2: Address) -> bool:
+        root = self.find(node1)
+        return root is not None and root == self.find(node2)
+
+    def invalidate(self):
+        self.stale = True
+
+    def build(self, channels: Iterable[Tuple[Address, Address]]):
+        self.parents = {}
+        self.sizes = {}
+        for participant1, participant2 in channels:
+            self.union(participant1, participant2)
+        self.stale = False
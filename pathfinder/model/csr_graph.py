@@ -0,0 +1,447 @@
+import heapq
+from itertools import count
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from networkx.exception import NetworkXError, NetworkXNoPath, NodeNotFound
+from raiden_libs.types import Address
+
+from pathfinder.config import CSR_COMPACTION_MIN_EDGES, CSR_COMPACTION_THRESHOLD
+from pathfinder.model.channel_view import ChannelView
+from pathfinder.utils.address import AddressTable
+
+# Capacities are stored as int64. Token amounts are uint256, so larger values are clipped in
+# the array and kept exactly in a side table.
+CAPACITY_MAX = np.iinfo(np.int64).max
+CAPACITY_MIN = np.iinfo(np.int64).min
+
+INITIAL_EDGE_SLOTS = 64
+
+
+class _Adjacency:
+    """ Read-only `G[u]` view that resolves `G[u][v]['view']` like a networkx DiGraph. """
+
+    def __init__(self, graph: 'CSRGraph', node: int) -> None:
+        self._graph = graph
+        self._node = node
+
+    def __getitem__(self, partner: Address) -> Dict[str, ChannelView]:
+        edge = self._graph._edge_id(self._node, self._graph.node_table.ids.get(partner, -1))
+        if edge is None:
+            raise KeyError(partner)
+        return {'view': self._graph._views[edge]}
+
+    def __contains__(self, partner: Address) -> bool:
+        node_ids = self._graph.node_table.ids
+        return self._graph._edge_id(self._node, node_ids.get(partner, -1)) is not None
+
+    def __iter__(self) -> Iterator[Address]:
+        addresses = self._graph.node_table.addresses
+        targets = self._graph.targets
+        return (addresses[targets[edge]] for edge in self._graph.out_edges(self._node))
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self._graph.out_edges(self._node))
+
+
+class CSRGraph:
+    """ Directed channel graph stored in contiguous NumPy arrays.
+
+    Node addresses are interned to consecutive integer ids by an `AddressTable` and every
+    directed edge occupies a slot in the edge arrays (`sources`, `targets`, `capacities`,
+    `fees`, `channel_ids`, `reverse`). Outgoing edges are indexed in compressed sparse row
+    form. Edges added since the last compaction are kept in a per-node overlay and removed
+    edges are only flagged as dead, so mutations stay cheap. Once the overlay and the dead
+    slots exceed `CSR_COMPACTION_THRESHOLD` of the graph, the arrays are compacted and the CSR
+    index is rebuilt.
+
+    Neighbours are always visited in edge insertion order, which is the order a
+    `networkx.DiGraph` uses. Searches on both backends therefore break ties identically.
+
+    The class implements the small part of the `DiGraph` interface used by `TokenNetwork`, so
+    `G[u][v]['view']` works for both backends. After changing a `ChannelView`, call
+    `update_edge` to copy its capacity and fee into the arrays.
+    """
+
+    def __init__(
+        self,
+        compaction_threshold: float = CSR_COMPACTION_THRESHOLD,
+        compaction_min_edges: int = CSR_COMPACTION_MIN_EDGES,
+    ) -> None:
+        self.compaction_threshold = compaction_threshold
+        self.compaction_min_edges = compaction_min_edges
+
+        self.node_table = AddressTable()
+
+        # (source id << 32 | target id) -> edge slot
+        self._edge_ids: Dict[int, int] = dict()
+        self._views: List[ChannelView] = []
+        self._large_capacities: Dict[int, int] = dict()
+        self._num_slots = 0
+        self._num_dead = 0
+
+        self.sources = np.zeros(INITIAL_EDGE_SLOTS, dtype=np.int32)
+        self.targets = np.zeros(INITIAL_EDGE_SLOTS, dtype=np.int32)
+        self.capacities = np.zeros(INITIAL_EDGE_SLOTS, dtype=np.int64)
+        self.fees = np.zeros(INITIAL_EDGE_SLOTS, dtype=np.float64)
+        self.channel_ids = np.zeros(INITIAL_EDGE_SLOTS, dtype=np.int64)
+        self.reverse = np.full(INITIAL_EDGE_SLOTS, -1, dtype=np.int64)
+        self.alive = np.zeros(INITIAL_EDGE_SLOTS, dtype=np.bool_)
+
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.zeros(0, dtype=np.int64)
+        self._overlay: Dict[int, List[int]] = dict()
+        self._overlay_size = 0
+        # plain list copies of indptr, indices, targets and alive for `dijkstra_path_weights`
+        self._search_lists: Optional[
+            Tuple[List[int], List[int], List[int], List[bool]]
+        ] = None
+
+    #
+    # networkx.DiGraph compatible interface
+    #
+
+    def __getitem__(self, node: Address) -> _Adjacency:
+        return _Adjacency(self, self.node_table.ids[node])
+
+    def __contains__(self, node: Address) -> bool:
+        return node in self.node_table
+
+    def __len__(self) -> int:
+        return len(self.node_table)
+
+    @property
+    def nodes(self) -> List[Address]:
+        return list(self.node_table.addresses)
+
+    def number_of_nodes(self) -> int:
+        return len(self.node_table)
+
+    def number_of_edges(self) -> int:
+        return self._num_slots - self._num_dead
+
+    def has_edge(self, u: Address, v: Address) -> bool:
+        node_ids = self.node_table.ids
+        return self._edge_id(node_ids.get(u, -1), node_ids.get(v, -1)) is not None
+
+    def edges(self, data: bool = False) -> Iterator[Tuple]:
+        for edge in np.flatnonzero(self.alive[:self._num_slots]):
+            u = self.node_table.addresses[self.sources[edge]]
+            v = self.node_table.addresses[self.targets[edge]]
+            if data:
+                yield u, v, {'view': self._views[edge]}
+            else:
+                yield u, v
+
+    def add_edge(self, u: Address, v: Address, view: ChannelView) -> None:
+        """ Adds the directed edge `u -> v` or replaces the view of an existing one. """
+        source = self.add_node(u)
+        target = self.add_node(v)
+
+        edge = self._edge_id(source, target)
+        if edge is None:
+            edge = self._allocate_slot(view)
+            self._edge_ids[self._edge_key(source, target)] = edge
+            self.sources[edge] = source
+            self.targets[edge] = target
+            self.alive[edge] = True
+            self._overlay.setdefault(source, []).append(edge)
+            self._overlay_size += 1
+            self._search_lists = None
+
+            reverse_edge = self._edge_id(target, source)
+            if reverse_edge is not None:
+                self.reverse[edge] = reverse_edge
+                self.reverse[reverse_edge] = edge
+
+        self._views[edge] = view
+        self._write_edge(edge, view)
+        self._maybe_compact()
+
+    def remove_edge(self, u: Address, v: Address) -> None:
+        """ Flags the edge `u -> v` as dead. """
+        edge = self._edge_id(self.node_table.ids.get(u, -1), self.node_table.ids.get(v, -1))
+        if edge is None:
+            raise NetworkXError('The edge {}-{} not in graph.'.format(u, v))
+        del self._edge_ids[self._edge_key(self.node_table.ids[u], self.node_table.ids[v])]
+
+        self.alive[edge] = False
+        self._large_capacities.pop(edge, None)
+        self._search_lists = None
+        reverse_edge = self.reverse[edge]
+        if reverse_edge >= 0:
+            self.reverse[reverse_edge] = -1
+            self.reverse[edge] = -1
+        self._num_dead += 1
+        self._maybe_compact()
+
+    #
+    # array interface
+    #
+
+    def add_node(self, node: Address) -> int:
+        """ Returns the integer id of `node`, interning it if necessary. """
+        return self.node_table.intern(node)
+
+    def node_id(self, node: Address) -> int:
+        return self.node_table.ids[node]
+
+    def address(self, node_id: int) -> Address:
+        return self.node_table.address(node_id)
+
+    def edge_id(self, u: Address, v: Address) -> int:
+        edge = self._edge_id(self.node_table.ids[u], self.node_table.ids[v])
+        if edge is None:
+            raise KeyError((u, v))
+        return edge
+
+    def update_edge(self, u: Address, v: Address) -> None:
+        """ Copies capacity and fee of the view on `u -> v` into the arrays. """
+        edge = self.edge_id(u, v)
+        self._write_edge(edge, self._views[edge])
+
+    def capacity(self, edge: int) -> int:
+        """ Returns the exact capacity of an edge, including values beyond int64. """
+        capacity = int(self.capacities[edge])
+        if capacity == CAPACITY_MAX or capacity == CAPACITY_MIN:
+            return self._large_capacities.get(edge, capacity)
+        return capacity
+
+    def out_edges(self, node: int) -> Iterator[int]:
+        """ Yields the live outgoing edge slots of `node` in insertion order. """
+        alive = self.alive
+        if node + 1 < len(self.indptr):
+            start, end = self.indptr.item(node), self.indptr.item(node + 1)
+            for edge in self.indices[start:end].tolist():
+                if alive.item(edge):
+                    yield edge
+        for edge in self._overlay.get(node, ()):
+            if alive.item(edge):
+                yield edge
+
+    def dijkstra_path(
+        self,
+        source: Address,
+        target: Address,
+        weight: Callable[[int], Optional[float]],
+    ) -> List[Address]:
+        """ Returns the shortest path from `source` to `target`.
+
+        `weight` maps an edge slot to its cost, `None` hides the edge. Mirrors
+        `networkx.dijkstra_path`, including its tie breaking and exceptions. """
+
+        if source not in self.node_table.ids:
+            raise NodeNotFound('Node {} not found in graph'.format(source))
+
+        source_id = self.node_table.ids[source]
+        target_id = self.node_table.ids.get(target, -1)
+        targets = self.targets
+
+        dist: Dict[int, float] = {}
+        seen: Dict[int, float] = {source_id: 0}
+        paths: Dict[int, List[int]] = {source_id: [source_id]}
+        counter = count()
+        fringe: List[Tuple[float, int, int]] = [(0, next(counter), source_id)]
+        while fringe:
+            d, _, node = heapq.heappop(fringe)
+            if node in dist:
+                continue
+            dist[node] = d
+            if node == target_id:
+                break
+            for edge in self.out_edges(node):
+                cost = weight(edge)
+                if cost is None:
+                    continue
+                partner = targets.item(edge)
+                partner_dist = d + cost
+                if partner in dist:
+                    continue
+                if partner not in seen or partner_dist < seen[partner]:
+                    seen[partner] = partner_dist
+                    heapq.heappush(fringe, (partner_dist, next(counter), partner))
+                    paths[partner] = paths[node] + [partner]
+
+        if target_id not in paths:
+            raise NetworkXNoPath('No path to {}.'.format(target))
+        return [self.node_table.addresses[node] for node in paths[target_id]]
+
+    def weight_array(self, value: int, offset: float, fee_factor: float) -> np.ndarray:
+        """ Returns `offset + fee_factor * fee` for every edge slot, or `inf` for dead edges and
+        edges with a capacity below `value`. """
+
+        num_slots = self._num_slots
+        weights = offset + fee_factor * self.fees[:num_slots]
+
+        if value > CAPACITY_MAX:
+            too_small = np.ones(num_slots, dtype=np.bool_)
+        elif value < CAPACITY_MIN:
+            too_small = np.zeros(num_slots, dtype=np.bool_)
+        else:
+            too_small = self.capacities[:num_slots] < value
+        for edge, capacity in self._large_capacities.items():
+            too_small[edge] = capacity < value
+        too_small |= ~self.alive[:num_slots]
+
+        weights[too_small] = np.inf
+        return weights
+
+    def dijkstra_path_weights(
+        self,
+        source: Address,
+        target: Address,
+        weights: List[float],
+    ) -> List[Address]:
+        """ Same as `dijkstra_path`, but the edge costs are looked up in `weights`, typically
+        built by `weight_array`. A weight of `inf` hides the edge, dead edges are skipped even
+        if `weights` was built before they were removed.
+
+        Weights are read from a plain list, which is much cheaper per element than a callback
+        or NumPy scalar access, and can be updated in place between searches. """
+
+        if source not in self.node_table:
+            raise NodeNotFound('Node {} not found in graph'.format(source))
+
+        source_id = self.node_table.ids[source]
+        target_id = self.node_table.ids.get(target, -1)
+        indptr, indices, targets, alive = self._search_sequences()
+        num_indexed = len(indptr) - 1
+        overlay = self._overlay
+        inf = float('inf')
+
+        dist: Dict[int, float] = {}
+        seen: Dict[int, float] = {source_id: 0}
+        paths: Dict[int, List[int]] = {source_id: [source_id]}
+        counter = count()
+        fringe: List[Tuple[float, int, int]] = [(0, next(counter), source_id)]
+        while fringe:
+            d, _, node = heapq.heappop(fringe)
+            if node in dist:
+                continue
+            dist[node] = d
+            if node == target_id:
+                break
+
+            edges = indices[indptr[node]:indptr[node + 1]] if node < num_indexed else []
+            if node in overlay:
+                edges = list(edges) + overlay[node]
+            for edge in edges:
+                cost = weights[edge]
+                if cost == inf or not alive[edge]:
+                    continue
+                partner = targets[edge]
+                if partner in dist:
+                    continue
+                partner_dist = d + cost
+                if partner not in seen or partner_dist < seen[partner]:
+                    seen[partner] = partner_dist
+                    heapq.heappush(fringe, (partner_dist, next(counter), partner))
+                    paths[partner] = paths[node] + [partner]
+
+        if target_id not in paths:
+            raise NetworkXNoPath('No path to {}.'.format(target))
+        return [self.node_table.addresses[node] for node in paths[target_id]]
+
+    def compact(self) -> None:
+        """ Drops dead edge slots, merges the overlay and rebuilds the CSR index. """
+        live = np.flatnonzero(self.alive[:self._num_slots])
+        num_live = len(live)
+
+        remap = np.full(self._num_slots, -1, dtype=np.int64)
+        remap[live] = np.arange(num_live)
+
+        for name in ('sources', 'targets', 'capacities', 'fees', 'channel_ids', 'alive'):
+            array = getattr(self, name)
+            array[:num_live] = array[live]
+        reverse = self.reverse[live]
+        self.reverse[:num_live] = np.where(reverse >= 0, remap[reverse], -1)
+        self.alive[num_live:self._num_slots] = False
+        self.reverse[num_live:self._num_slots] = -1
+
+        self._views = [self._views[edge] for edge in live]
+        self._large_capacities = {
+            int(remap[edge]): capacity for edge, capacity in self._large_capacities.items()
+        }
+        self._edge_ids = {
+            self._edge_key(source, target): edge
+            for edge, (source, target) in enumerate(zip(
+                self.sources[:num_live].tolist(),
+                self.targets[:num_live].tolist(),
+            ))
+        }
+        self._num_slots = num_live
+        self._num_dead = 0
+
+        # live slots are ordered by insertion, a stable sort keeps that order per node
+        sources = self.sources[:num_live]
+        self.indices = np.argsort(sources, kind='stable').astype(np.int64)
+        self.indptr = np.zeros(len(self.node_table) + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(sources, minlength=len(self.node_table)),
+            out=self.indptr[1:]
+        )
+        self._overlay = dict()
+        self._overlay_size = 0
+        self._search_lists = None
+
+    #
+    # internals
+    #
+
+    def _search_sequences(
+        self,
+    ) -> Tuple[Sequence[int], Sequence[int], Sequence[int], Sequence[bool]]:
+        """ `indptr`, `indices`, `targets` and `alive` as plain lists, which are much cheaper
+        per element than the arrays, kept until the topology changes. """
+        if self._search_lists is None:
+            self._search_lists = (
+                self.indptr.tolist(),
+                self.indices.tolist(),
+                self.targets[:self._num_slots].tolist(),
+                self.alive[:self._num_slots].tolist(),
+            )
+        return self._search_lists
+
+    @staticmethod
+    def _edge_key(source: int, target: int) -> int:
+        return (source << 32) | target
+
+    def _edge_id(self, source: int, target: int) -> Optional[int]:
+        if source < 0 or target < 0:
+            return None
+        return self._edge_ids.get(self._edge_key(source, target))
+
+    def _write_edge(self, edge: int, view: ChannelView) -> None:
+        capacity = view.capacity
+        if CAPACITY_MIN < capacity < CAPACITY_MAX:
+            self.capacities[edge] = capacity
+            self._large_capacities.pop(edge, None)
+        else:
+            self.capacities[edge] = CAPACITY_MAX if capacity > 0 else CAPACITY_MIN
+            self._large_capacities[edge] = capacity
+        self.fees[edge] = view.percentage_fee
+        self.channel_ids[edge] = view.channel_id
+
+    def _allocate_slot(self, view: ChannelView) -> int:
+        if self._num_slots == len(self.sources):
+            self._grow(2 * len(self.sources))
+        self._views.append(view)
+        edge = self._num_slots
+        self._num_slots += 1
+        return edge
+
+    def _grow(self, size: int) -> None:
+        for name in ('sources', 'targets', 'capacities', 'fees', 'channel_ids', 'alive'):
+            array = getattr(self, name)
+            grown = np.zeros(size, dtype=array.dtype)
+            grown[:len(array)] = array
+            setattr(self, name, grown)
+        reverse = np.full(size, -1, dtype=np.int64)
+        reverse[:len(self.reverse)] = self.reverse
+        self.reverse = reverse
+
+    def _maybe_compact(self) -> None:
+        pending = self._overlay_size + self._num_dead
+        size = max(self.compaction_min_edges, self._num_slots - self._num_dead)
+        if pending > self.compaction_threshold * size:
+            self.compact()
@@ -0,0 +1,56 @@
+import heapq
+from typing import Dict, Hashable, List, Tuple
+
+
+class MaxFeeIndex:
+    """ Tracks the maximum of a set of keyed fees with a lazy deletion heap.
+
+    Updates and removals only touch the `fees` dict and push to the heap, outdated heap entries
+    are dropped once they surface at the top. `max` is amortized O(log n). The heap is rebuilt
+    when outdated entries dominate it, so a single flapping fee cannot grow it unboundedly.
+    """
+
+    def __init__(self) -> None:
+        self.fees: Dict[Hashable, float] = {}
+        self.heap: List[Tuple[float, int, Hashable]] = []
+        self.counter = 0
+
+    def __len__(self) -> int:
+        return len(self.fees)
+
+    def update(self, key: Hashable, fee: float):
+        if self.fees.get(key) == fee:
+            return
+        self.fees[key] = fee
+        self.counter += 1
+        heapq.heappush(self.heap, (-fee, self.counter, key))
+        self._maybe_rebuild()
+
+    def reset(self, fees: Dict[Hashable, float]):
+        """ Replaces all fees at once, in linear time. """
+        self.fees = dict(fees)
+        self._rebuild()
+
+    def remove(self, key: Hashable):
+        if self.fees.pop(key, None) is not None:
+            self._maybe_rebuild()
+
+    def max(self, default: float = 0.0) -> float:
+        heap = self.heap
+        while heap:
+            negative_fee, _, key = heap[0]
+            if self.fees.get(key) == -negative_fee:
+                # entries matching the current fee of their key are valid, even if they
+                # predate a later update back to the same fee
+                return -negative_fee
+            heapq.heappop(heap)
+        return default
+
+    def _maybe_rebuild(self):
+        if len(self.heap) > 2 * len(self.fees) + 64:
+            self._rebuild()
+
+    def _rebuild(self):
+        self.heap = [(-fee, i, key) for i, (key, fee) in enumerate(self.fees.items())]
+        self.counter = len(self.heap)
+        heapq.heapify(self.heap)
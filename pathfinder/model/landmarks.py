@@ -0,0 +1,88 @@
+from typing import Callable, Dict, Iterable, List, Optional
+
+from pathfinder.config import LANDMARK_MAX_SLACK
+from pathfinder.model.search import Adjacency, Node, shortest_path_tree
+
+
+class LandmarkIndex:
+    """ Landmark distance tables for goal directed A* searches (ALT).
+
+    For a few landmarks `L` the fee distances `d(L, v)` and `d(v, L)` to and from every node are
+    stored. By the triangle inequality `d(v, t) >= d(v, L) - d(t, L)` and
+    `d(v, t) >= d(L, t) - d(L, v)`, which gives an admissible heuristic for any target `t`.
+
+    The tables are computed on the plain percentage fees without any capacity restriction.
+    Routing weights blend in the hop bias and diversity penalties, which only ever add cost,
+    so the bounds hold for every query after scaling with `1 - hop_bias`.
+
+    Closing channels and raising fees only makes paths more expensive and keeps the tables
+    admissible. A lowered fee can shorten any path by at most the decrease, so decreases are
+    summed up in `slack` and subtracted from every bound. New channels can shorten paths
+    arbitrarily, they mark the tables stale. Stale tables, or a slack above `max_slack`, are
+    recomputed lazily before the next search.
+    """
+
+    def __init__(self, num_landmarks: int, max_slack: float = LANDMARK_MAX_SLACK) -> None:
+        self.num_landmarks = num_landmarks
+        self.max_slack = max_slack
+
+        self.landmarks: List[Node] = []
+        self.from_landmark: List[Dict[Node, float]] = []
+        self.to_landmark: List[Dict[Node, float]] = []
+        self.slack = 0.0
+        self.stale = True
+
+    @property
+    def needs_refresh(self) -> bool:
+        return self.stale or self.slack > self.max_slack
+
+    def invalidate(self):
+        self.stale = True
+
+    def fee_lowered(self, decrease: float):
+        self.slack += decrease
+
+    def build(self, nodes: Iterable[Node], successors: Adjacency, predecessors: Adjacency):
+        """ Picks the highest degree nodes as landmarks and computes their distance tables.
+
+        `successors` and `predecessors` must yield the plain percentage fee of every edge. """
+
+        degrees = {node: sum(1 for _ in successors(node)) for node in nodes}
+        self.landmarks = sorted(degrees, key=lambda node: -degrees[node])[:self.num_landmarks]
+        self.from_landmark = [
+            shortest_path_tree(successors, landmark)[0] for landmark in self.landmarks
+        ]
+        self.to_landmark = [
+            shortest_path_tree(predecessors, landmark)[0] for landmark in self.landmarks
+        ]
+        self.slack = 0.0
+        self.stale = False
+
+    def heuristic(self, target: Node, scale: float = 1.0) -> Callable[[Node], Optional[float]]:
+        """ Returns a lower bound function for the distance to `target`, multiplied by
+        `scale`. Bounds are memoized, the function is meant to be reused by all searches of a
+        single query. """
+
+        bounds = [
+            (to_landmark, from_landmark, to_landmark.get(target), from_landmark.get(target))
+            for to_landmark, from_landmark in zip(self.to_landmark, self.from_landmark)
+        ]
+        slack = self.slack
+        memo: Dict[Node, float] = {}
+
+        def lower_bound(node: Node) -> float:
+            if node in memo:
+                return memo[node]
+
+            best = 0.0
+            for to_landmark, from_landmark, target_to_landmark, landmark_to_target in bounds:
+                node_to_landmark = to_landmark.get(node)
+                if node_to_landmark is not None and target_to_landmark is not None:
+                    best = max(best, node_to_landmark - target_to_landmark)
+                landmark_to_node = from_landmark.get(node)
+                if landmark_to_node is not None and landmark_to_target is not None:
+                    best = max(best, landmark_to_target - landmark_to_node)
+            memo[node] = max(0.0, best - slack) * scale
+            return memo[node]
+
+        return lower_bound
@@ -0,0 +1,110 @@
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, List, NamedTuple, Optional, Set
+
+from raiden_libs.types import ChannelIdentifier
+
+from pathfinder.config import PATH_CACHE_SIZE_DEFAULT
+
+
+class CacheEntry(NamedTuple):
+    result: List[Dict[str, Any]]
+    channel_ids: frozenset
+    max_percentage_fee: float
+
+
+class PathCache:
+    """ Bounded LRU cache of `TokenNetwork.get_paths` results.
+
+    Every entry records the channels of its paths and the `max_percentage_fee` it was computed
+    with. Changes to one of these channels drop the entry, so the returned paths and fees are
+    always current. Improvements of channels outside of the cached paths, like a lowered fee,
+    are not tracked and can leave a cheaper path unused until the entry is dropped. New
+    channels clear the whole cache.
+    """
+
+    def __init__(self, max_entries: int = PATH_CACHE_SIZE_DEFAULT) -> None:
+        self.max_entries = max_entries
+        self.entries: 'OrderedDict[Hashable, CacheEntry]' = OrderedDict()
+        self.keys_by_channel: Dict[ChannelIdentifier, Set[Hashable]] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: Hashable, max_percentage_fee: float) -> Optional[List[Dict[str, Any]]]:
+        entry = self.entries.get(key)
+        if entry is not None and entry.max_percentage_fee != max_percentage_fee:
+            # the hop bias weights all channels by the maximum fee
+            self._remove(key)
+            self.invalidations += 1
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return _copy_result(entry.result)
+
+    def put(
+        self,
+        key: Hashable,
+        result: List[Dict[str, Any]],
+        channel_ids: Iterable[ChannelIdentifier],
+        max_percentage_fee: float,
+    ):
+        if self.max_entries <= 0:
+            return
+
+        if key in self.entries:
+            self._remove(key)
+        entry = CacheEntry(_copy_result(result), frozenset(channel_ids), max_percentage_fee)
+        self.entries[key] = entry
+        for channel_id in entry.channel_ids:
+            self.keys_by_channel.setdefault(channel_id, set()).add(key)
+
+        while len(self.entries) > self.max_entries:
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def invalidate_channel(self, channel_id: ChannelIdentifier):
+        """ Drops all entries with a path through the given channel. """
+        for key in self.keys_by_channel.pop(channel_id, ()):
+            self._remove(key)
+            self.invalidations += 1
+
+    def clear(self):
+        self.invalidations += len(self.entries)
+        self.entries.clear()
+        self.keys_by_channel.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return dict(
+            size=len(self.entries),
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            invalidations=self.invalidations,
+        )
+
+    def _remove(self, key: Hashable):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+
+        for channel_id in entry.channel_ids:
+            keys = self.keys_by_channel.get(channel_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.keys_by_channel[channel_id]
+
+
+def _copy_result(result: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """ Callers own the returned paths, so the cache never hands out its own lists. """
+    return [dict(path, path=list(path['path'])) for path in result]
@@ -0,0 +1,197 @@
+""" Backend independent shortest path searches.
+
+Graphs are described by adjacency functions, so the same code runs on the networkx and on the
+CSR backend: `successors(node)` yields `(neighbour, edge, weight)` triples for the outgoing
+edges of `node` and `predecessors(node)` does the same for the incoming ones. `edge` is an
+opaque handle that is passed back to the caller, a weight of `None` hides the edge.
+"""
+import heapq
+from itertools import count
+from typing import (
+    AbstractSet,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+Node = Any
+Edge = Any
+Adjacency = Callable[[Node], Iterable[Tuple[Node, Edge, Optional[float]]]]
+# nodes, edges and the accumulated cost at every node of a path
+Path = Tuple[List[Node], List[Edge], List[float]]
+# distances and (parent, edge, weight) of every reached node, see `shortest_path_tree`
+SearchTree = Tuple[Dict[Node, float], Dict[Node, Tuple[Node, Edge, float]]]
+
+
+def shortest_path_tree(adjacency: Adjacency, root: Node) -> SearchTree:
+    """ Runs Dijkstra from `root` over the whole graph.
+
+    Returns the distances of all reached nodes and, for every node except `root`, its parent,
+    the edge leading there and its weight. With `predecessors` as adjacency this is the reverse
+    tree, i.e. the distances *to* `root` and the next hop towards it. """
+
+    dist: Dict[Node, float] = {}
+    parents: Dict[Node, Tuple[Node, Edge, float]] = {}
+    seen: Dict[Node, float] = {root: 0}
+    counter = count()
+    fringe: List[Tuple[float, int, Node]] = [(0, next(counter), root)]
+    while fringe:
+        d, _, node = heapq.heappop(fringe)
+        if node in dist:
+            continue
+        dist[node] = d
+        for neighbour, edge, weight in adjacency(node):
+            if weight is None or neighbour in dist:
+                continue
+            neighbour_dist = d + weight
+            if neighbour not in seen or neighbour_dist < seen[neighbour]:
+                seen[neighbour] = neighbour_dist
+                parents[neighbour] = (node, edge, weight)
+                heapq.heappush(fringe, (neighbour_dist, next(counter), neighbour))
+
+    return dist, parents
+
+
+def astar_path(
+    successors: Adjacency,
+    source: Node,
+    target: Node,
+    heuristic: Callable[[Node], Optional[float]],
+    ignore_nodes: AbstractSet[Node] = frozenset(),
+    ignore_edges: AbstractSet[Tuple[Node, Node]] = frozenset(),
+    offset: float = 0,
+) -> Optional[Path]:
+    """ Goal directed search from `source` to `target`.
+
+    `heuristic` must return a lower bound for the distance to `target`, or `None` for nodes
+    that cannot reach it. Nodes in `ignore_nodes` and `(u, v)` pairs in `ignore_edges` are
+    skipped. Costs in the returned path start at `offset`. Returns `None` if there is no
+    path. """
+
+    if heuristic(source) is None:
+        return None
+
+    # Nodes are reopened when a cheaper way to them shows up, so an admissible heuristic is
+    # sufficient, it does not need to be consistent.
+    seen: Dict[Node, float] = {source: offset}
+    parents: Dict[Node, Tuple[Node, Edge]] = {}
+    counter = count()
+    fringe: List[Tuple[float, int, Node, float]] = [(offset, next(counter), source, offset)]
+    while fringe:
+        _, _, node, d = heapq.heappop(fringe)
+        if d > seen[node]:
+            continue
+        if node == target:
+            nodes, edges = [node], []
+            while node != source:
+                node, edge = parents[node]
+                nodes.append(node)
+                edges.append(edge)
+            nodes.reverse()
+            edges.reverse()
+            return nodes, edges, [seen[node] for node in nodes]
+
+        for neighbour, edge, weight in successors(node):
+            if weight is None or neighbour in ignore_nodes:
+                continue
+            if (node, neighbour) in ignore_edges:
+                continue
+            neighbour_dist = d + weight
+            if neighbour in seen and neighbour_dist >= seen[neighbour]:
+                continue
+            estimate = heuristic(neighbour)
+            if estimate is None:
+                continue
+            seen[neighbour] = neighbour_dist
+            parents[neighbour] = (node, edge)
+            heapq.heappush(
+                fringe,
+                (neighbour_dist + estimate, next(counter), neighbour, neighbour_dist)
+            )
+
+    return None
+
+
+def k_shortest_paths(
+    successors: Adjacency,
+    predecessors: Adjacency,
+    source: Node,
+    target: Node,
+    reverse_tree: Optional[SearchTree] = None,
+) -> Iterator[Path]:
+    """ Yields the loopless paths from `source` to `target` in order of increasing cost.
+
+    This is Yen's algorithm with two refinements:
+    - One reverse shortest path tree towards `target` is computed up front. It yields the first
+      path and its exact distances drive every spur search as an A* heuristic, which stays
+      admissible because spur searches only ever remove nodes and edges.
+    - Following Lawler, a path is only spurred from its deviation node onwards, the spur
+      searches along the shared root prefix were already done for its parent. Root prefix
+      costs are carried along instead of being recomputed.
+
+    `reverse_tree` can pass in `shortest_path_tree(predecessors, target)` when it is shared
+    between several queries. """
+
+    if reverse_tree is None:
+        reverse_tree = shortest_path_tree(predecessors, target)
+    to_target, next_hops = reverse_tree
+    if source not in to_target:
+        return
+
+    nodes, edges, costs = [source], [], [0.0]
+    while nodes[-1] != target:
+        node, edge, weight = next_hops[nodes[-1]]
+        nodes.append(node)
+        edges.append(edge)
+        costs.append(costs[-1] + weight)
+
+    counter = count()
+    candidates: List[Tuple[float, int, Path, int]] = []
+    known: Set[Tuple[Node, ...]] = {tuple(nodes)}
+    # root prefix -> next nodes already taken by yielded paths with this root
+    used_branches: Dict[Tuple[Node, ...], Set[Node]] = {}
+
+    path, deviation = (nodes, edges, costs), 0
+    while True:
+        yield path
+        nodes, edges, costs = path
+
+        for i in range(len(nodes) - 1):
+            used_branches.setdefault(tuple(nodes[:i + 1]), set()).add(nodes[i + 1])
+
+        for i in range(deviation, len(nodes) - 1):
+            root = tuple(nodes[:i + 1])
+            spur = astar_path(
+                successors,
+                nodes[i],
+                target,
+                to_target.get,
+                ignore_nodes=set(root[:-1]),
+                ignore_edges={(nodes[i], branch) for branch in used_branches[root]},
+                offset=costs[i],
+            )
+            if spur is None:
+                continue
+
+            spur_nodes, spur_edges, spur_costs = spur
+            candidate = nodes[:i] + spur_nodes
+            key = tuple(candidate)
+            if key in known:
+                continue
+            known.add(key)
+            heapq.heappush(candidates, (
+                spur_costs[-1],
+                next(counter),
+                (candidate, edges[:i] + spur_edges, costs[:i] + spur_costs),
+                i,
+            ))
+
+        if not candidates:
+            return
+        _, _, path, deviation = heapq.heappop(candidates)
@@ -0,0 +1,369 @@
+""" Immutable, versioned graph snapshots for read-only processes.
+
+A snapshot file holds the topology of a token network in compressed sparse row form together
+with the capacity, fee and channel id of every channel direction. Readers map the file and use
+the arrays in place, so any number of processes can answer path queries from one copy of the
+graph in the page cache.
+
+Snapshots are written with `atomic_write`, which renames a new file over the previous one.
+Readers still holding an older version keep using it until they switch to the new file, see
+`SnapshotReader`. The writer yields to other greenlets after every `SNAPSHOT_CHUNK_SIZE` edges,
+so a large network does not hold up the updates and path queries of the publishing service.
+"""
+import mmap
+import os
+import struct
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import gevent
+import numpy as np
+from networkx.exception import NetworkXError
+from raiden_libs.types import Address, ChannelIdentifier
+
+from pathfinder.config import (
+    NUM_LANDMARKS_DEFAULT,
+    PATH_CACHE_SIZE_DEFAULT,
+    SNAPSHOT_CHUNK_SIZE,
+)
+from pathfinder.model.csr_graph import CAPACITY_MAX, CAPACITY_MIN, CSRGraph
+from pathfinder.model.token_network import TokenNetwork
+from pathfinder.utils.address import AddressTable
+from pathfinder.utils.files import atomic_write
+
+SNAPSHOT_MAGIC = b'PFSGRAPH'
+SNAPSHOT_FORMAT = 2
+SNAPSHOT_SUFFIX = '.graph'
+
+# magic, format, token network address, version, nodes, edges, large capacities, max fee, epoch
+HEADER = struct.Struct('<8sI42s2xQQQQdQ')
+HEADER_SIZE = 128
+ADDRESS_DTYPE = np.dtype('S42')
+# capacities beyond int64 as signed big endian integers, wide enough for uint256 deposits.
+# 'S' dtypes would strip trailing zero bytes.
+LARGE_CAPACITY_DTYPE = np.dtype('V33')
+
+
+class SnapshotChannelView(NamedTuple):
+    """ The part of a `ChannelView` kept in a snapshot. """
+    self: Address
+    partner: Address
+    channel_id: ChannelIdentifier
+    capacity: int
+    percentage_fee: float
+
+
+def snapshot_path(directory: str, token_network_address: Address) -> str:
+    return os.path.join(directory, token_network_address + SNAPSHOT_SUFFIX)
+
+
+def _sections(num_nodes: int, num_edges: int, num_large: int) -> List[Tuple[str, np.dtype, int]]:
+    """ Name, dtype and length of the arrays following the header, in file order. """
+    return [
+        ('addresses', ADDRESS_DTYPE, num_nodes),
+        ('components', np.dtype(np.int64), num_nodes),
+        ('indptr', np.dtype(np.int64), num_nodes + 1),
+        ('indices', np.dtype(np.int64), num_edges),
+        ('sources', np.dtype(np.int32), num_edges),
+        ('targets', np.dtype(np.int32), num_edges),
+        ('capacities', np.dtype(np.int64), num_edges),
+        ('fees', np.dtype(np.float64), num_edges),
+        ('channel_ids', np.dtype(np.int64), num_edges),
+        ('reverse', np.dtype(np.int64), num_edges),
+        ('alive', np.dtype(np.bool_), num_edges),
+        ('large_edges', np.dtype(np.int64), num_large),
+        ('large_capacities', LARGE_CAPACITY_DTYPE, num_large),
+    ]
+
+
+def _aligned(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def _reverse_edges(sources: np.ndarray, targets: np.ndarray, num_nodes: int) -> np.ndarray:
+    """ The edge from the target to the source of every edge, -1 if there is none. """
+    if len(targets) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    keys = sources.astype(np.int64) * num_nodes + targets
+    reverse_keys = targets.astype(np.int64) * num_nodes + sources
+    order = np.argsort(keys)
+    sorted_keys = keys[order]
+    positions = np.minimum(np.searchsorted(sorted_keys, reverse_keys), len(keys) - 1)
+    return np.where(sorted_keys[positions] == reverse_keys, order[positions], -1)
+
+
+def write_snapshot(token_network: TokenNetwork, path: str) -> bool:
+    """ Atomically replaces the snapshot at `path` with the current state of `token_network`.
+
+    Works for both graph backends. Edges are stored grouped by source in insertion order, so
+    searches on the snapshot break ties like searches on the network itself.
+
+    Balance and fee updates applied while the writer yields can already be part of the
+    snapshot, its `version` is the one of the network when the writing started. Returns
+    `False` without writing if channels were opened or closed meanwhile, the graph cannot be
+    read consistently then. """
+
+    version = token_network.version
+    topology_version = token_network.topology_version
+    graph = token_network.G
+    nodes: List[Address] = list(graph.nodes)
+    node_ids = {node: node_id for node_id, node in enumerate(nodes)}
+
+    if token_network.components.stale:
+        token_network.components.build(token_network.channel_id_to_addresses.values())
+    components = []
+    for node in nodes:
+        root = token_network.components.find(node)
+        components.append(-1 if root is None else node_ids[root])
+
+    indptr = [0]
+    targets: List[int] = []
+    capacities: List[int] = []
+    fees: List[float] = []
+    channel_ids: List[int] = []
+    large_capacities: Dict[int, int] = {}
+    next_yield = SNAPSHOT_CHUNK_SIZE
+    for source, node in enumerate(nodes):
+        if len(targets) >= next_yield:
+            gevent.sleep(0)
+            if token_network.topology_version != topology_version:
+                return False
+            next_yield = len(targets) + SNAPSHOT_CHUNK_SIZE
+        for partner in graph[node]:
+            view = graph[node][partner]['view']
+            edge = len(targets)
+            targets.append(node_ids[partner])
+            capacity = view.capacity
+            if CAPACITY_MIN < capacity < CAPACITY_MAX:
+                capacities.append(capacity)
+            else:
+                capacities.append(CAPACITY_MAX if capacity > 0 else CAPACITY_MIN)
+                large_capacities[edge] = capacity
+            fees.append(view.percentage_fee)
+            channel_ids.append(view.channel_id)
+        indptr.append(len(targets))
+
+    num_edges = len(targets)
+    sources = np.repeat(np.arange(len(nodes), dtype=np.int32), np.diff(indptr))
+    target_array = np.array(targets, dtype=np.int32)
+    reverse = _reverse_edges(sources, target_array, len(nodes))
+    arrays = {
+        'addresses': np.array(nodes, dtype=ADDRESS_DTYPE),
+        'components': np.array(components, dtype=np.int64),
+        'indptr': np.array(indptr, dtype=np.int64),
+        'indices': np.arange(num_edges, dtype=np.int64),
+        'sources': sources,
+        'targets': target_array,
+        'capacities': np.array(capacities, dtype=np.int64),
+        'fees': np.array(fees, dtype=np.float64),
+        'channel_ids': np.array(channel_ids, dtype=np.int64),
+        'reverse': reverse,
+        'alive': np.ones(num_edges, dtype=np.bool_),
+        'large_edges': np.array(list(large_capacities), dtype=np.int64),
+        'large_capacities': np.array(
+            [
+                capacity.to_bytes(LARGE_CAPACITY_DTYPE.itemsize, 'big', signed=True)
+                for capacity in large_capacities.values()
+            ],
+            dtype=LARGE_CAPACITY_DTYPE,
+        ),
+    }
+
+    header = HEADER.pack(
+        SNAPSHOT_MAGIC,
+        SNAPSHOT_FORMAT,
+        token_network.address.encode(),
+        version,
+        len(nodes),
+        num_edges,
+        len(large_capacities),
+        token_network.max_percentage_fee,
+        token_network.epoch,
+    )
+
+    with atomic_write(path) as snapshot_file:
+        snapshot_file.write(header.ljust(HEADER_SIZE, b'\0'))
+        offset = HEADER_SIZE
+        for name, dtype, length in _sections(len(nodes), num_edges, len(large_capacities)):
+            data = arrays[name].astype(dtype, copy=False).tobytes()
+            assert len(data) == dtype.itemsize * length
+            snapshot_file.write(data)
+            offset += len(data)
+            snapshot_file.write(b'\0' * (_aligned(offset) - offset))
+            offset = _aligned(offset)
+    return True
+
+
+class _SnapshotViews:
+    """ Builds the `SnapshotChannelView` of an edge slot on access. """
+
+    def __init__(self, graph: 'SnapshotGraph') -> None:
+        self._graph = graph
+
+    def __len__(self) -> int:
+        return self._graph.number_of_edges()
+
+    def __getitem__(self, edge: int) -> SnapshotChannelView:
+        graph = self._graph
+        return SnapshotChannelView(
+            graph.address(graph.sources.item(edge)),
+            graph.address(graph.targets.item(edge)),
+            graph.channel_ids.item(edge),
+            graph.capacity(edge),
+            graph.fees.item(edge),
+        )
+
+
+class SnapshotGraph(CSRGraph):
+    """ Read-only `CSRGraph` using the arrays of a mapped snapshot file in place.
+
+    Edges are found by scanning the row of their source instead of a dict with an entry per
+    edge, and `G[u][v]['view']` returns a `SnapshotChannelView`. Searches read the mapped
+    arrays through memory views instead of list copies, which would be held by every reader
+    process. """
+
+    def __init__(self, arrays: Dict[str, np.ndarray], large_capacities: Dict[int, int]) -> None:
+        super().__init__()
+
+        addresses = [Address(address.decode()) for address in arrays['addresses'].tolist()]
+        # the addresses were validated when they were added to the written network
+        self.node_table = AddressTable()
+        self.node_table.addresses = addresses
+        self.node_table.ids = {address: node_id for node_id, address in enumerate(addresses)}
+
+        for name in ('indptr', 'indices', 'sources', 'targets', 'capacities', 'fees',
+                     'channel_ids', 'reverse', 'alive'):
+            setattr(self, name, arrays[name])
+        self._large_capacities = large_capacities
+        self._num_slots = len(self.targets)
+        self._views = _SnapshotViews(self)  # type: ignore
+        # items of memory views are plain ints and bools, like the list items of a `CSRGraph`.
+        # Snapshots store the edges in row order, their indices are a range.
+        self._search_views = (
+            self.indptr.data,
+            range(self._num_slots),
+            self.targets.data,
+            self.alive.data,
+        )
+
+    def add_edge(self, u: Address, v: Address, view) -> None:
+        raise NetworkXError('Snapshot graphs are read-only')
+
+    def remove_edge(self, u: Address, v: Address) -> None:
+        raise NetworkXError('Snapshot graphs are read-only')
+
+    def update_edge(self, u: Address, v: Address) -> None:
+        raise NetworkXError('Snapshot graphs are read-only')
+
+    def compact(self) -> None:
+        raise NetworkXError('Snapshot graphs are read-only')
+
+    def _search_sequences(self):
+        return self._search_views
+
+    def _edge_id(self, source: int, target: int) -> Optional[int]:
+        if source < 0 or target < 0:
+            return None
+        start, end = self.indptr.item(source), self.indptr.item(source + 1)
+        matches = np.flatnonzero(self.targets[start:end] == target)
+        if len(matches) == 0:
+            return None
+        return start + int(matches[0])
+
+
+def load_snapshot(
+    path: str,
+    num_landmarks: int = NUM_LANDMARKS_DEFAULT,
+    path_cache_size: int = PATH_CACHE_SIZE_DEFAULT,
+) -> TokenNetwork:
+    """ Maps the snapshot at `path` and returns a `TokenNetwork` on it.
+
+    The network answers path queries like the one the snapshot was written from, but cannot
+    be changed. Its `version` is the one of the written network. """
+
+    with open(path, 'rb') as snapshot_file:
+        buffer = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    (
+        magic,
+        snapshot_format,
+        token_network_address,
+        version,
+        num_nodes,
+        num_edges,
+        num_large,
+        max_percentage_fee,
+        epoch,
+    ) = HEADER.unpack_from(buffer)
+    if magic != SNAPSHOT_MAGIC or snapshot_format != SNAPSHOT_FORMAT:
+        raise ValueError('Not a graph snapshot: {}'.format(path))
+
+    arrays: Dict[str, np.ndarray] = {}
+    offset = HEADER_SIZE
+    for name, dtype, length in _sections(num_nodes, num_edges, num_large):
+        arrays[name] = np.frombuffer(buffer, dtype=dtype, count=length, offset=offset)
+        offset = _aligned(offset + dtype.itemsize * length)
+
+    large_capacities = {
+        edge: int.from_bytes(capacity, 'big', signed=True)
+        for edge, capacity in zip(
+            arrays['large_edges'].tolist(),
+            arrays['large_capacities'].tolist(),
+        )
+    }
+
+    token_network = TokenNetwork(
+        Address(token_network_address.decode()),
+        graph_backend='csr',
+        num_landmarks=num_landmarks,
+        path_cache_size=path_cache_size,
+    )
+    graph = SnapshotGraph(arrays, large_capacities)
+    token_network.G = graph
+    token_network.version = version
+    token_network.epoch = epoch
+    token_network.max_percentage_fee = max_percentage_fee
+
+    addresses = graph.node_table.addresses
+    for node_id, root in enumerate(arrays['components'].tolist()):
+        if root >= 0:
+            token_network.components.parents[addresses[node_id]] = addresses[root]
+
+    return token_network
+
+
+class SnapshotReader:
+    """ Follows the snapshot file at `path`.
+
+    `refresh` switches to a newly published version. The switch is a single assignment, so
+    queries already running keep their version, which stays mapped until they finish. """
+
+    def __init__(
+        self,
+        path: str,
+        num_landmarks: int = NUM_LANDMARKS_DEFAULT,
+        path_cache_size: int = PATH_CACHE_SIZE_DEFAULT,
+    ) -> None:
+        self.path = path
+        self.num_landmarks = num_landmarks
+        self.path_cache_size = path_cache_size
+        self.token_network: Optional[TokenNetwork] = None
+        self.file_key: Optional[Tuple[int, int, int]] = None
+
+    def refresh(self) -> Optional[TokenNetwork]:
+        """ Returns the latest published version, `None` before the first one. """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return self.token_network
+
+        # every publication renames a new file over the old one
+        file_key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if file_key != self.file_key:
+            self.token_network = load_snapshot(
+                self.path,
+                num_landmarks=self.num_landmarks,
+                path_cache_size=self.path_cache_size,
+            )
+            self.file_key = file_key
+        return self.token_network
@@ -0,0 +1,272 @@
+""" Binary snapshots of the complete state of a token network, for fast restarts.
+
+A state snapshot stores one fixed size record per channel, with the full `ChannelView` of
+both directions including the balance proof and fee info nonces, in a NumPy structured array
+behind a small header. Token amounts are uint256 and stored as 32 byte big endian integers.
+The file is mapped on load, restoring a network only creates its Python objects.
+
+Together with the state, the snapshot records the last event it contains, by block number and
+log index. Events up to that one must not be applied again, see `PathfindingService`. The blocks
+up to which the blockchain listeners processed all events are saved with the snapshots as
+checkpoints, so the listeners can resume from there instead of scanning the chain from its
+start. Every followed token network gets its own checkpoint as well, networks without one still
+need all their events.
+"""
+import json
+import mmap
+import os
+import struct
+from typing import Any, Dict, Hashable, List, Tuple
+
+import numpy as np
+from raiden_libs.types import Address
+
+from pathfinder.config import (
+    GRAPH_BACKEND_DEFAULT,
+    NUM_LANDMARKS_DEFAULT,
+    PATH_CACHE_SIZE_DEFAULT,
+)
+from pathfinder.model.channel_view import ChannelView
+from pathfinder.model.token_network import TokenNetwork
+from pathfinder.utils.files import atomic_write
+
+STATE_SNAPSHOT_MAGIC = b'PFSSTATE'
+STATE_SNAPSHOT_FORMAT = 2
+STATE_SNAPSHOT_SUFFIX = '.state'
+CHECKPOINTS_FILE = 'checkpoints.json'
+
+# magic, format, token network address, block and log index of the last event, channels, max fee
+HEADER = struct.Struct('<8sI42s2xQQQd')
+HEADER_SIZE = 128
+
+AMOUNT_DTYPE = np.dtype('V32')
+VIEW_DTYPE = np.dtype([
+    ('deposit', AMOUNT_DTYPE),
+    ('transferred_amount', AMOUNT_DTYPE),
+    ('received_amount', AMOUNT_DTYPE),
+    ('locked_amount', AMOUNT_DTYPE),
+    ('percentage_fee', '<f8'),
+    ('balance_proof_nonce', '<u8'),
+    ('fee_info_nonce', '<u8'),
+    ('state', 'u1'),
+])
+CHANNEL_DTYPE = np.dtype([
+    ('channel_id', '<i8'),
+    ('participant1', 'S42'),
+    ('participant2', 'S42'),
+    # whether the views in the graph belong to this channel, see `write_state_snapshot`
+    ('has_views', 'u1'),
+    ('view1', VIEW_DTYPE),
+    ('view2', VIEW_DTYPE),
+])
+
+STATES = list(ChannelView.State)
+EMPTY_VIEW_RECORD = (bytes(AMOUNT_DTYPE.itemsize),) * 4 + (0.0, 0, 0, 0)
+
+
+def state_snapshot_path(directory: str, token_network_address: Address) -> str:
+    return os.path.join(directory, token_network_address + STATE_SNAPSHOT_SUFFIX)
+
+
+def saved_token_networks(directory: str) -> List[Address]:
+    """ The addresses of all token networks with a state snapshot in `directory`. """
+    return [
+        Address(file_name[:-len(STATE_SNAPSHOT_SUFFIX)])
+        for file_name in sorted(os.listdir(directory))
+        if file_name.endswith(STATE_SNAPSHOT_SUFFIX)
+    ]
+
+
+def known_token_networks(directory: str) -> List[Address]:
+    """ The addresses of all token networks with a state snapshot or a checkpoint in
+    `directory`, the latter were followed even if their state snapshot is missing. """
+    checkpointed = load_checkpoints(directory).get('token_networks', {})
+    return sorted(set(saved_token_networks(directory)) | set(checkpointed))
+
+
+def write_checkpoints(directory: str, checkpoints: Dict[str, Any]):
+    """ Atomically saves the last processed block of every blockchain listener, and under
+    `'token_networks'` the block up to which the state of every token network is complete. """
+    with atomic_write(os.path.join(directory, CHECKPOINTS_FILE)) as checkpoints_file:
+        checkpoints_file.write(json.dumps(checkpoints, sort_keys=True).encode())
+
+
+def load_checkpoints(directory: str) -> Dict[str, Any]:
+    """ Returns the checkpoints saved by `write_checkpoints`, or none at all. """
+    try:
+        with open(os.path.join(directory, CHECKPOINTS_FILE), 'rb') as checkpoints_file:
+            return json.loads(checkpoints_file.read().decode())
+    except FileNotFoundError:
+        return {}
+
+
+def token_network_resume_block(
+    directory: str,
+    checkpoints: Dict[str, Any],
+    token_network_addresses: List[Address],
+) -> int:
+    """ The block to start the sync of the token network listener from, given the
+    `checkpoints` saved in `directory`.
+
+    The listener reports the events of all token networks, so it resumes from the lowest
+    checkpoint of the networks to follow. A network without a saved state, like one newly
+    given on the command line, has no checkpoint and needs its events from the first block.
+    Without `token_network_addresses` the registry is followed, networks registered after its
+    checkpoint need their events from there. """
+    network_checkpoints = checkpoints.get('token_networks', {})
+    if token_network_addresses:
+        blocks = []
+        addresses = token_network_addresses
+    else:
+        blocks = [checkpoints.get('token_network_registry', 0)]
+        addresses = known_token_networks(directory)
+    for address in addresses:
+        if os.path.exists(state_snapshot_path(directory, address)):
+            blocks.append(network_checkpoints.get(address, 0))
+        else:
+            blocks.append(0)
+    return min(blocks)
+
+
+def _amount(value: int) -> bytes:
+    return value.to_bytes(AMOUNT_DTYPE.itemsize, 'big')
+
+
+def _view_record(view: ChannelView) -> Tuple:
+    return (
+        _amount(view.deposit),
+        _amount(view.transferred_amount),
+        _amount(view.received_amount),
+        _amount(view.locked_amount),
+        view.percentage_fee,
+        view.balance_proof_nonce,
+        view.fee_info_nonce,
+        STATES.index(view.state),
+    )
+
+
+def _restore_view(view: ChannelView, record: Tuple):
+    (
+        deposit,
+        transferred_amount,
+        received_amount,
+        locked_amount,
+        view._percentage_fee,
+        view.balance_proof_nonce,
+        view.fee_info_nonce,
+        state,
+    ) = record
+    view._deposit = int.from_bytes(deposit, 'big')
+    view._transferred_amount = int.from_bytes(transferred_amount, 'big')
+    view._received_amount = int.from_bytes(received_amount, 'big')
+    view._locked_amount = int.from_bytes(locked_amount, 'big')
+    # see `ChannelView.update_capacity`
+    view._capacity = view._deposit - (
+        view._transferred_amount + view._locked_amount
+    ) + view._received_amount
+    view.state = STATES[state]
+
+
+def write_state_snapshot(token_network: TokenNetwork, path: str, last_event: Tuple[int, int]):
+    """ Atomically replaces the state snapshot at `path` with the state of `token_network`,
+    which includes all events up to `last_event`, given by block number and log index. """
+
+    graph = token_network.G
+    records = []
+    for channel_id, (participant1, participant2) in token_network.channel_id_to_addresses.items():
+        # the channels of a pair of participants share their edges, a channel can be open
+        # while a later one for the same participants owns or already removed the edges
+        has_views = (
+            graph.has_edge(participant1, participant2) and
+            graph[participant1][participant2]['view'].channel_id == channel_id
+        )
+        if has_views:
+            view1 = graph[participant1][participant2]['view']
+            view2 = graph[participant2][participant1]['view']
+            records.append((
+                channel_id,
+                participant1,
+                participant2,
+                True,
+                _view_record(view1),
+                _view_record(view2),
+            ))
+        else:
+            records.append((
+                channel_id,
+                participant1,
+                participant2,
+                False,
+                EMPTY_VIEW_RECORD,
+                EMPTY_VIEW_RECORD,
+            ))
+
+    header = HEADER.pack(
+        STATE_SNAPSHOT_MAGIC,
+        STATE_SNAPSHOT_FORMAT,
+        token_network.address.encode(),
+        *last_event,
+        len(records),
+        token_network.max_percentage_fee,
+    )
+    with atomic_write(path) as snapshot_file:
+        snapshot_file.write(header.ljust(HEADER_SIZE, b'\0'))
+        snapshot_file.write(np.array(records, dtype=CHANNEL_DTYPE).tobytes())
+
+
+def load_state_snapshot(
+    path: str,
+    **kwargs: Any
+) -> Tuple[TokenNetwork, Tuple[int, int]]:
+    """ Restores the token network in the state snapshot at `path`.
+
+    Returns the network and the block number and log index of the last event in the snapshot.
+    Keyword args are passed on to `TokenNetwork`. """
+
+    with open(path, 'rb') as snapshot_file:
+        buffer = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    (
+        magic,
+        snapshot_format,
+        token_network_address,
+        last_block,
+        last_log_index,
+        num_channels,
+        max_percentage_fee,
+    ) = HEADER.unpack_from(buffer)
+    if magic != STATE_SNAPSHOT_MAGIC or snapshot_format != STATE_SNAPSHOT_FORMAT:
+        raise ValueError('Not a state snapshot: {}'.format(path))
+
+    kwargs.setdefault('graph_backend', GRAPH_BACKEND_DEFAULT)
+    kwargs.setdefault('num_landmarks', NUM_LANDMARKS_DEFAULT)
+    kwargs.setdefault('path_cache_size', PATH_CACHE_SIZE_DEFAULT)
+    token_network = TokenNetwork(Address(token_network_address.decode()), **kwargs)
+
+    fees: Dict[Hashable, float] = {}
+    channels = np.frombuffer(buffer, dtype=CHANNEL_DTYPE, count=num_channels, offset=HEADER_SIZE)
+    for channel_id, participant1, participant2, has_views, record1, record2 in channels.tolist():
+        participant1 = Address(participant1.decode())
+        participant2 = Address(participant2.decode())
+        token_network.channel_id_to_addresses[channel_id] = (participant1, participant2)
+        token_network.components.union(participant1, participant2)
+        if not has_views:
+            continue
+
+        view1 = ChannelView(channel_id, participant1, participant2)
+        view2 = ChannelView(channel_id, participant2, participant1)
+        _restore_view(view1, record1)
+        _restore_view(view2, record2)
+
+        token_network.G.add_edge(participant1, participant2, view=view1)
+        token_network.G.add_edge(participant2, participant1, view=view2)
+        for view in (view1, view2):
+            # only fees announced with a FeeInfo count towards the maximum
+            if view.fee_info_nonce > 0:
+                fees[channel_id, view.self] = view.percentage_fee
+    del channels
+
+    token_network.fee_index.reset(fees)
+    token_network.max_percentage_fee = max_percentage_fee
+    buffer.close()
+    return token_network, (last_block, last_log_index)
@@ -1,23 +1,109 @@
 # -*- coding: utf-8 -*-
+import hashlib
 import logging
-from typing import List, Dict, Any, Tuple
+import secrets
+import time
+from typing import (
+    List,
+    Dict,
+    Any,
+    Tuple,
+    Callable,
+    Generator,
+    Iterable,
+    Iterator,
+    Optional,
+    Set,
+)
 
+import gevent
 import networkx as nx
 from networkx import DiGraph
-from eth_utils import is_checksum_address, is_same_address
 from raiden_libs.types import Address, ChannelIdentifier
 
 from pathfinder.config import (
     DIVERSITY_PEN_DEFAULT,
+    GRAPH_BACKEND_DEFAULT,
+    NUM_LANDMARKS_DEFAULT,
+    PATH_CACHE_SIZE_DEFAULT,
     MIN_PATH_REDUNDANCY,
     PATH_REDUNDANCY_FACTOR,
-    MAX_PATHS_PER_REQUEST
+    MAX_PATHS_PER_REQUEST,
+    PATH_STRATEGY_DEFAULT,
 )
 from pathfinder.model import ChannelView
+from pathfinder.model.components import ComponentIndex
+from pathfinder.model.csr_graph import CAPACITY_MAX, CAPACITY_MIN, CSRGraph
+from pathfinder.model.fee_index import MaxFeeIndex
+from pathfinder.model.landmarks import LandmarkIndex
+from pathfinder.model.path_cache import PathCache
+from pathfinder.model.search import (
+    Adjacency,
+    Edge,
+    Node,
+    SearchTree,
+    astar_path,
+    k_shortest_paths,
+    shortest_path_tree,
+)
+from pathfinder.utils.address import is_checksum_address, to_checksum_address
 
 
 log = logging.getLogger(__name__)
 
+GRAPH_BACKENDS = ('networkx', 'csr')
+PATH_STRATEGIES = ('diversity', 'yen')
+MUTATIONS = (
+    'handle_channel_opened_event',
+    'handle_channel_new_deposit_event',
+    'handle_channel_closed_event',
+    'update_balance',
+    'update_fee',
+)
+
+
+class PathsResult(list):
+    """ The paths returned by `TokenNetwork.get_paths`.
+
+    `partial` is set when the time budget of the query ran out before all requested paths were
+    searched for.
+    """
+    partial = False
+
+    def copy_paths(self) -> 'PathsResult':
+        """ A copy for another caller, who may modify it. """
+        result = PathsResult(dict(path, path=list(path['path'])) for path in self)
+        result.partial = self.partial
+        return result
+
+
+def _collect(search: Generator[Any, None, Any], items: List) -> Any:
+    """ Appends the items yielded by `search` to `items`, returns the return value of
+    `search`. """
+    while True:
+        try:
+            items.append(next(search))
+        except StopIteration as stop:
+            return stop.value
+
+
+def _yield_all(items: Iterable, value: Any) -> Generator[Any, None, Any]:
+    """ Yields `items`, then returns `value`. """
+    yield from items
+    return value
+
+
+def _out_of_time(deadline: Optional[float]) -> bool:
+    """ Yields to other greenlets between the searches of a path query and checks its time
+    budget.
+
+    The network can change meanwhile. Capacities and fees are read from the graph by the
+    searches, but state built for a query, like the weights of `_path_finder` or the trees of
+    `get_paths_batch`, has to be rebuilt once `TokenNetwork.version` or `topology_version`
+    changed. """
+    gevent.sleep(0)
+    return deadline is not None and time.monotonic() >= deadline
+
 
 class TokenNetwork:
     """ Manages a token network for pathfinding.
@@ -29,13 +115,70 @@ class TokenNetwork:
     TODO: test all these methods once we have sample data, DO NOT let these crucial functions
     remain uncovered! """
 
-    def __init__(self, token_network_address: Address) -> None:
-        """ Initializes a new TokenNetwork. """
+    def __init__(
+        self,
+        token_network_address: Address,
+        graph_backend: str = GRAPH_BACKEND_DEFAULT,
+        num_landmarks: int = NUM_LANDMARKS_DEFAULT,
+        path_cache_size: int = PATH_CACHE_SIZE_DEFAULT,
+    ) -> None:
+        """ Initializes a new TokenNetwork.
+
+        Args:
+            token_network_address: The address of the token network contract
+            graph_backend: 'networkx' keeps the channel graph in a `networkx.DiGraph`, 'csr'
+                keeps it in the array based `CSRGraph`. Both return the same paths.
+            num_landmarks: Number of ALT landmarks guiding the searches in `get_paths`, `0`
+                disables the goal directed search
+            path_cache_size: Maximum number of `get_paths` results kept in the `PathCache`,
+                `0` disables caching
+        """
+
+        if graph_backend not in GRAPH_BACKENDS:
+            raise ValueError('Unknown graph backend: {}'.format(graph_backend))
 
         self.address = token_network_address
+        self.graph_backend = graph_backend
         self.channel_id_to_addresses: Dict[int, Tuple[Address, Address]] = dict()
-        self.G = DiGraph()
+        self.G = DiGraph() if graph_backend == 'networkx' else CSRGraph()
+        # maximum over all fees announced with a FeeInfo, keyed by (channel id, sender)
+        self.fee_index = MaxFeeIndex()
         self.max_percentage_fee = 0.0
+        self.landmarks = LandmarkIndex(num_landmarks) if num_landmarks > 0 else None
+        self.path_cache = PathCache(path_cache_size)
+        self.components = ComponentIndex()
+        self.mutation_listeners: List[Callable[[str, Tuple], None]] = []
+        # increased by every change of the network
+        self.version = 0
+        # versions start over for every new instance, e.g. after a restart, the epoch tells
+        # them apart. Replicas and graph snapshots keep the epoch of their source.
+        self.epoch = secrets.randbits(64)
+        # increased by every opened or closed channel, which can move the edges of the graph
+        # backend, see `_out_of_time`
+        self.topology_version = 0
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # listeners belong to the process that registered them, replicas get their own
+        state = self.__dict__.copy()
+        state['mutation_listeners'] = []
+        return state
+
+    def add_mutation_listener(self, callback: Callable[[str, Tuple], None]):
+        """ Registers `callback` for all successful changes of the network.
+
+        The callback receives the name of the changing method and its arguments, replaying
+        them with `apply_mutation` on a copy of the network keeps the copy identical. """
+        self.mutation_listeners.append(callback)
+
+    def apply_mutation(self, method: str, args: Tuple):
+        if method not in MUTATIONS:
+            raise ValueError('Unknown mutation: {}'.format(method))
+        getattr(self, method)(*args)
+
+    def _publish(self, method: str, *args):
+        self.version += 1
+        for callback in self.mutation_listeners:
+            callback(method, args)
 
     #
     # Contract event listener functions
@@ -61,6 +204,19 @@ class TokenNetwork:
 
         self.G.add_edge(participant1, participant2, view=view1)
         self.G.add_edge(participant2, participant1, view=view2)
+        self.components.union(participant1, participant2)
+
+        # new edges can shorten any path
+        if self.landmarks is not None:
+            self.landmarks.invalidate()
+        self.path_cache.clear()
+        self.topology_version += 1
+        self._publish(
+            'handle_channel_opened_event',
+            channel_identifier,
+            participant1,
+            participant2,
+        )
 
     def handle_channel_new_deposit_event(
         self,
@@ -77,14 +233,24 @@ class TokenNetwork:
         try:
             participant1, participant2 = self.channel_id_to_addresses[channel_identifier]
 
+            self.path_cache.invalidate_channel(channel_identifier)
             if receiver == participant1:
                 self.G[participant1][participant2]['view'].update_capacity(deposit=total_deposit)
+                self._update_edge(participant1, participant2)
             elif receiver == participant2:
                 self.G[participant2][participant1]['view'].update_capacity(deposit=total_deposit)
+                self._update_edge(participant2, participant1)
             else:
                 log.error(
                     "Receiver in ChannelNewDeposit does not fit the internal channel"
                 )
+                return
+            self._publish(
+                'handle_channel_new_deposit_event',
+                channel_identifier,
+                receiver,
+                total_deposit,
+            )
         except KeyError:
             log.error(
                 "Received ChannelNewDeposit event for unknown channel '{}'".format(
@@ -104,6 +270,14 @@ class TokenNetwork:
 
             self.G.remove_edge(participant1, participant2)
             self.G.remove_edge(participant2, participant1)
+            self.fee_index.remove((channel_identifier, participant1))
+            self.fee_index.remove((channel_identifier, participant2))
+            self.max_percentage_fee = self.fee_index.max()
+            self.path_cache.invalidate_channel(channel_identifier)
+            # closing can split a component
+            self.components.invalidate()
+            self.topology_version += 1
+            self._publish('handle_channel_closed_event', channel_identifier)
         except KeyError:
             log.error(
                 "Received ChannelClosed event for unknown channel '{}'".format(
@@ -133,9 +307,10 @@ class TokenNetwork:
             (None, None)
         )
 
-        if is_same_address(participant1, signer):
+        signer = to_checksum_address(signer)
+        if signer == participant1:
             receiver = participant2
-        elif is_same_address(participant2, signer):
+        elif signer == participant2:
             receiver = participant1
         else:
             raise ValueError('Balance proof signature does not match any of the participants.')
@@ -154,6 +329,17 @@ class TokenNetwork:
         view2.update_capacity(
             received_amount=transferred_amount
         )
+        self._update_edge(signer, receiver)
+        self._update_edge(receiver, signer)
+        self.path_cache.invalidate_channel(channel_identifier)
+        self._publish(
+            'update_balance',
+            channel_identifier,
+            signer,
+            nonce,
+            transferred_amount,
+            locked_amount,
+        )
 
     def update_fee(
         self,
@@ -171,10 +357,11 @@ class TokenNetwork:
             channel_identifier,
             (None, None)
         )
-        if is_same_address(participant1, signer):
+        signer = to_checksum_address(signer)
+        if signer == participant1:
             sender = participant1
             receiver = participant2
-        elif is_same_address(participant2, signer):
+        elif signer == participant2:
             sender = participant2
             receiver = participant1
         else:
@@ -186,33 +373,82 @@ class TokenNetwork:
         if nonce <= channel_view.fee_info_nonce:
             raise ValueError('Outdated fee info.')
 
-        if new_percentage_fee_casted >= self.max_percentage_fee:
-            # Equal case is included to avoid a recalculation of the max fee.
-            self.max_percentage_fee = new_percentage_fee_casted
-            channel_view._percentage_fee = new_percentage_fee_casted
-        elif channel_view._percentage_fee == self.max_percentage_fee:
-            # O(n) operation but rarely called, amortized likely constant.
-            channel_view._percentage_fee = new_percentage_fee_casted
-            self.max_percentage_fee = max(
-                edge_data['view'].percentage_fee
-                for _, _, edge_data in self.G.edges(data=True)
-            )
+        if self.landmarks is not None and new_percentage_fee_casted < channel_view.percentage_fee:
+            self.landmarks.fee_lowered(channel_view.percentage_fee - new_percentage_fee_casted)
+
+        self.fee_index.update((channel_identifier, sender), new_percentage_fee_casted)
+        self.max_percentage_fee = self.fee_index.max()
 
         channel_view.update_fee(nonce, new_percentage_fee_casted)
+        self._update_edge(sender, receiver)
+        self.path_cache.invalidate_channel(channel_identifier)
+        self._publish('update_fee', channel_identifier, signer, nonce, new_percentage_fee_casted)
 
-    def get_paths(
+    def _update_edge(self, u: Address, v: Address):
+        """ Propagates changes of the view on `u -> v` into the graph backend. """
+        if self.graph_backend == 'csr':
+            self.G.update_edge(u, v)
+
+    def _path_finder(
         self,
         source: Address,
         target: Address,
         value: int,
-        k: int,
-        **kwargs
-    ):
-        k = min(k, MAX_PATHS_PER_REQUEST)
-        visited: Dict[ChannelIdentifier, float] = {}
-        paths: List[List[Address]] = []
-        hop_bias = kwargs.get('hop_bias', 0)
-        assert 0 <= hop_bias <= 1
+        hop_bias: float,
+        visited: Dict[ChannelIdentifier, float],
+    ) -> Tuple[Callable[[], List[Address]], Callable[[Address, Address], None]]:
+        """ Returns a function that computes the currently cheapest path from `source` to
+        `target`, taking the diversity penalties in `visited` into account.
+
+        The second returned function must be called with the participants of a channel after
+        its penalty in `visited` changed. """
+
+        def penalty_changed(u: Address, v: Address):
+            pass
+
+        if self.landmarks is not None:
+            def search_weight(fee: float, capacity: int, channel_id: ChannelIdentifier):
+                if capacity < value:
+                    return None
+                else:
+                    return hop_bias * self.max_percentage_fee + \
+                        (1 - hop_bias) * fee + \
+                        visited.get(channel_id, 0)
+
+            successors, _ = self._adjacency(search_weight)
+            heuristic = self._landmark_heuristic(target, hop_bias)
+            source_node = self._search_node(source)
+            target_node = self._search_node(target)
+
+            def find_path():
+                path = astar_path(successors, source_node, target_node, heuristic)
+                if path is None:
+                    raise nx.NetworkXNoPath('No path to {}.'.format(target))
+                return self._search_path(path[0])
+
+            return find_path, penalty_changed
+
+        if self.graph_backend == 'csr':
+            graph: CSRGraph = self.G
+            # one dense weight per edge slot, penalties are written into a copy in place
+            base_weights = graph.weight_array(
+                value,
+                hop_bias * self.max_percentage_fee,
+                1 - hop_bias
+            ).tolist()
+            weights = list(base_weights)
+
+            def update_weights(u: Address, v: Address):
+                edge = graph.edge_id(u, v)
+                penalty = visited[graph.channel_ids.item(edge)]
+                for channel_edge in (edge, graph.reverse.item(edge)):
+                    if channel_edge >= 0:
+                        weights[channel_edge] = base_weights[channel_edge] + penalty
+
+            return (
+                lambda: graph.dijkstra_path_weights(source, target, weights),
+                update_weights,
+            )
 
         def weight(
             u: Address,
@@ -230,9 +466,297 @@ class TokenNetwork:
                             0
                         )
 
+        return lambda: nx.dijkstra_path(self.G, source, target, weight=weight), penalty_changed
+
+    def _k_shortest_paths(
+        self,
+        source: Address,
+        target: Address,
+        value: int,
+        hop_bias: float,
+        reverse_tree: Optional[SearchTree] = None,
+    ) -> Iterator[Tuple[List[Address], List[ChannelIdentifier], float]]:
+        """ Yields the loopless paths from `source` to `target` by increasing cost, together
+        with their channel ids and their cost. `reverse_tree` can pass in the result of
+        `_shortest_path_tree(target, value, hop_bias, reverse=True)`. """
+
+        successors, predecessors = self._adjacency(self._routing_weight(value, hop_bias))
+        for nodes, edges, costs in k_shortest_paths(
+            successors,
+            predecessors,
+            self._search_node(source),
+            self._search_node(target),
+            reverse_tree=reverse_tree,
+        ):
+            yield (
+                self._search_path(nodes),
+                [self._edge_channel_id(edge) for edge in edges],
+                costs[-1],
+            )
+
+    def _routing_weight(
+        self,
+        value: int,
+        hop_bias: float,
+    ) -> Callable[[float, int, ChannelIdentifier], Optional[float]]:
+        """ Edge weight for `_adjacency` without diversity penalties. """
+
+        def weight(fee: float, capacity: int, channel_id: ChannelIdentifier):
+            if capacity < value:
+                return None
+            return hop_bias * self.max_percentage_fee + (1 - hop_bias) * fee
+
+        return weight
+
+    def _shortest_path_tree(
+        self,
+        root: Address,
+        value: int,
+        hop_bias: float,
+        reverse: bool = False,
+    ) -> SearchTree:
+        """ Runs Dijkstra from `root` with the routing weights of `get_paths`. The reverse tree
+        holds the distances to `root` instead. """
+
+        successors, predecessors = self._adjacency(self._routing_weight(value, hop_bias))
+        return shortest_path_tree(predecessors if reverse else successors, self._search_node(root))
+
+    def _tree_path(self, tree: SearchTree, target: Address) -> List[Address]:
+        """ Returns the path from the root of a forward `tree` to `target`. """
+
+        _, parents = tree
+        node = self._search_node(target)
+        if node not in tree[0]:
+            raise nx.NetworkXNoPath('No path to {}.'.format(target))
+
+        nodes = [node]
+        while node in parents:
+            node = parents[node][0]
+            nodes.append(node)
+        nodes.reverse()
+        return self._search_path(nodes)
+
+    #
+    # backend independent search helpers, see `pathfinder.model.search`
+    #
+
+    def _adjacency(
+        self,
+        weight: Callable[[float, int, ChannelIdentifier], Optional[float]],
+    ) -> Tuple[Adjacency, Adjacency]:
+        """ Returns successor and predecessor functions over the channel graph.
+
+        `weight(percentage_fee, capacity, channel_id)` gives the cost of an edge or `None` to
+        hide it. Nodes are addresses for the networkx backend and node ids for the CSR
+        backend, edges are `ChannelView`s or edge slots respectively. """
+
+        if self.graph_backend == 'csr':
+            graph: CSRGraph = self.G
+            capacities = graph.capacities
+            fees = graph.fees
+            channel_ids = graph.channel_ids
+            targets = graph.targets
+            reverse = graph.reverse
+
+            def edge_weight(edge: int):
+                capacity = capacities.item(edge)
+                if capacity == CAPACITY_MAX or capacity == CAPACITY_MIN:
+                    capacity = graph.capacity(edge)
+                return weight(fees.item(edge), capacity, channel_ids.item(edge))
+
+            def successors(node: int):
+                for edge in graph.out_edges(node):
+                    yield targets.item(edge), edge, edge_weight(edge)
+
+            def predecessors(node: int):
+                for edge in graph.out_edges(node):
+                    in_edge = reverse.item(edge)
+                    if in_edge >= 0:
+                        yield targets.item(edge), in_edge, edge_weight(in_edge)
+
+            return successors, predecessors
+
+        digraph: DiGraph = self.G
+
+        def view_weight(view: ChannelView):
+            return weight(view._percentage_fee, view.capacity, view.channel_id)
+
+        def view_successors(node: Address):
+            for partner, attr in digraph.succ[node].items():
+                yield partner, attr['view'], view_weight(attr['view'])
+
+        def view_predecessors(node: Address):
+            for partner, attr in digraph.pred[node].items():
+                yield partner, attr['view'], view_weight(attr['view'])
+
+        return view_successors, view_predecessors
+
+    def _search_nodes(self) -> Iterable[Node]:
+        if self.graph_backend == 'csr':
+            return range(self.G.number_of_nodes())
+        return list(self.G.nodes)
+
+    def _search_node(self, address: Address) -> Node:
+        if self.graph_backend == 'csr':
+            return self.G.node_id(address)
+        return address
+
+    def _search_path(self, nodes: List[Node]) -> List[Address]:
+        if self.graph_backend == 'csr':
+            return [self.G.address(node) for node in nodes]
+        return nodes
+
+    def _edge_channel_id(self, edge: Edge) -> ChannelIdentifier:
+        if self.graph_backend == 'csr':
+            return self.G.channel_ids.item(edge)
+        return edge.channel_id
+
+    def _landmark_heuristic(
+        self,
+        target: Address,
+        hop_bias: float,
+    ) -> Callable[[Node], Optional[float]]:
+        """ Returns the ALT heuristic towards `target`, refreshing the landmarks if needed. """
+        assert self.landmarks is not None
+
+        if self.landmarks.needs_refresh:
+            successors, predecessors = self._adjacency(
+                lambda fee, capacity, channel_id: fee
+            )
+            self.landmarks.build(self._search_nodes(), successors, predecessors)
+
+        return self.landmarks.heuristic(self._search_node(target), scale=1 - hop_bias)
+
+    def _yen_paths(
+        self,
+        source: Address,
+        target: Address,
+        value: int,
+        k: int,
+        hop_bias: float,
+        diversity_penalty: bool,
+        reverse_tree: Optional[SearchTree] = None,
+        deadline: Optional[float] = None,
+    ) -> Tuple[List[List[Address]], bool]:
+        """ Returns up to `k` paths using Yen's k shortest loopless paths and whether the
+        search stopped early at `deadline`, or because channels were opened or closed.
+
+        Without `diversity_penalty` these are simply the `k` cheapest paths. With it, every
+        returned path adds `DIVERSITY_PEN_DEFAULT` to the cost of its channels, and the next
+        path is the cheapest one under these penalties, like in the iterative strategy.
+        Penalties only ever increase costs, so candidates are only pulled from Yen until the
+        next one cannot beat the best penalized candidate. """
+
+        candidates = self._k_shortest_paths(source, target, value, hop_bias, reverse_tree)
+        topology_version = self.topology_version
+
+        def stopped() -> bool:
+            # the state of Yen's algorithm refers to edges, which can move with the topology
+            return _out_of_time(deadline) or self.topology_version != topology_version
+
+        out_of_time = False
+        if not diversity_penalty:
+            paths = []
+            for nodes, _, _ in candidates:
+                paths.append(nodes)
+                if len(paths) >= k:
+                    break
+                if stopped():
+                    out_of_time = True
+                    break
+            if not paths:
+                raise nx.NetworkXNoPath('No path to {}.'.format(target))
+            return paths, out_of_time
+
+        max_candidates = max(MIN_PATH_REDUNDANCY, PATH_REDUNDANCY_FACTOR * k)
+        penalties: Dict[ChannelIdentifier, float] = {}
+        pool: List[Tuple[List[Address], List[ChannelIdentifier], float]] = []
+        paths = []
+        pending = next(candidates, None)
+        pulled = 0
+
+        def penalized_cost(candidate) -> float:
+            _, channel_ids, cost = candidate
+            return cost + sum(penalties.get(channel_id, 0) for channel_id in channel_ids)
+
+        while len(paths) < k:
+            while pending is not None and pulled < max_candidates:
+                if pool and pending[2] >= min(penalized_cost(c) for c in pool):
+                    break
+                pool.append(pending)
+                pulled += 1
+                if stopped():
+                    out_of_time = True
+                    break
+                pending = next(candidates, None)
+
+            if not pool:
+                break
+            best = min(pool, key=penalized_cost)
+            pool.remove(best)
+            paths.append(best[0])
+            for channel_id in best[1]:
+                penalties[channel_id] = penalties.get(channel_id, 0) + DIVERSITY_PEN_DEFAULT
+            if out_of_time:
+                break
+
+        if not paths:
+            raise nx.NetworkXNoPath('No path to {}.'.format(target))
+        return paths, out_of_time and len(paths) < k
+
+    def _diversity_paths(
+        self,
+        source: Address,
+        target: Address,
+        value: int,
+        k: int,
+        hop_bias: float,
+        first_path: Optional[List[Address]] = None,
+        deadline: Optional[float] = None,
+    ) -> Tuple[List[List[Address]], bool]:
+        """ Returns the paths of `_iter_diversity_paths` and whether the search stopped early at
+        `deadline`. """
+
+        paths: List[List[Address]] = []
+        out_of_time = _collect(
+            self._iter_diversity_paths(source, target, value, k, hop_bias, first_path, deadline),
+            paths,
+        )
+        return paths, out_of_time
+
+    def _iter_diversity_paths(
+        self,
+        source: Address,
+        target: Address,
+        value: int,
+        k: int,
+        hop_bias: float,
+        first_path: Optional[List[Address]] = None,
+        deadline: Optional[float] = None,
+    ) -> Generator[List[Address], None, bool]:
+        """ Yields up to `k` paths by repeatedly running Dijkstra and penalizing the channels
+        of every path found, each one as soon as it is found. Returns whether the search
+        stopped early at `deadline`. `first_path` can pass in the result of the first,
+        unpenalized search. """
+
+        visited: Dict[ChannelIdentifier, float] = {}
+        paths: List[List[Address]] = []
+
+        find_path, penalty_changed = self._path_finder(source, target, value, hop_bias, visited)
+        version = self.version
+
         max_iterations = max(MIN_PATH_REDUNDANCY, PATH_REDUNDANCY_FACTOR * k)
-        for _ in range(max_iterations):
-            path = nx.dijkstra_path(self.G, source, target, weight=weight)
+        for i in range(max_iterations):
+            if i == 0 and first_path is not None:
+                path = first_path
+            elif paths:
+                try:
+                    path = find_path()
+                except nx.NetworkXNoPath:
+                    # penalties never disconnect the target, channels were closed meanwhile
+                    break
+            else:
+                path = find_path()
             duplicate = path in paths
             for node1, node2 in zip(path[:-1], path[1:]):
                 channel_id = self.G[node1][node2]['view'].channel_id
@@ -240,21 +764,295 @@ class TokenNetwork:
                     visited[channel_id] *= 2
                 else:
                     visited[channel_id] = visited.get(channel_id, 0) + DIVERSITY_PEN_DEFAULT
+                penalty_changed(node1, node2)
 
             if not duplicate:
                 paths.append(path)
+                yield path
             if len(paths) >= k:
                 break
+            if _out_of_time(deadline):
+                return True
+            if self.version != version:
+                find_path, penalty_changed = self._path_finder(
+                    source,
+                    target,
+                    value,
+                    hop_bias,
+                    visited,
+                )
+                for channel_id in visited:
+                    participants = self.channel_id_to_addresses.get(channel_id)
+                    if participants is not None:
+                        penalty_changed(*participants)
+                version = self.version
+
+        return False
+
+    def check_route(self, source: Address, target: Address):
+        """ Checks in constant time that `target` can be reached from `source` at all,
+        ignoring capacities.
+
+        Raises the same exceptions as `networkx.dijkstra_path`, `NodeNotFound` for an unknown
+        `source` and `NetworkXNoPath` if `target` is unknown or in a different component. """
+
+        if source not in self.G:
+            raise nx.NodeNotFound('Node {} not found in graph'.format(source))
+
+        if self.components.stale:
+            self.components.build(self.channel_id_to_addresses.values())
+        if source != target and not self.components.connected(source, target):
+            raise nx.NetworkXNoPath('No path to {}.'.format(target))
+
+    def get_paths(
+        self,
+        source: Address,
+        target: Address,
+        value: int,
+        k: int,
+        **kwargs
+    ) -> PathsResult:
+        """ Returns up to `k` paths from `source` to `target` that can carry `value`.
+
+        Keyword args:
+            hop_bias: Between 0 (prefer cheap paths) and 1 (prefer short paths)
+            strategy: 'diversity' repeatedly runs Dijkstra and penalizes used channels, 'yen'
+                enumerates the k shortest loopless paths
+            diversity_penalty: Only for 'yen', penalize channels shared with earlier paths
+            max_time_ms: Time budget of the query. Once it is used up, the paths found so far
+                are returned with `partial` set. The first path is always searched for.
+        """
+        result = PathsResult()
+        result.partial = _collect(self.iter_paths(source, target, value, k, **kwargs), result)
+        return result
+
+    def iter_paths(
+        self,
+        source: Address,
+        target: Address,
+        value: int,
+        k: int,
+        **kwargs
+    ) -> Generator[Dict[str, Any], None, bool]:
+        """ Yields the paths of `get_paths` with their fees. Returns whether the result is
+        partial.
+
+        The 'diversity' strategy yields every path as soon as it is found, so a caller can use
+        the first path before the others are searched for. The errors of `get_paths` are
+        raised by the first `next`.
+
+        The network can change while the caller holds the generator. Paths that lost a channel
+        meanwhile are skipped, which makes the result partial, and results found while the
+        network changed are not cached. """
+        hop_bias, strategy, diversity_penalty, deadline = self._path_options(kwargs)
+        version = self.version
+        self.check_route(source, target)
+
+        k = min(k, MAX_PATHS_PER_REQUEST)
+        cache_key = (source, target, value, k, hop_bias, strategy, diversity_penalty)
+        cached = self.path_cache.get(cache_key, self.max_percentage_fee)
+        if cached is not None:
+            yield from cached
+            return False
+
+        if strategy == 'diversity':
+            search = self._iter_diversity_paths(
+                source,
+                target,
+                value,
+                k,
+                hop_bias,
+                deadline=deadline,
+            )
+        else:
+            search = _yield_all(*self._yen_paths(
+                source,
+                target,
+                value,
+                k,
+                hop_bias,
+                diversity_penalty,
+                deadline=deadline,
+            ))
 
         result = []
-        for path in paths:
-            fee = 0
+        channel_ids: Set[ChannelIdentifier] = set()
+        skipped = False
+        while True:
+            try:
+                path = next(search)
+            except StopIteration as stop:
+                partial = stop.value or skipped
+                break
+            if self.version != version and not self._path_exists(path):
+                skipped = True
+                continue
+            path_result = dict(path=path, estimated_fee=self._path_fee(path, channel_ids))
+            result.append(path_result)
+            # the caller owns the yielded paths, the cache gets the unchanged ones
+            yield dict(path_result, path=list(path))
+
+        if not partial and self.version == version:
+            self.path_cache.put(cache_key, result, channel_ids, self.max_percentage_fee)
+        return partial
+
+    def get_paths_batch(
+        self,
+        queries: List[Tuple[Address, Address, int, int]],
+        **kwargs
+    ) -> List[Any]:
+        """ Answers several `(source, target, value, k)` path queries at once.
+
+        Returns the `get_paths` result for every query in order. Queries that `get_paths` would
+        fail with `NodeNotFound` or `NetworkXNoPath` get the exception instead of a result.
+        The keyword args are the ones of `get_paths` and apply to all queries, `max_time_ms` is
+        the budget of the whole batch.
+
+        Queries with the same source and value share one shortest path tree, which yields the
+        first path of each. For the 'yen' strategy queries are grouped by target instead and
+        share the reverse tree that drives Yen's spur searches.
+        """
+        hop_bias, strategy, diversity_penalty, deadline = self._path_options(kwargs)
+
+        results: List[Any] = [None] * len(queries)
+        groups: Dict[Tuple[Address, int], List[int]] = {}
+        for index, (source, target, value, k) in enumerate(queries):
+            try:
+                self.check_route(source, target)
+            except (nx.NodeNotFound, nx.NetworkXNoPath) as error:
+                results[index] = error
+                continue
+
+            cache_key = (source, target, value, min(k, MAX_PATHS_PER_REQUEST), hop_bias,
+                         strategy, diversity_penalty)
+            cached = self.path_cache.get(cache_key, self.max_percentage_fee)
+            if cached is not None:
+                results[index] = PathsResult(cached)
+                continue
+
+            root = source if strategy == 'diversity' else target
+            groups.setdefault((root, value), []).append(index)
+
+        for (root, value), indices in groups.items():
+            tree = self._shortest_path_tree(root, value, hop_bias, reverse=strategy == 'yen')
+            tree_version = self.version
+            tree_topology_version = self.topology_version
+            for index in indices:
+                source, target, _, k = queries[index]
+                k = min(k, MAX_PATHS_PER_REQUEST)
+                if self.topology_version != tree_topology_version:
+                    # channels were opened or closed during the searches of earlier queries
+                    tree = self._shortest_path_tree(
+                        root,
+                        value,
+                        hop_bias,
+                        reverse=strategy == 'yen',
+                    )
+                    tree_version = self.version
+                    tree_topology_version = self.topology_version
+                try:
+                    if strategy == 'diversity':
+                        paths, partial = self._diversity_paths(
+                            source,
+                            target,
+                            value,
+                            k,
+                            hop_bias,
+                            first_path=self._tree_path(tree, target),
+                            deadline=deadline,
+                        )
+                    else:
+                        paths, partial = self._yen_paths(
+                            source,
+                            target,
+                            value,
+                            k,
+                            hop_bias,
+                            diversity_penalty,
+                            reverse_tree=tree,
+                            deadline=deadline,
+                        )
+                except nx.NetworkXNoPath as error:
+                    results[index] = error
+                    continue
+
+                cache_key = (source, target, value, k, hop_bias, strategy, diversity_penalty)
+                results[index] = self._paths_result(cache_key, paths, partial, tree_version)
+
+        return results
+
+    @staticmethod
+    def _path_options(kwargs: Dict[str, Any]) -> Tuple[float, str, bool, Optional[float]]:
+        """ Returns hop bias, strategy, diversity penalty and the `time.monotonic` deadline
+        of a path query. """
+
+        hop_bias = kwargs.get('hop_bias', 0)
+        assert 0 <= hop_bias <= 1
+        strategy = kwargs.get('strategy', PATH_STRATEGY_DEFAULT)
+        if strategy not in PATH_STRATEGIES:
+            raise ValueError('Unknown path strategy: {}'.format(strategy))
+
+        max_time_ms = kwargs.get('max_time_ms')
+        deadline = None
+        if max_time_ms is not None:
+            deadline = time.monotonic() + max_time_ms / 1000
+
+        return hop_bias, strategy, kwargs.get('diversity_penalty', False), deadline
+
+    def _path_fee(self, path: List[Address], channel_ids: Set[ChannelIdentifier]) -> float:
+        """ The estimated fee of `path`, adds its channels to `channel_ids`. """
+
+        fee = 0.0
+        for node1, node2 in zip(path[:-1], path[1:]):
+            view: ChannelView = self.G[node1][node2]['view']
+            fee += view.percentage_fee
+            channel_ids.add(view.channel_id)
+        return fee
+
+    def paths_fingerprint(self, paths: List[Dict[str, Any]]) -> str:
+        """ A digest of the `get_paths` result `paths` and the state of its channels.
+
+        It changes when the capacity or fee of a channel on one of the paths changes, changes
+        elsewhere in the network leave it as is. """
+
+        state: List[Tuple] = []
+        for path_result in paths:
+            path = path_result['path']
+            state.append(tuple(path))
             for node1, node2 in zip(path[:-1], path[1:]):
-                fee += self.G[node1][node2]['view'].percentage_fee
+                view: ChannelView = self.G[node1][node2]['view']
+                state.append((view.channel_id, view.capacity, view.percentage_fee))
+        return hashlib.blake2b(repr(state).encode(), digest_size=8).hexdigest()
+
+    def _paths_result(
+        self,
+        cache_key: Tuple,
+        paths: List[List[Address]],
+        partial: bool,
+        version: int,
+    ) -> PathsResult:
+        """ Adds the fees to `paths` found on `version` of the network and caches complete
+        results.
 
+        If the network changed since, paths with closed channels are dropped, which makes the
+        result partial, and the result is not cached. """
+
+        result = PathsResult()
+        result.partial = partial
+        channel_ids: Set[ChannelIdentifier] = set()
+        for path in paths:
+            if self.version != version and not self._path_exists(path):
+                result.partial = True
+                continue
             result.append(dict(
                 path=path,
-                estimated_fee=fee
+                estimated_fee=self._path_fee(path, channel_ids)
             ))
 
+        if not result.partial and self.version == version:
+            self.path_cache.put(cache_key, result, channel_ids, self.max_percentage_fee)
         return result
+
+    def _path_exists(self, path: List[Address]) -> bool:
+        """ Whether all channels of `path` are still open. """
+        return all(self.G.has_edge(node1, node2) for node1, node2 in zip(path[:-1], path[1:]))
@@ -1,11 +1,12 @@
 # -*- coding: utf-8 -*-
 import logging
+import os
 import sys
+import time
 import traceback
-from typing import Dict, Optional, List
+from typing import Any, Dict, Generator, Optional, List, Tuple
 
 import gevent
-from eth_utils import is_checksum_address, to_checksum_address
 from raiden_libs.blockchain import BlockchainListener
 from raiden_libs.messages import Message, FeeInfo, BalanceProof
 from raiden_libs.gevent_error_handler import register_error_handler
@@ -13,7 +14,37 @@ from raiden_libs.transport import MatrixTransport
 from raiden_libs.types import Address
 from raiden_contracts.contract_manager import ContractManager
 
+from pathfinder.config import (
+    COALESCE_INTERVAL_DEFAULT,
+    GRAPH_BACKEND_DEFAULT,
+    INGESTION_QUEUE_SIZE_DEFAULT,
+    INGESTION_STATS_INTERVAL,
+    NUM_LANDMARKS_DEFAULT,
+    OVERFLOW_POLICY_DEFAULT,
+    PATH_CACHE_SIZE_DEFAULT,
+    QUERY_STATS_INTERVAL,
+    ROUTING_WORKERS_DEFAULT,
+    SIGNATURE_WORKERS_DEFAULT,
+    SNAPSHOT_INTERVAL_DEFAULT,
+    STATE_SNAPSHOT_INTERVAL_DEFAULT,
+)
+from pathfinder.ingestion import IngestionPipeline
+from pathfinder.journal import Journal, journal_path
 from pathfinder.model import TokenNetwork
+from pathfinder.model.snapshot import snapshot_path, write_snapshot
+from pathfinder.model.state_snapshot import (
+    known_token_networks,
+    load_state_snapshot,
+    state_snapshot_path,
+    write_checkpoints,
+    write_state_snapshot,
+)
+from pathfinder.model.token_network import PathsResult
+from pathfinder.routing_pool import RoutingWorkerPool
+from pathfinder.signature_pool import SignatureWorkerPool
+from pathfinder.utils.address import is_checksum_address, to_checksum_address
+from pathfinder.utils.exceptions import RoutingWorkerError
+from pathfinder.utils.single_flight import SingleFlight
 
 log = logging.getLogger(__name__)
 
@@ -29,6 +60,8 @@ def error_handler(context, exc_info):
 
 
 class PathfindingService(gevent.Greenlet):
+    read_only = False
+
     def __init__(
         self,
         contract_manager: ContractManager,
@@ -37,6 +70,18 @@ class PathfindingService(gevent.Greenlet):
         *,
         follow_networks: List[Address] = None,
         token_network_registry_listener: BlockchainListener = None,
+        graph_backend: str = GRAPH_BACKEND_DEFAULT,
+        num_landmarks: int = NUM_LANDMARKS_DEFAULT,
+        path_cache_size: int = PATH_CACHE_SIZE_DEFAULT,
+        routing_workers: int = ROUTING_WORKERS_DEFAULT,
+        signature_workers: int = SIGNATURE_WORKERS_DEFAULT,
+        coalesce_interval: float = COALESCE_INTERVAL_DEFAULT,
+        ingestion_queue_size: int = INGESTION_QUEUE_SIZE_DEFAULT,
+        overflow_policy: str = OVERFLOW_POLICY_DEFAULT,
+        snapshot_dir: Optional[str] = None,
+        snapshot_interval: float = SNAPSHOT_INTERVAL_DEFAULT,
+        state_dir: Optional[str] = None,
+        state_snapshot_interval: float = STATE_SNAPSHOT_INTERVAL_DEFAULT,
     ) -> None:
         """ Creates a new pathfinding service
 
@@ -47,6 +92,28 @@ class PathfindingService(gevent.Greenlet):
             follow_networks: A list of token network addresses to follow. This has precedence over
                 the `token_network_registry_listener`
             token_network_registry_listener: A blockchain listener object for the network registry
+            graph_backend: The graph backend used for the token networks, see `TokenNetwork`
+            num_landmarks: Number of landmarks for goal directed routing, see `TokenNetwork`
+            path_cache_size: Size of the path cache of every token network, see `TokenNetwork`
+            routing_workers: Number of worker processes answering path queries, `0` answers
+                them in this process
+            signature_workers: Number of worker processes recovering the signers of received
+                messages, `0` recovers them in this process
+            coalesce_interval: Seconds received balance proofs and fee infos are collected
+                before they are applied. Only the one with the highest nonce is applied for
+                every channel direction. `0` applies them right away.
+            ingestion_queue_size: Number of received messages queued for the recovery of their
+                signers, see `IngestionPipeline`
+            overflow_policy: What to do with received messages when the queue is full, one of
+                `OVERFLOW_POLICIES`
+            snapshot_dir: Directory to publish graph snapshots of the token networks to, for
+                read-only API processes, see `SnapshotPathfindingService`
+            snapshot_interval: Seconds between checks for changed token networks to publish
+            state_dir: Directory to save the state of the token networks to, they are
+                restored from there on startup. Balance and fee updates are journaled there
+                between two saves, see `Journal`. The saved block checkpoints of the
+                listeners allow them to resume, see `checkpoints`.
+            state_snapshot_interval: Seconds between saving the state of changed token networks
         """
         super().__init__()
         self.contract_manager = contract_manager
@@ -55,11 +122,53 @@ class PathfindingService(gevent.Greenlet):
 
         self.token_network_registry_listener = token_network_registry_listener
         self.follow_networks = follow_networks
+        self.graph_backend = graph_backend
+        self.num_landmarks = num_landmarks
+        self.path_cache_size = path_cache_size
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_interval = snapshot_interval
+        # token network address -> last published version
+        self.snapshot_versions: Dict[Address, int] = {}
+        self.state_dir = state_dir
+        self.state_snapshot_interval = state_snapshot_interval
+        # token network address -> version of the last saved state
+        self.state_versions: Dict[Address, int] = {}
+        # token network address -> block number and log index of the last event included in
+        # its restored state
+        self.restored_events: Dict[Address, Tuple[int, int]] = {}
+        self.journals: Dict[Address, Journal] = {}
+        # last event of the token network listener, last block with events of the registry
+        # listener
+        self.last_event = (0, 0)
+        self.last_registry_block = 0
 
         self.is_running = gevent.event.Event()
         self.transport.add_message_callback(lambda message: self.on_message_event(message))
         self.token_networks: Dict[Address, TokenNetwork] = {}
 
+        # concurrent identical path queries on the same version of a network share one search
+        self.path_queries = SingleFlight()
+        self.routing_pool: Optional[RoutingWorkerPool] = None
+        if routing_workers > 0:
+            self.routing_pool = RoutingWorkerPool(routing_workers)
+            self.routing_pool.start()
+
+        self.signature_pool: Optional[SignatureWorkerPool] = None
+        if signature_workers > 0:
+            self.signature_pool = SignatureWorkerPool(signature_workers)
+            self.signature_pool.start()
+
+        # without signature workers and coalescing, messages are applied when they arrive
+        self.ingestion: Optional[IngestionPipeline] = None
+        if self.signature_pool is not None or coalesce_interval > 0:
+            self.ingestion = IngestionPipeline(
+                self.apply_messages,
+                signature_pool=self.signature_pool,
+                coalesce_interval=coalesce_interval,
+                queue_size=ingestion_queue_size,
+                overflow_policy=overflow_policy,
+            )
+
         assert (
             self.follow_networks is not None or self.token_network_registry_listener is not None
         )
@@ -84,6 +193,10 @@ class PathfindingService(gevent.Greenlet):
             for network_address in self.follow_networks:
                 self.create_token_network_for_address(network_address)
         else:
+            if self.state_dir is not None:
+                # a resumed registry listener does not report the known networks again
+                for network_address in known_token_networks(self.state_dir):
+                    self.create_token_network_for_address(network_address)
             self.token_network_registry_listener.add_confirmed_listener(
                 'TokenNetworkCreated',
                 self.handle_token_network_created
@@ -95,22 +208,233 @@ class PathfindingService(gevent.Greenlet):
         self.token_network_listener.start()
         if self.token_network_registry_listener:
             self.token_network_registry_listener.start()
+        if self.snapshot_dir is not None:
+            gevent.spawn(self._publish_snapshots_forever)
+        if self.state_dir is not None:
+            gevent.spawn(self._save_state_forever)
+        gevent.spawn(self._report_query_stats_forever)
+        if self.ingestion is not None:
+            self.ingestion.start()
+            gevent.spawn(self._report_ingestion_stats_forever)
 
         self.is_running.wait()
 
     def stop(self):
+        if self.ingestion is not None:
+            self.ingestion.stop()
+        if self.routing_pool is not None:
+            self.routing_pool.stop()
+        if self.signature_pool is not None:
+            self.signature_pool.stop()
+        if self.state_dir is not None:
+            self.save_state()
+        for journal in self.journals.values():
+            journal.stop()
         self.is_running.set()
 
+    def checkpoints(self) -> Dict[str, int]:
+        """ The blocks up to which the blockchain listeners processed all confirmed events.
+
+        Listeners advance their confirmed head after running the callbacks for the new blocks,
+        a checkpoint can only be behind the processed events. The callbacks of the last block
+        with events may still be running, so only the block before it counts as processed. Its
+        events that were already applied are skipped by log index, see `_is_new_event`. """
+        checkpoints = {
+            'token_network': max(
+                self.last_event[0] - 1,
+                getattr(self.token_network_listener, 'confirmed_head_number', 0),
+            ),
+        }
+        if self.token_network_registry_listener is not None:
+            checkpoints['token_network_registry'] = max(
+                self.last_registry_block - 1,
+                getattr(self.token_network_registry_listener, 'confirmed_head_number', 0),
+            )
+        return checkpoints
+
+    def save_state(self):
+        """ Saves the state of all token networks changed since it was last saved, together
+        with the listener checkpoints and the block up to which every network is complete. """
+        assert self.state_dir is not None
+
+        checkpoints = self.checkpoints()
+        token_network_checkpoints: Dict[Address, int] = {}
+        for address, token_network in list(self.token_networks.items()):
+            # a restored network already contains the events up to its restored event, even
+            # if the listener did not catch up to it yet
+            last_event = max(self.last_event, self.restored_events.get(address, (0, 0)))
+            token_network_checkpoints[address] = max(
+                checkpoints['token_network'],
+                last_event[0] - 1,
+            )
+            if self.state_versions.get(address) == token_network.version:
+                continue
+            write_state_snapshot(
+                token_network,
+                state_snapshot_path(self.state_dir, address),
+                last_event,
+            )
+            self.state_versions[address] = token_network.version
+            self.journals[address].reset()
+        write_checkpoints(
+            self.state_dir,
+            dict(checkpoints, token_networks=token_network_checkpoints),
+        )
+
+    def _save_state_forever(self):
+        while not self.is_running.is_set():
+            self.is_running.wait(self.state_snapshot_interval)
+            self.save_state()
+
+    def publish_snapshots(self):
+        """ Publishes snapshots of all token networks changed since their last snapshot.
+
+        A network whose channels were opened or closed while its snapshot was written is
+        published next time, see `write_snapshot`. """
+        assert self.snapshot_dir is not None
+
+        for address, token_network in list(self.token_networks.items()):
+            version = token_network.version
+            if self.snapshot_versions.get(address) == version:
+                continue
+            if write_snapshot(token_network, snapshot_path(self.snapshot_dir, address)):
+                self.snapshot_versions[address] = version
+
+    def _publish_snapshots_forever(self):
+        while not self.is_running.is_set():
+            start = time.monotonic()
+            self.publish_snapshots()
+            # with large networks, spend at most half of the time on writing snapshots
+            self.is_running.wait(max(self.snapshot_interval, time.monotonic() - start))
+
+    def get_paths(
+        self,
+        token_network: TokenNetwork,
+        *args,
+        **kwargs
+    ) -> PathsResult:
+        """ `TokenNetwork.get_paths`, answered by a routing worker if there are any.
+
+        A query arriving while the same one is searched for on the same version of the network
+        waits for that search instead of starting another. """
+        key = (token_network, token_network.version, args, tuple(sorted(kwargs.items())))
+        paths, joined = self.path_queries.run(key, self._get_paths, token_network, *args, **kwargs)
+        return paths.copy_paths() if joined else paths
+
+    def _get_paths(self, token_network: TokenNetwork, *args, **kwargs) -> PathsResult:
+        if self.routing_pool is not None:
+            try:
+                return self.routing_pool.get_paths(token_network.address, *args, **kwargs)
+            except RoutingWorkerError as error:
+                log.warning('Answering path query locally: {}'.format(error))
+        return token_network.get_paths(*args, **kwargs)
+
+    def iter_paths(
+        self,
+        token_network: TokenNetwork,
+        *args,
+        **kwargs
+    ) -> Generator[Dict[str, Any], None, bool]:
+        """ `TokenNetwork.iter_paths`. Routing workers only return whole results, with them
+        the paths are yielded once all of them are found. """
+        if self.routing_pool is not None:
+            paths = self.get_paths(token_network, *args, **kwargs)
+            yield from paths
+            return paths.partial
+        return (yield from token_network.iter_paths(*args, **kwargs))
+
+    def get_paths_batch(
+        self,
+        token_network: TokenNetwork,
+        *args,
+        **kwargs
+    ) -> List[Any]:
+        """ `TokenNetwork.get_paths_batch`, answered by a routing worker if there are any. """
+        if self.routing_pool is not None:
+            try:
+                return self.routing_pool.get_paths_batch(token_network.address, *args, **kwargs)
+            except RoutingWorkerError as error:
+                log.warning('Answering path queries locally: {}'.format(error))
+        return token_network.get_paths_batch(*args, **kwargs)
+
     def on_message_event(self, message: Message):
         """This handles messages received over the Transport"""
         assert isinstance(message, Message)
-        if isinstance(message, FeeInfo):
+        if self.ingestion is not None and isinstance(message, (FeeInfo, BalanceProof)):
+            self.ingestion.put(message)
+        elif isinstance(message, FeeInfo):
             self.on_fee_info_message(message)
         elif isinstance(message, BalanceProof):
             self.on_balance_proof_message(message)
         else:
             log.error("Ignoring unknown message of type '%s'", (type(message)))
 
+    def apply_messages(
+        self,
+        messages: List[Message],
+        signers: Optional[List[Optional[Address]]] = None,
+    ) -> List[Optional[str]]:
+        """ Handles the balance proofs and fee infos in `messages` in a single pass.
+
+        `signers` are the already recovered signers of the messages, `None` for invalid
+        signatures. Returns `None` for every applied message and the reason for every rejected
+        one. """
+        if signers is None and self.signature_pool is not None:
+            signers = self.signature_pool.recover_signers(messages)
+
+        errors: List[Optional[str]] = []
+        for index, message in enumerate(messages):
+            signer = None if signers is None else signers[index]
+            try:
+                if signers is not None and signer is None:
+                    raise ValueError('Invalid signature')
+                if isinstance(message, FeeInfo):
+                    self.on_fee_info_message(message, signer)
+                else:
+                    self.on_balance_proof_message(message, signer)
+            except ValueError as error:
+                errors.append(str(error))
+            except KeyError:
+                # the edges of closed channels are removed
+                errors.append('Channel is not open: {}'.format(message.channel_identifier))
+            else:
+                errors.append(None)
+        return errors
+
+    def _report_query_stats_forever(self):
+        calls = 0
+        joined = 0
+        while not self.is_running.is_set():
+            self.is_running.wait(QUERY_STATS_INTERVAL)
+            stats = self.path_queries.stats()
+            if stats['calls'] > calls:
+                log.info('{} path queries, {:.1%} joined an identical search in flight'.format(
+                    stats['calls'] - calls,
+                    (stats['joined'] - joined) / (stats['calls'] - calls),
+                ))
+            calls = stats['calls']
+            joined = stats['joined']
+
+    def _report_ingestion_stats_forever(self):
+        assert self.ingestion is not None
+        recovered = 0
+        while not self.is_running.is_set():
+            self.is_running.wait(INGESTION_STATS_INTERVAL)
+            log.info(
+                '{queued} messages queued, {dropped} dropped, {pending} pending, '
+                '{superseded} superseded, {applied} applied, {rejected} rejected'.format(
+                    **self.ingestion.stats()
+                )
+            )
+            if self.signature_pool is not None:
+                stats = self.signature_pool.stats()
+                log.info('Recovered {:.0f} signers/s, {} cache hits, {} in flight'.format(
+                    (stats['recovered'] - recovered) / INGESTION_STATS_INTERVAL,
+                    stats['cache_hits'],
+                    stats['in_flight'],
+                ))
+                recovered = stats['recovered']
+
     def follows_token_network(self, token_network_address: Address) -> bool:
         """ Checks if a token network is followed by the pathfinding service. """
         assert is_checksum_address(token_network_address)
@@ -127,10 +451,24 @@ class PathfindingService(gevent.Greenlet):
         else:
             return self.token_networks[token_network_address]
 
+    def _is_new_event(self, event: Dict) -> bool:
+        """ Tracks the last event, returns `False` for events included in the restored state
+        of their token network.
+
+        Events are ordered by block number and log index, as the state can be saved while only
+        some of the events of a block were applied. """
+        block = event.get('blockNumber')
+        if block is None:
+            return True
+
+        position = (block, event.get('logIndex', 0))
+        self.last_event = max(self.last_event, position)
+        return position > self.restored_events.get(event['address'], (-1, -1))
+
     def handle_channel_opened(self, event: Dict):
         token_network = self._get_token_network(event['address'])
 
-        if token_network:
+        if token_network and self._is_new_event(event):
             log.debug('Received ChannelOpened event for token network {}'.format(
                 token_network.address
             ))
@@ -144,11 +482,15 @@ class PathfindingService(gevent.Greenlet):
                 participant1,
                 participant2
             )
+            # updates journaled before a restart for channels opened after the last save
+            journal = self.journals.get(token_network.address)
+            if journal is not None:
+                journal.replay_channel(token_network, channel_identifier)
 
     def handle_channel_new_deposit(self, event: Dict):
         token_network = self._get_token_network(event['address'])
 
-        if token_network:
+        if token_network and self._is_new_event(event):
             log.debug('Received ChannelNewDeposit event for token network {}'.format(
                 token_network.address
             ))
@@ -166,7 +508,7 @@ class PathfindingService(gevent.Greenlet):
     def handle_channel_closed(self, event: Dict):
         token_network = self._get_token_network(event['address'])
 
-        if token_network:
+        if token_network and self._is_new_event(event):
             log.debug('Received ChannelClosed event for token network {}'.format(
                 token_network.address
             ))
@@ -175,7 +517,8 @@ class PathfindingService(gevent.Greenlet):
 
             token_network.handle_channel_closed_event(channel_identifier)
 
-    def on_fee_info_message(self, fee_info: FeeInfo):
+    def on_fee_info_message(self, fee_info: FeeInfo, signer: Optional[Address] = None):
+        """ Applies `fee_info`, recovering its signer unless it is given. """
         token_network = self._get_token_network(fee_info.token_network_address)
 
         if token_network:
@@ -186,12 +529,17 @@ class PathfindingService(gevent.Greenlet):
 
             token_network.update_fee(
                 fee_info.channel_identifier,
-                Address(to_checksum_address(fee_info.signer)),
+                to_checksum_address(fee_info.signer) if signer is None else signer,
                 fee_info.nonce,
                 fee_info.percentage_fee
             )
 
-    def on_balance_proof_message(self, balance_proof: BalanceProof):
+    def on_balance_proof_message(
+        self,
+        balance_proof: BalanceProof,
+        signer: Optional[Address] = None,
+    ):
+        """ Applies `balance_proof`, recovering its signer unless it is given. """
         token_network = self._get_token_network(balance_proof.token_network_address)
 
         if token_network:
@@ -202,7 +550,7 @@ class PathfindingService(gevent.Greenlet):
 
             token_network.update_balance(
                 balance_proof.channel_identifier,
-                Address(to_checksum_address(balance_proof.signer)),
+                to_checksum_address(balance_proof.signer) if signer is None else signer,
                 balance_proof.nonce,
                 balance_proof.transferred_amount,
                 balance_proof.locked_amount,
@@ -211,6 +559,10 @@ class PathfindingService(gevent.Greenlet):
     def handle_token_network_created(self, event):
         token_network_address = event['args']['token_network_address']
         assert is_checksum_address(token_network_address)
+        self.last_registry_block = max(
+            self.last_registry_block,
+            event.get('blockNumber', 0),
+        )
 
         if not self.follows_token_network(token_network_address):
             log.info(f'Found new token network at {token_network_address}')
@@ -219,5 +571,35 @@ class PathfindingService(gevent.Greenlet):
     def create_token_network_for_address(self, token_network_address: Address):
         log.info(f'Following token network at {token_network_address}')
 
-        token_network = TokenNetwork(token_network_address)
+        token_network_kwargs: Dict[str, Any] = dict(
+            graph_backend=self.graph_backend,
+            num_landmarks=self.num_landmarks,
+            path_cache_size=self.path_cache_size,
+        )
+        state_path = None
+        if self.state_dir is not None:
+            state_path = state_snapshot_path(self.state_dir, token_network_address)
+
+        if state_path is not None and os.path.exists(state_path):
+            token_network, last_event = load_state_snapshot(state_path, **token_network_kwargs)
+            log.info(f'Restored {len(token_network.channel_id_to_addresses)} channels up to '
+                     f'block {last_event[0]}')
+            self.restored_events[token_network_address] = last_event
+            self.state_versions[token_network_address] = token_network.version
+        else:
+            token_network = TokenNetwork(token_network_address, **token_network_kwargs)
+
+        if self.state_dir is not None:
+            journal = Journal(journal_path(self.state_dir, token_network_address))
+            num_replayed = journal.replay(token_network)
+            if num_replayed > 0:
+                log.info(f'Replayed {num_replayed} journaled updates')
+            if journal.deferred:
+                log.info(f'Deferred journaled updates of {len(journal.deferred)} channels '
+                         f'until they are opened')
+            journal.start()
+            token_network.add_mutation_listener(journal.on_mutation)
+            self.journals[token_network_address] = journal
         self.token_networks[token_network_address] = token_network
+        if self.routing_pool is not None:
+            self.routing_pool.add_token_network(token_network)
@@ -0,0 +1,247 @@
+""" Answers path queries in worker processes holding replicas of the token networks.
+
+Every worker starts from a pickled copy of each token network and afterwards receives the
+network's mutations as a stream of `(method, args)` deltas, see
+`TokenNetwork.add_mutation_listener`. Mutations and queries travel through the same pipe, so a
+worker always answers a query on a graph that includes all changes published before it.
+Different workers can lag behind each other by the messages still in flight.
+"""
+import itertools
+import logging
+import multiprocessing
+import pickle
+from functools import partial
+from multiprocessing.connection import Connection
+from typing import Any, Dict, List, Tuple
+
+import gevent
+import gevent.socket
+from gevent.event import AsyncResult
+from gevent.queue import Queue
+from raiden_libs.types import Address
+
+from pathfinder.config import ROUTING_WORKER_TIMEOUT
+from pathfinder.model import TokenNetwork
+from pathfinder.model.token_network import PathsResult
+from pathfinder.utils.exceptions import RoutingWorkerError
+
+log = logging.getLogger(__name__)
+
+QUERIES = ('get_paths', 'get_paths_batch')
+
+
+def _worker_main(requests: Connection, replies: Connection):
+    """ Main loop of a worker process, applies mutations and answers queries in order. """
+    token_networks: Dict[Address, TokenNetwork] = {}
+
+    while True:
+        try:
+            message = requests.recv()
+        except EOFError:
+            return
+
+        kind = message[0]
+        if kind == 'stop':
+            return
+        elif kind == 'network':
+            _, address, snapshot = message
+            token_networks[address] = pickle.loads(snapshot)
+        elif kind == 'mutation':
+            _, address, method, args = message
+            try:
+                token_networks[address].apply_mutation(method, args)
+            except Exception:
+                # the service only publishes successful mutations
+                log.exception('Replica of token network {} diverged'.format(address))
+        elif kind == 'query':
+            _, request_id, address, method, args, kwargs = message
+            try:
+                if method not in QUERIES:
+                    raise ValueError('Unknown query: {}'.format(method))
+                reply = (True, getattr(token_networks[address], method)(*args, **kwargs))
+            except Exception as error:
+                reply = (False, error)
+
+            try:
+                replies.send(('result', request_id) + reply)
+            except (pickle.PicklingError, AttributeError, TypeError) as error:
+                replies.send(('result', request_id, False, RoutingWorkerError(repr(error))))
+
+
+class RoutingWorker:
+    """ The parent side of a worker process. """
+
+    def __init__(
+        self,
+        index: int,
+        process: multiprocessing.Process,
+        requests: Connection,
+        replies: Connection,
+    ) -> None:
+        self.index = index
+        self.process = process
+        self.requests = requests
+        self.replies = replies
+        self.outbox: Queue = Queue()
+        self.pending: Dict[int, AsyncResult] = {}
+        self.alive = True
+        self.greenlets: List[gevent.Greenlet] = []
+
+    @property
+    def load(self) -> int:
+        return len(self.pending)
+
+
+class RoutingWorkerPool:
+    """ Dispatches path queries to the least loaded of `num_workers` worker processes.
+
+    Messages to a worker are queued and sent from a thread of the gevent threadpool, so a busy
+    worker with a full pipe never blocks the event loop. Workers are started with the 'spawn'
+    method, forking a monkey patched gevent process is not safe. Simplex pipes are used as
+    duplex ones are socket pairs, which the monkey patched socket module makes non-blocking
+    for the workers as well.
+
+    Subclasses can run another `worker_main` speaking the same protocol.
+    """
+    worker_main = staticmethod(_worker_main)
+    worker_name = 'routing worker'
+
+    def __init__(self, num_workers: int, timeout: float = ROUTING_WORKER_TIMEOUT) -> None:
+        if num_workers < 1:
+            raise ValueError('At least one {} is required'.format(self.worker_name))
+
+        self.num_workers = num_workers
+        self.timeout = timeout
+        self.workers: List[RoutingWorker] = []
+        self.next_worker = 0
+        self.request_ids = itertools.count()
+
+    def start(self):
+        context = multiprocessing.get_context('spawn')
+        for index in range(self.num_workers):
+            request_reader, request_writer = context.Pipe(duplex=False)
+            reply_reader, reply_writer = context.Pipe(duplex=False)
+            process = context.Process(
+                target=self.worker_main,
+                args=(request_reader, reply_writer),
+                name='{}-{}'.format(self.worker_name.replace(' ', '-'), index),
+                daemon=True,
+            )
+            process.start()
+            request_reader.close()
+            reply_writer.close()
+
+            worker = RoutingWorker(index, process, request_writer, reply_reader)
+            worker.greenlets = [
+                gevent.spawn(self._send_loop, worker),
+                gevent.spawn(self._receive_loop, worker),
+            ]
+            self.workers.append(worker)
+
+    def stop(self):
+        for worker in self.workers:
+            if worker.alive:
+                worker.outbox.put(('stop',))
+                worker.alive = False
+        for worker in self.workers:
+            # give the queued messages a chance to be sent
+            gevent.joinall(worker.greenlets[:1], timeout=1)
+            gevent.killall(worker.greenlets)
+            worker.process.join(timeout=1)
+            if worker.process.is_alive():
+                worker.process.terminate()
+            worker.requests.close()
+            worker.replies.close()
+        self.workers = []
+
+    def add_token_network(self, token_network: TokenNetwork):
+        """ Seeds all workers with a replica of `token_network` and forwards its mutations. """
+        snapshot = pickle.dumps(token_network, protocol=pickle.HIGHEST_PROTOCOL)
+        for worker in self.workers:
+            worker.outbox.put(('network', token_network.address, snapshot))
+        token_network.add_mutation_listener(partial(self._on_mutation, token_network.address))
+
+    def get_paths(self, token_network_address: Address, *args, **kwargs) -> PathsResult:
+        """ `TokenNetwork.get_paths` on the least loaded worker. """
+        return self._query(token_network_address, 'get_paths', args, kwargs)
+
+    def get_paths_batch(self, token_network_address: Address, *args, **kwargs) -> List[Any]:
+        """ `TokenNetwork.get_paths_batch` on the least loaded worker. """
+        return self._query(token_network_address, 'get_paths_batch', args, kwargs)
+
+    def _on_mutation(self, token_network_address: Address, method: str, args: Tuple):
+        message = ('mutation', token_network_address, method, args)
+        for worker in self.workers:
+            if worker.alive:
+                worker.outbox.put(message)
+
+    def _pick_worker(self) -> RoutingWorker:
+        """ Returns the worker with the fewest pending queries, ties are broken round-robin. """
+        num_workers = len(self.workers)
+        candidates = [
+            self.workers[(self.next_worker + offset) % num_workers]
+            for offset in range(num_workers)
+        ]
+        candidates = [worker for worker in candidates if worker.alive]
+        if not candidates:
+            raise RoutingWorkerError('No {} available'.format(self.worker_name))
+
+        worker = min(candidates, key=lambda candidate: candidate.load)
+        self.next_worker = (worker.index + 1) % num_workers
+        return worker
+
+    def _query(self, token_network_address: Address, method: str, args: Tuple, kwargs: Dict):
+        worker = self._pick_worker()
+        request_id = next(self.request_ids)
+        result = AsyncResult()
+        worker.pending[request_id] = result
+        worker.outbox.put(('query', request_id, token_network_address, method, args, kwargs))
+
+        try:
+            success, value = result.get(timeout=self.timeout)
+        except gevent.Timeout:
+            raise RoutingWorkerError('{} {} timed out'.format(
+                self.worker_name.capitalize(),
+                worker.index,
+            ))
+        finally:
+            worker.pending.pop(request_id, None)
+
+        if not success:
+            raise value
+        return value
+
+    def _send_loop(self, worker: RoutingWorker):
+        threadpool = gevent.get_hub().threadpool
+        while True:
+            message = worker.outbox.get()
+            if message[0] != 'stop' and not worker.alive:
+                return
+            try:
+                threadpool.apply(worker.requests.send, (message,))
+            except (OSError, EOFError):
+                self._worker_died(worker)
+                return
+
+    def _receive_loop(self, worker: RoutingWorker):
+        while True:
+            try:
+                gevent.socket.wait_read(worker.replies.fileno())
+                _, request_id, success, value = worker.replies.recv()
+            except (OSError, EOFError):
+                self._worker_died(worker)
+                return
+
+            result = worker.pending.get(request_id)
+            if result is not None:
+                result.set((success, value))
+
+    def _worker_died(self, worker: RoutingWorker):
+        if not worker.alive:
+            return
+
+        error = '{} {} died'.format(self.worker_name.capitalize(), worker.index)
+        log.error(error)
+        worker.alive = False
+        for result in worker.pending.values():
+            result.set_exception(RoutingWorkerError(error))
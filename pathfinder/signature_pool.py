@@ -0,0 +1,132 @@
+""" Recovers the signers of balance proofs and fee infos in worker processes.
+
+The signer of every message is recovered from its secp256k1 signature, which takes far longer
+than applying the message. Done on the gevent hub, bursts of messages delay path queries. The
+pool splits batches of messages over worker processes, see `RoutingWorkerPool` for the process
+handling, and waits for them without blocking the event loop.
+
+Resent and duplicate messages are common, so the recovered signers are kept in an LRU cache
+keyed by a hash of the signed data and the signature.
+"""
+import hashlib
+import logging
+import math
+from collections import OrderedDict
+from multiprocessing.connection import Connection
+from typing import Dict, List, Optional
+
+import gevent
+from raiden_libs.messages import Message
+from raiden_libs.types import Address
+
+from pathfinder.config import ROUTING_WORKER_TIMEOUT, SIGNER_CACHE_SIZE
+from pathfinder.routing_pool import RoutingWorkerPool
+from pathfinder.utils.address import to_checksum_address
+from pathfinder.utils.exceptions import RoutingWorkerError
+
+log = logging.getLogger(__name__)
+
+
+def recover_signer(message: Message) -> Optional[Address]:
+    """ The checksummed signer of `message`, `None` for invalid signatures. """
+    try:
+        return to_checksum_address(message.signer)
+    except Exception:
+        # the recovery raises different errors for the different ways a signature is broken
+        return None
+
+
+def message_hash(message: Message) -> bytes:
+    """ Identifies the signed content of `message` together with its signature. """
+    return hashlib.sha256(
+        type(message).__name__.encode() +
+        message.serialize_bin() +
+        str(message.signature).encode()
+    ).digest()
+
+
+def _worker_main(requests: Connection, replies: Connection):
+    """ Main loop of a worker process, recovers the signers of the messages in every query. """
+    while True:
+        try:
+            message = requests.recv()
+        except EOFError:
+            return
+
+        if message[0] == 'stop':
+            return
+        _, request_id, _, _, (messages, ), _ = message
+        replies.send(('result', request_id, True, [recover_signer(item) for item in messages]))
+
+
+class SignatureWorkerPool(RoutingWorkerPool):
+    """ Recovers the signers of messages on `num_workers` worker processes. """
+    worker_main = staticmethod(_worker_main)
+    worker_name = 'signature worker'
+
+    def __init__(
+        self,
+        num_workers: int,
+        cache_size: int = SIGNER_CACHE_SIZE,
+        timeout: float = ROUTING_WORKER_TIMEOUT,
+    ) -> None:
+        super().__init__(num_workers, timeout)
+        self.cache_size = cache_size
+        self.signers: 'OrderedDict[bytes, Optional[Address]]' = OrderedDict()
+
+        self.recovered = 0
+        self.cache_hits = 0
+        self.in_flight = 0
+
+    def recover_signers(self, messages: List[Message]) -> List[Optional[Address]]:
+        """ The signers of `messages` like `recover_signer`, in the same order. """
+        hashes = [message_hash(message) for message in messages]
+        missing: Dict[bytes, Message] = {}
+        for digest, message in zip(hashes, messages):
+            if digest in self.signers:
+                self.signers.move_to_end(digest)
+                self.cache_hits += 1
+            else:
+                missing[digest] = message
+
+        if missing:
+            digests = list(missing)
+            chunk_size = math.ceil(len(digests) / self.num_workers)
+            chunks = [
+                digests[start:start + chunk_size]
+                for start in range(0, len(digests), chunk_size)
+            ]
+            self.in_flight += len(digests)
+            try:
+                jobs = [
+                    gevent.spawn(self._recover_chunk, [missing[digest] for digest in chunk])
+                    for chunk in chunks
+                ]
+                gevent.joinall(jobs, raise_error=True)
+            finally:
+                self.in_flight -= len(digests)
+
+            for chunk, job in zip(chunks, jobs):
+                for digest, signer in zip(chunk, job.value):
+                    self.signers[digest] = signer
+            self.recovered += len(digests)
+
+        signers = [self.signers[digest] for digest in hashes]
+        while len(self.signers) > self.cache_size:
+            self.signers.popitem(last=False)
+        return signers
+
+    def _recover_chunk(self, messages: List[Message]) -> List[Optional[Address]]:
+        try:
+            return self._query(None, 'recover_signers', (messages, ), {})
+        except RoutingWorkerError as error:
+            log.warning('Recovering signers locally: {}'.format(error))
+            return [recover_signer(message) for message in messages]
+
+    def stats(self) -> Dict[str, int]:
+        return dict(
+            cache_size=len(self.signers),
+            cache_hits=self.cache_hits,
+            recovered=self.recovered,
+            in_flight=self.in_flight,
+        )
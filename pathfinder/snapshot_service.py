@@ -0,0 +1,100 @@
+import os
+import time
+from typing import Any, Dict, Generator, List, Optional
+
+from raiden_libs.types import Address
+
+from pathfinder.config import (
+    NUM_LANDMARKS_DEFAULT,
+    PATH_CACHE_SIZE_DEFAULT,
+    SNAPSHOT_REFRESH_INTERVAL_DEFAULT,
+)
+from pathfinder.model import TokenNetwork
+from pathfinder.model.snapshot import SNAPSHOT_SUFFIX, SnapshotReader
+from pathfinder.model.token_network import PathsResult
+from pathfinder.utils.address import is_checksum_address
+from pathfinder.utils.single_flight import SingleFlight
+
+
+class SnapshotPathfindingService:
+    """ Read-only stand-in for the `PathfindingService` in additional API processes.
+
+    Answers path queries from the graph snapshots a `PathfindingService` publishes to
+    `snapshot_dir`, switching to newer snapshots as they appear. All processes share the
+    mapped snapshot files instead of holding a graph each. Balance and fee updates are only
+    accepted by the `ServiceApi` of the publishing service.
+
+    The snapshot directory is checked at most once per `refresh_interval` seconds, requests in
+    between use the token networks found by the last check.
+    """
+    read_only = True
+
+    def __init__(
+        self,
+        snapshot_dir: str,
+        num_landmarks: int = NUM_LANDMARKS_DEFAULT,
+        path_cache_size: int = PATH_CACHE_SIZE_DEFAULT,
+        refresh_interval: float = SNAPSHOT_REFRESH_INTERVAL_DEFAULT,
+    ) -> None:
+        self.snapshot_dir = snapshot_dir
+        self.num_landmarks = num_landmarks
+        self.path_cache_size = path_cache_size
+        self.refresh_interval = refresh_interval
+        self.readers: Dict[Address, SnapshotReader] = {}
+        self.path_queries = SingleFlight()
+        self.refreshed_at: Optional[float] = None
+        self._token_networks: Dict[Address, TokenNetwork] = {}
+
+    @property
+    def token_networks(self) -> Dict[Address, TokenNetwork]:
+        """ The latest published version of every token network, as of the last `refresh`. """
+        if (
+            self.refreshed_at is None or
+            time.monotonic() - self.refreshed_at >= self.refresh_interval
+        ):
+            self.refresh()
+        return self._token_networks
+
+    def refresh(self):
+        """ Looks for new token networks and switches to newly published snapshots. """
+        for file_name in os.listdir(self.snapshot_dir):
+            address = Address(file_name[:-len(SNAPSHOT_SUFFIX)])
+            if file_name.endswith(SNAPSHOT_SUFFIX) and address not in self.readers:
+                self.readers[address] = SnapshotReader(
+                    os.path.join(self.snapshot_dir, file_name),
+                    num_landmarks=self.num_landmarks,
+                    path_cache_size=self.path_cache_size,
+                )
+
+        token_networks = {}
+        for address, reader in self.readers.items():
+            token_network = reader.refresh()
+            if token_network is not None:
+                token_networks[address] = token_network
+        self._token_networks = token_networks
+        self.refreshed_at = time.monotonic()
+
+    def follows_token_network(self, token_network_address: Address) -> bool:
+        assert is_checksum_address(token_network_address)
+
+        return token_network_address in self.token_networks
+
+    def get_paths(self, token_network: TokenNetwork, *args, **kwargs) -> PathsResult:
+        """ `TokenNetwork.get_paths`, sharing searches like `PathfindingService.get_paths`.
+
+        Every refreshed snapshot is a new `TokenNetwork`, so it never shares a search with an
+        older one. """
+        key = (token_network, token_network.version, args, tuple(sorted(kwargs.items())))
+        paths, joined = self.path_queries.run(key, token_network.get_paths, *args, **kwargs)
+        return paths.copy_paths() if joined else paths
+
+    def iter_paths(
+        self,
+        token_network: TokenNetwork,
+        *args,
+        **kwargs
+    ) -> Generator[Dict[str, Any], None, bool]:
+        return token_network.iter_paths(*args, **kwargs)
+
+    def get_paths_batch(self, token_network: TokenNetwork, *args, **kwargs) -> List[Any]:
+        return token_network.get_paths_batch(*args, **kwargs)
@@ -0,0 +1,31 @@
+from typing import List
+
+import pytest
+from raiden_libs.types import Address
+
+from pathfinder.utils.address import AddressTable, to_checksum_address
+from pathfinder.utils.exceptions import InvalidAddressChecksumError
+
+
+def test_address_table(addresses: List[Address]):
+    table = AddressTable()
+
+    assert table.intern(addresses[0]) == 0
+    assert table.intern(addresses[1]) == 1
+    assert table.intern(addresses[0]) == 0
+    assert len(table) == 2
+    assert addresses[1] in table
+    assert table.get(addresses[2]) is None
+    assert table.address(1) == addresses[1]
+
+    with pytest.raises(InvalidAddressChecksumError):
+        table.intern(Address(addresses[2].lower()))
+    assert len(table) == 2
+
+
+def test_to_checksum_address_cached(addresses: List[Address]):
+    to_checksum_address.cache_clear()
+
+    assert to_checksum_address(addresses[0].lower()) == addresses[0]
+    assert to_checksum_address(addresses[0].lower()) == addresses[0]
+    assert to_checksum_address.cache_info().hits == 1
@@ -0,0 +1,46 @@
+import gevent
+
+from pathfinder.api.admission import AdmissionBudget, AdmissionController
+
+
+def slow_app(environ, start_response):
+    gevent.sleep(0.05)
+    start_response('200 OK', [])
+    return [b'{}']
+
+
+def request(controller: AdmissionController, path: str) -> str:
+    statuses = []
+    response = controller({'PATH_INFO': path}, lambda status, headers: statuses.append(status))
+    list(response)
+    if hasattr(response, 'close'):
+        response.close()
+    return statuses[0]
+
+
+def test_admission_controller_limits_budgets():
+    paths = AdmissionBudget(limit=1, queue_size=1, timeout=1)
+    updates = AdmissionBudget(limit=1, queue_size=1, timeout=0.01)
+    controller = AdmissionController(
+        slow_app,
+        dict(paths=paths, updates=updates),
+        lambda environ: environ['PATH_INFO'].strip('/') or None,
+    )
+
+    # one running, one waiting and one rejected request
+    requests = [gevent.spawn(request, controller, '/paths') for _ in range(3)]
+    gevent.sleep(0.01)
+    assert paths.stats() == dict(running=1, waiting=1, admitted=1, rejected=1, timed_out=0)
+    # the updates budget and requests without a budget are not affected
+    assert request(controller, '/updates') == '200 OK'
+    assert request(controller, '/') == '200 OK'
+
+    gevent.joinall(requests)
+    assert [r.value for r in requests] == ['200 OK', '200 OK', '429 Too Many Requests']
+    assert paths.stats() == dict(running=0, waiting=0, admitted=2, rejected=1, timed_out=0)
+
+    # requests still waiting at their deadline are rejected
+    requests = [gevent.spawn(request, controller, '/updates') for _ in range(2)]
+    gevent.joinall(requests)
+    assert [r.value for r in requests] == ['200 OK', '503 Service Unavailable']
+    assert updates.stats() == dict(running=0, waiting=0, admitted=2, rejected=0, timed_out=1)
@@ -0,0 +1,15 @@
+from pathfinder.utils.coalescing import CoalescingQueue
+
+
+def test_coalescing_queue_keeps_highest_nonce():
+    queue = CoalescingQueue()
+    queue.put('a', 2, 'a2')
+    queue.put('b', 1, 'b1')
+    queue.put('a', 3, 'a3')
+    queue.put('a', 1, 'a1')
+
+    assert len(queue) == 2
+    assert queue.dropped == 2
+    assert queue.take() == ['a3', 'b1']
+    assert len(queue) == 0
+    assert queue.take() == []
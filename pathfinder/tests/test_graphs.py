@@ -1,16 +1,20 @@
+import itertools
 import random
 from math import isclose
-from typing import List
+from typing import Callable, List
 import time
+import tracemalloc
 
+import networkx as nx
 import numpy as np
 import pytest
 from _pytest.monkeypatch import MonkeyPatch
 from networkx import NetworkXNoPath
-from raiden_libs.types import Address
+from raiden_libs.types import Address, ChannelIdentifier
+from web3 import Web3
 
 import pathfinder.model.token_network
-from pathfinder.model import ChannelView, TokenNetwork
+from pathfinder.model import ChannelView, CSRGraph, TokenNetwork
 
 
 def test_routing_benchmark(
@@ -152,3 +156,565 @@ def test_routing_hop_fee_balance(
         'path': [addresses[1], addresses[4]],
         'estimated_fee': 0.01
     }
+
+
+def test_csr_backend_matches_networkx(
+    token_networks: List[TokenNetwork],
+    populate_token_networks: Callable,
+    private_keys: List[str],
+    addresses: List[Address],
+    web3: Web3,
+    channel_descriptions_case_1: List,
+):
+    networkx_network = token_networks[0]
+    csr_network = TokenNetwork(networkx_network.address, graph_backend='csr')
+    populate_token_networks(
+        [networkx_network, csr_network],
+        private_keys,
+        addresses,
+        web3,
+        channel_descriptions_case_1,
+    )
+
+    assert isinstance(csr_network.G, CSRGraph)
+    assert csr_network.G.number_of_edges() == networkx_network.G.number_of_edges()
+    view: ChannelView = csr_network.G[addresses[0]][addresses[1]]['view']
+    assert view.capacity == 90
+
+    for source, target in itertools.permutations(addresses[:7], 2):
+        for hop_bias in (0, 0.5, 1):
+            try:
+                expected = networkx_network.get_paths(
+                    source,
+                    target,
+                    value=10,
+                    k=3,
+                    hop_bias=hop_bias
+                )
+            except NetworkXNoPath:
+                with pytest.raises(NetworkXNoPath):
+                    csr_network.get_paths(source, target, value=10, k=3, hop_bias=hop_bias)
+                continue
+
+            assert csr_network.get_paths(
+                source,
+                target,
+                value=10,
+                k=3,
+                hop_bias=hop_bias
+            ) == expected
+
+
+def test_csr_graph_compaction(addresses: List[Address]):
+    graph = CSRGraph(compaction_threshold=0.1, compaction_min_edges=4)
+    for channel_id, (node1, node2) in enumerate(zip(addresses[:10], addresses[1:11])):
+        graph.add_edge(node1, node2, view=ChannelView(channel_id, node1, node2, deposit=10))
+        graph.add_edge(node2, node1, view=ChannelView(channel_id, node2, node1, deposit=20))
+
+    # mutations beyond the threshold fold the overlay into the CSR index
+    assert graph._overlay_size < 4
+    assert graph.number_of_edges() == 20
+
+    graph.remove_edge(addresses[0], addresses[1])
+    graph.remove_edge(addresses[1], addresses[0])
+    graph.compact()
+    assert graph.number_of_edges() == 18
+    assert not graph.has_edge(addresses[0], addresses[1])
+    assert list(graph[addresses[2]]) == [addresses[1], addresses[3]]
+
+    edge = graph.edge_id(addresses[2], addresses[3])
+    reverse_edge = graph.reverse[edge]
+    assert graph.targets[reverse_edge] == graph.node_id(addresses[2])
+    assert graph.capacity(edge) == 10
+    assert graph.capacity(reverse_edge) == 20
+
+    # capacities beyond int64 are kept exactly
+    view = graph[addresses[2]][addresses[3]]['view']
+    view.update_capacity(deposit=2 ** 80)
+    graph.update_edge(addresses[2], addresses[3])
+    assert graph.capacity(edge) == 2 ** 80
+
+
+def test_csr_graph_weight_array(addresses: List[Address]):
+    graph = CSRGraph()
+    for channel_id, (node1, node2) in enumerate(zip(addresses[:3], addresses[1:4])):
+        graph.add_edge(node1, node2, view=ChannelView(channel_id, node1, node2, deposit=10))
+        graph.add_edge(node2, node1, view=ChannelView(channel_id, node2, node1, deposit=2 ** 80))
+    graph.remove_edge(addresses[2], addresses[3])
+
+    weights = graph.weight_array(value=10, offset=0.5, fee_factor=0.5)
+    assert len(weights) == 6
+    assert list(np.isinf(weights)) == [False, False, False, False, True, False]
+    assert weights[0] == 0.5 + 0.5 * graph.fees[0]
+
+    # only the exact large capacities can carry values beyond int64
+    weights = graph.weight_array(value=2 ** 70, offset=0, fee_factor=1)
+    assert list(np.isinf(weights)) == [True, False, True, False, True, False]
+
+    path = graph.dijkstra_path_weights(addresses[2], addresses[0], weights.tolist())
+    assert path == [addresses[2], addresses[1], addresses[0]]
+    with pytest.raises(NetworkXNoPath):
+        graph.dijkstra_path_weights(addresses[0], addresses[2], weights.tolist())
+
+
+def test_routing_yen_case2(
+    token_networks: List[TokenNetwork],
+    populate_token_networks_case_2: None,
+    addresses: List[Address],
+    monkeypatch: MonkeyPatch
+):
+    token_network = token_networks[0]
+
+    # the k cheapest loopless paths, by increasing fee
+    paths = token_network.get_paths(addresses[0], addresses[4], value=10, k=3, strategy='yen')
+    assert [path['path'] for path in paths] == [
+        [addresses[0], addresses[2], addresses[5], addresses[4]],
+        [addresses[0], addresses[2], addresses[3], addresses[4]],
+        [addresses[0], addresses[1], addresses[4]],
+    ]
+    assert isclose(paths[0]['estimated_fee'], 0.3)
+    assert isclose(paths[1]['estimated_fee'], 0.4)
+    assert isclose(paths[2]['estimated_fee'], 0.5)
+
+    # a high diversity penalty prefers the disjoint path, as the iterative strategy does
+    monkeypatch.setattr(pathfinder.model.token_network, 'DIVERSITY_PEN_DEFAULT', 1)
+    paths = token_network.get_paths(
+        addresses[0],
+        addresses[4],
+        value=10,
+        k=3,
+        strategy='yen',
+        diversity_penalty=True,
+    )
+    assert [path['path'] for path in paths] == [
+        [addresses[0], addresses[2], addresses[5], addresses[4]],
+        [addresses[0], addresses[1], addresses[4]],
+        [addresses[0], addresses[2], addresses[3], addresses[4]],
+    ]
+
+    # there are only three loopless paths
+    paths = token_network.get_paths(addresses[0], addresses[4], value=10, k=10, strategy='yen')
+    assert len(paths) == 3
+
+
+def test_routing_yen_matches_networkx(
+    token_networks: List[TokenNetwork],
+    populate_token_networks_random: None
+):
+    token_network = token_networks[0]
+    value = 100
+
+    def weight(u, v, attr):
+        view: ChannelView = attr['view']
+        return None if view.capacity < value else view.percentage_fee
+
+    random.seed(42)
+    for _ in range(20):
+        source, target = random.sample(list(token_network.G.nodes), 2)
+        try:
+            expected = list(itertools.islice(
+                nx.shortest_simple_paths(token_network.G, source, target, weight=weight),
+                5
+            ))
+        except NetworkXNoPath:
+            continue
+
+        paths = token_network.get_paths(source, target, value=value, k=5, strategy='yen')
+        assert len(paths) == len(expected)
+        for path, expected_path in zip(paths, expected):
+            expected_fee = sum(
+                token_network.G[node1][node2]['view'].percentage_fee
+                for node1, node2 in zip(expected_path[:-1], expected_path[1:])
+            )
+            assert isclose(path['estimated_fee'], expected_fee)
+
+
+def test_routing_landmarks_match_dijkstra(
+    token_networks: List[TokenNetwork],
+    populate_token_networks: Callable,
+    private_keys: List[str],
+    addresses: List[Address],
+    web3: Web3,
+    channel_descriptions_case_1: List,
+):
+    dijkstra_network = token_networks[0]
+    landmark_network = TokenNetwork(dijkstra_network.address, num_landmarks=2)
+    populate_token_networks(
+        [dijkstra_network, landmark_network],
+        private_keys,
+        addresses,
+        web3,
+        channel_descriptions_case_1,
+    )
+
+    def assert_same_fees():
+        for source, target in itertools.permutations(addresses[:7], 2):
+            for hop_bias in (0, 0.5, 1):
+                try:
+                    expected = dijkstra_network.get_paths(
+                        source,
+                        target,
+                        value=10,
+                        k=3,
+                        hop_bias=hop_bias
+                    )
+                except NetworkXNoPath:
+                    with pytest.raises(NetworkXNoPath):
+                        landmark_network.get_paths(
+                            source,
+                            target,
+                            value=10,
+                            k=3,
+                            hop_bias=hop_bias
+                        )
+                    continue
+
+                paths = landmark_network.get_paths(
+                    source,
+                    target,
+                    value=10,
+                    k=3,
+                    hop_bias=hop_bias
+                )
+                assert [path['estimated_fee'] for path in paths] == pytest.approx(
+                    [path['estimated_fee'] for path in expected]
+                )
+
+    assert_same_fees()
+    assert landmark_network.landmarks is not None
+    assert not landmark_network.landmarks.needs_refresh
+
+    # a small fee decrease is absorbed by the slack of the landmark tables
+    for token_network in (dijkstra_network, landmark_network):
+        token_network.update_fee(
+            channel_identifier=1,
+            signer=addresses[1],
+            nonce=100,
+            new_percentage_fee=0.0007
+        )
+    assert landmark_network.landmarks.slack == pytest.approx(0.0001)
+    assert not landmark_network.landmarks.needs_refresh
+    assert_same_fees()
+
+
+def test_path_cache_invalidation(
+    token_networks: List[TokenNetwork],
+    populate_token_networks: Callable,
+    private_keys: List[str],
+    addresses: List[Address],
+    web3: Web3,
+    channel_descriptions_case_1: List,
+):
+    token_network = TokenNetwork(token_networks[0].address, path_cache_size=2)
+    populate_token_networks(
+        [token_network],
+        private_keys,
+        addresses,
+        web3,
+        channel_descriptions_case_1,
+    )
+    cache = token_network.path_cache
+
+    paths = token_network.get_paths(addresses[0], addresses[3], value=10, k=1)
+    assert paths[0]['path'] == [addresses[0], addresses[1], addresses[2], addresses[3]]
+    assert token_network.get_paths(addresses[0], addresses[3], value=10, k=1) == paths
+    assert cache.stats() == dict(size=1, hits=1, misses=1, evictions=0, invalidations=0)
+
+    # returned results are copies
+    paths[0]['path'].clear()
+    assert len(token_network.get_paths(addresses[0], addresses[3], value=10, k=1)[0]['path']) == 4
+
+    # updates of unrelated channels keep the entry
+    token_network.update_fee(
+        channel_identifier=6,
+        signer=addresses[5],
+        nonce=100,
+        new_percentage_fee=0.003
+    )
+    token_network.get_paths(addresses[0], addresses[3], value=10, k=1)
+    assert cache.hits == 3
+
+    # updates of a channel on the path drop it
+    token_network.update_fee(
+        channel_identifier=1,
+        signer=addresses[1],
+        nonce=100,
+        new_percentage_fee=0.0009
+    )
+    assert len(cache) == 0
+    paths = token_network.get_paths(addresses[0], addresses[3], value=10, k=1)
+    assert paths[0]['estimated_fee'] == pytest.approx(0.0026)
+    assert cache.misses == 2
+
+    token_network.get_paths(addresses[0], addresses[1], value=10, k=1)
+    token_network.get_paths(addresses[1], addresses[0], value=10, k=1)
+    assert cache.evictions == 1
+    assert len(cache) == 2
+
+    token_network.handle_channel_closed_event(ChannelIdentifier(0))
+    assert len(cache) == 0
+
+    # results are not cached if the network changed while the caller held the search
+    search = token_network.iter_paths(addresses[1], addresses[3], value=10, k=1)
+    assert next(search)['path'] == [addresses[1], addresses[2], addresses[3]]
+    token_network.update_fee(
+        channel_identifier=2,
+        signer=addresses[2],
+        nonce=100,
+        new_percentage_fee=0.002
+    )
+    assert list(search) == []
+    assert len(cache) == 0
+    paths = token_network.get_paths(addresses[1], addresses[3], value=10, k=1)
+    assert paths[0]['estimated_fee'] == pytest.approx(0.0029)
+
+
+def test_component_index(
+    token_networks: List[TokenNetwork],
+    populate_token_networks_case_1: None,
+    addresses: List[Address],
+):
+    token_network = token_networks[0]
+    components = token_network.components
+
+    assert components.connected(addresses[0], addresses[4])
+    assert components.connected(addresses[5], addresses[6])
+    assert not components.connected(addresses[0], addresses[5])
+    assert not components.connected(addresses[0], addresses[10])
+
+    with pytest.raises(NetworkXNoPath):
+        token_network.check_route(addresses[0], addresses[6])
+    with pytest.raises(nx.NodeNotFound):
+        token_network.get_paths(addresses[10], addresses[0], value=10, k=1)
+
+    # splitting off 4 needs a rebuild of the index
+    token_network.handle_channel_closed_event(ChannelIdentifier(3))
+    token_network.handle_channel_closed_event(ChannelIdentifier(5))
+    assert components.stale
+    with pytest.raises(NetworkXNoPath):
+        token_network.get_paths(addresses[0], addresses[4], value=10, k=1)
+    assert not components.stale
+    assert components.connected(addresses[0], addresses[3])
+
+    token_network.handle_channel_opened_event(ChannelIdentifier(7), addresses[4], addresses[6])
+    assert components.connected(addresses[5], addresses[4])
+    token_network.check_route(addresses[4], addresses[5])
+
+
+def test_fee_update_benchmark(
+    token_networks: List[TokenNetwork],
+    populate_token_networks_random: None
+):
+    token_network = token_networks[0]
+
+    def announced_fees():
+        return [
+            edge_data['view'].percentage_fee
+            for _, _, edge_data in token_network.G.edges(data=True)
+            if edge_data['view'].fee_info_nonce > 0
+        ]
+
+    max_view: ChannelView = max(
+        (edge_data['view'] for _, _, edge_data in token_network.G.edges(data=True)),
+        key=lambda view: view.percentage_fee
+    )
+    assert token_network.max_percentage_fee == max(announced_fees())
+
+    # the channel holding the maximum flaps its fee
+    times = []
+    start = time.time()
+    for i in range(1000):
+        tic = time.time()
+        token_network.update_fee(
+            channel_identifier=max_view.channel_id,
+            signer=max_view.self,
+            nonce=max_view.fee_info_nonce + 1,
+            new_percentage_fee=0.1 if i % 2 == 0 else 0.0
+        )
+        toc = time.time()
+        times.append(toc - tic)
+    end = time.time()
+    assert token_network.max_percentage_fee == max(announced_fees())
+
+    print(np.mean(np.array(times)), np.min(np.array(times)), np.max(np.array(times)))
+    print("total_runtime = {}".format(end-start))
+
+
+def test_channel_view_benchmark(addresses: List[Address]):
+    num_views = 10000
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    views = [
+        ChannelView(ChannelIdentifier(i), addresses[0], addresses[1], deposit=100)
+        for i in range(num_views)
+    ]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert not hasattr(views[0], '__dict__')
+
+    start = time.time()
+    for i, view in enumerate(views):
+        view.update_capacity(nonce=1, transferred_amount=i % 100, locked_amount=1)
+        view.update_capacity(received_amount=5)
+    end = time.time()
+    assert views[10].capacity == 100 - (10 + 1) + 5
+
+    print("bytes per view = {}".format((after - before) / num_views))
+    print("update_capacity = {}us".format((end - start) / (2 * num_views) * 1e6))
+
+
+def test_routing_batch_matches_single_queries(
+    token_networks: List[TokenNetwork],
+    populate_token_networks_random: None
+):
+    token_network = token_networks[0]
+
+    random.seed(7)
+    nodes = list(token_network.G.nodes)
+    sources = random.sample(nodes, 3)
+    queries = [
+        (source, target, 100, 3)
+        for source in sources
+        for target in random.sample(nodes, 10)
+        if source != target
+    ]
+
+    for strategy in ('diversity', 'yen'):
+        results = token_network.get_paths_batch(queries, strategy=strategy)
+        assert len(results) == len(queries)
+        for (source, target, value, k), result in zip(queries, results):
+            try:
+                expected = token_network.get_paths(source, target, value, k, strategy=strategy)
+            except NetworkXNoPath:
+                assert isinstance(result, NetworkXNoPath)
+                continue
+            assert result == expected
+
+
+def test_routing_time_budget(
+    token_networks: List[TokenNetwork],
+    populate_token_networks_case_1: None,
+    addresses: List[Address],
+    monkeypatch: MonkeyPatch
+):
+    token_network = token_networks[0]
+    yields = []
+    monkeypatch.setattr(
+        pathfinder.model.token_network.gevent,
+        'sleep',
+        lambda seconds: yields.append(seconds)
+    )
+
+    paths = token_network.get_paths(addresses[0], addresses[2], value=10, k=3)
+    assert len(paths) == 2
+    assert not paths.partial
+    assert yields
+
+    for strategy in ('diversity', 'yen'):
+        paths = token_network.get_paths(
+            addresses[0],
+            addresses[2],
+            value=10,
+            k=3,
+            strategy=strategy,
+            max_time_ms=0
+        )
+        assert paths.partial
+        assert paths == [{
+            'path': [addresses[0], addresses[1], addresses[2]],
+            'estimated_fee': 0.0018
+        }]
+
+
+def test_routing_iter_paths(
+    token_networks: List[TokenNetwork],
+    populate_token_networks_case_1: None,
+    addresses: List[Address]
+):
+    token_network = token_networks[0]
+    expected = token_network.get_paths(addresses[0], addresses[2], value=10, k=3)
+
+    search = token_network.iter_paths(addresses[0], addresses[2], value=10, k=3)
+    # the first path is found before the next search
+    assert next(search) == expected[0]
+    assert list(search) == expected[1:]
+
+    search = token_network.iter_paths(addresses[0], addresses[2], value=10, k=3, max_time_ms=0)
+    assert next(search) == expected[0]
+    with pytest.raises(StopIteration) as stop:
+        next(search)
+    assert stop.value.value is True
+
+    with pytest.raises(NetworkXNoPath):
+        next(token_network.iter_paths(addresses[0], addresses[5], value=10, k=3))
+
+    # Yen's paths are found at once, the channel 3 -> 4 of the second one is closed before
+    # it is taken
+    search = token_network.iter_paths(addresses[0], addresses[2], value=10, k=3, strategy='yen')
+    assert next(search) == expected[0]
+    token_network.handle_channel_closed_event(ChannelIdentifier(3))
+    with pytest.raises(StopIteration) as stop:
+        next(search)
+    assert stop.value.value is True
+
+
+def test_routing_network_changes_during_search(
+    token_networks: List[TokenNetwork],
+    populate_token_networks: Callable,
+    private_keys: List[str],
+    addresses: List[Address],
+    web3: Web3,
+    channel_descriptions_case_1: List,
+    monkeypatch: MonkeyPatch
+):
+    networkx_network = token_networks[0]
+    csr_network = TokenNetwork(networkx_network.address, graph_backend='csr')
+    populate_token_networks(
+        [networkx_network, csr_network],
+        private_keys,
+        addresses,
+        web3,
+        channel_descriptions_case_1,
+    )
+
+    # changes applied by other greenlets while a search yields
+    changes: List[Callable[[], None]] = []
+
+    def sleep(seconds: float):
+        while changes:
+            changes.pop()()
+
+    monkeypatch.setattr(pathfinder.model.token_network.gevent, 'sleep', sleep)
+
+    for token_network in (networkx_network, csr_network):
+        def close_first_path(token_network=token_network):
+            token_network.handle_channel_closed_event(ChannelIdentifier(1))
+            token_network.handle_channel_opened_event(
+                ChannelIdentifier(100),
+                addresses[0],
+                addresses[3],
+            )
+
+        changes.append(close_first_path)
+        paths = token_network.get_paths(addresses[0], addresses[2], value=10, k=3)
+        assert not changes
+        assert [path['path'] for path in paths] == [
+            # found before the channel 1 -> 2 was closed
+            [addresses[0], addresses[1], addresses[2]],
+            [addresses[0], addresses[1], addresses[4], addresses[3], addresses[2]],
+        ]
+
+        def open_and_close(token_network=token_network):
+            token_network.handle_channel_opened_event(
+                ChannelIdentifier(101),
+                addresses[0],
+                addresses[4],
+            )
+            token_network.handle_channel_closed_event(ChannelIdentifier(6))
+
+        queries = [(addresses[0], addresses[target], 10, 3) for target in (2, 3, 4)]
+        changes.append(open_and_close)
+        results = token_network.get_paths_batch(queries)
+        assert not changes
+        assert results == [token_network.get_paths(*query) for query in queries]
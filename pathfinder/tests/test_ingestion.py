@@ -0,0 +1,85 @@
+from typing import List
+from unittest import mock
+
+import gevent
+from raiden_libs.messages import BalanceProof
+from raiden_libs.types import Address
+
+from pathfinder.ingestion import IngestionPipeline, ReceivedQueue
+
+
+def make_balance_proof(token_network_address: Address, channel_identifier: int, nonce: int):
+    return BalanceProof(
+        channel_identifier=channel_identifier,
+        token_network_address=token_network_address,
+        nonce=nonce,
+        chain_id=321,
+        locksroot="0x%064x" % 0,
+        transferred_amount=0,
+        locked_amount=0,
+        additional_hash="0x%064x" % 0,
+    )
+
+
+def test_received_queue_drops_oldest_of_channel(token_network_addresses: List[Address]):
+    queue = ReceivedQueue(3, 'drop-oldest')
+    for channel_identifier, nonce in [(1, 1), (2, 1), (1, 2), (1, 3), (3, 1)]:
+        queue.put(make_balance_proof(token_network_addresses[0], channel_identifier, nonce))
+
+    # the oldest message of channel 1 makes room for its newer one, channel 3 replaces the
+    # oldest message of all
+    assert len(queue) == 3
+    assert queue.dropped == 2
+    messages = queue.get_batch(10)
+    assert [(m.channel_identifier, m.nonce) for m in messages] == [(1, 2), (1, 3), (3, 1)]
+    assert len(queue) == 0
+
+
+def test_received_queue_pauses_when_full(token_network_addresses: List[Address]):
+    queue = ReceivedQueue(2, 'pause')
+    producer = gevent.spawn(lambda: [
+        queue.put(make_balance_proof(token_network_addresses[0], 1, nonce))
+        for nonce in range(1, 5)
+    ])
+    gevent.sleep(0.01)
+    assert not producer.ready()
+    assert len(queue) == 2
+
+    assert [m.nonce for m in queue.get_batch(1)] == [1]
+    gevent.sleep(0.01)
+    assert [m.nonce for m in queue.get_batch(10)] == [2, 3]
+    gevent.sleep(0.01)
+    assert [m.nonce for m in queue.get_batch(10)] == [4]
+    producer.join(timeout=1)
+    assert producer.ready()
+    assert queue.dropped == 0
+
+
+def test_pipeline_stop_applies_queued_messages(
+    token_network_addresses: List[Address],
+    addresses: List[Address]
+):
+    applied: List[BalanceProof] = []
+
+    def apply_messages(messages, signers):
+        applied.extend(messages)
+        return [None] * len(messages)
+
+    pipeline = IngestionPipeline(apply_messages, coalesce_interval=10)
+    with mock.patch('pathfinder.ingestion.recover_signer', return_value=addresses[0]):
+        pipeline.start()
+        for channel_identifier in (1, 2):
+            pipeline.put(make_balance_proof(token_network_addresses[0], channel_identifier, 1))
+        gevent.sleep(0.01)
+        # the verified messages wait for the interval, the next one was not verified yet
+        assert len(pipeline.pending) == 2
+        pipeline.put(make_balance_proof(token_network_addresses[0], 3, 1))
+        assert len(pipeline.received) == 1
+        assert applied == []
+
+        pipeline.stop()
+
+    assert sorted(m.channel_identifier for m in applied) == [1, 2, 3]
+    assert pipeline.stats()['applied'] == 3
+    assert len(pipeline.pending) == 0
+    assert len(pipeline.received) == 0
@@ -0,0 +1,96 @@
+import pickle
+from typing import List
+
+from raiden_libs.types import Address
+
+from pathfinder.journal import Journal, journal_path, read_records
+from pathfinder.model import TokenNetwork
+
+
+def test_journal_replays_latest_updates(
+    token_networks: List[TokenNetwork],
+    populate_token_networks_case_1: None,
+    addresses: List[Address],
+    tmpdir,
+):
+    token_network = token_networks[0]
+    # the state saved before the journaled updates
+    saved_token_network = pickle.loads(pickle.dumps(token_network))
+
+    path = journal_path(str(tmpdir), token_network.address)
+    journal = Journal(path, compaction_factor=2, compaction_min_records=4)
+    journal.start()
+    token_network.add_mutation_listener(journal.on_mutation)
+    for nonce in range(2, 12):
+        token_network.update_balance(0, addresses[0], nonce, 20 + nonce, 0)
+    token_network.update_fee(0, addresses[1], 10, 0.005)
+    journal.stop()
+
+    # compacted to the latest update of both channel directions
+    assert len(list(read_records(path))) == 2
+    # a record cut off by a crash is ignored
+    with open(path, 'ab') as journal_file:
+        journal_file.write(b'\1' * 10)
+
+    journal = Journal(path)
+    assert journal.replay(saved_token_network) == 2
+    for source, target in [(addresses[0], addresses[1]), (addresses[1], addresses[0])]:
+        view = token_network.G[source][target]['view']
+        saved_view = saved_token_network.G[source][target]['view']
+        assert saved_view.capacity == view.capacity
+        assert saved_view.balance_proof_nonce == view.balance_proof_nonce
+        assert saved_view.fee_info_nonce == view.fee_info_nonce
+        assert saved_view.percentage_fee == view.percentage_fee
+    assert saved_token_network.max_percentage_fee == token_network.max_percentage_fee
+
+    # updates contained in the saved state are skipped
+    assert Journal(path).replay(token_network) == 0
+
+    # saving the state empties the journal
+    journal.start()
+    journal.reset()
+    journal.stop()
+    assert list(read_records(path)) == []
+
+
+def test_journal_defers_updates_of_unknown_channels(
+    token_networks: List[TokenNetwork],
+    populate_token_networks_case_1: None,
+    addresses: List[Address],
+    tmpdir,
+):
+    token_network = token_networks[0]
+    saved_token_network = pickle.loads(pickle.dumps(token_network))
+
+    path = journal_path(str(tmpdir), token_network.address)
+    journal = Journal(path)
+    journal.start()
+    token_network.add_mutation_listener(journal.on_mutation)
+    # a channel opened after the state was saved
+    token_network.handle_channel_opened_event(100, addresses[7], addresses[8])
+    token_network.handle_channel_new_deposit_event(100, addresses[7], 50)
+    token_network.update_balance(100, addresses[7], 1, 20, 0)
+    token_network.update_fee(100, addresses[8], 1, 0.005)
+    journal.stop()
+
+    # the updates are kept until the listener reports the channel again, also when the
+    # state is saved meanwhile
+    journal = Journal(path)
+    assert journal.replay(saved_token_network) == 0
+    assert list(journal.deferred) == [100]
+    journal.start()
+    saved_token_network.add_mutation_listener(journal.on_mutation)
+    journal.reset()
+
+    saved_token_network.handle_channel_opened_event(100, addresses[7], addresses[8])
+    saved_token_network.handle_channel_new_deposit_event(100, addresses[7], 50)
+    assert journal.replay_channel(saved_token_network, 100) == 2
+    journal.stop()
+    assert journal.deferred == {}
+    assert len(list(read_records(path))) == 2
+
+    for source, target in [(addresses[7], addresses[8]), (addresses[8], addresses[7])]:
+        view = token_network.G[source][target]['view']
+        saved_view = saved_token_network.G[source][target]['view']
+        assert saved_view.capacity == view.capacity
+        assert saved_view.percentage_fee == view.percentage_fee
@@ -5,14 +5,24 @@ The tests in this module mock events creation by using a mock blockchain listene
 This makes them a lot faster than using full blockchain based approach and they should
 be used most of the time to keep test times short.
 """
+import os
 from typing import List
 
+import gevent
+from eth_utils import encode_hex
 from unittest.mock import Mock
 from raiden_contracts.contract_manager import ContractManager
+from raiden_libs.messages import BalanceProof
 from raiden_libs.test.mocks.blockchain import BlockchainListenerMock
 from raiden_libs.types import Address
+from raiden_libs.utils.signing import sign_data
 
 from pathfinder.model import TokenNetwork
+from pathfinder.model.state_snapshot import (
+    load_checkpoints,
+    state_snapshot_path,
+    token_network_resume_block,
+)
 from pathfinder.pathfinding_service import PathfindingService
 
 
@@ -340,3 +350,323 @@ def test_pfs_follow_networks_has_precedence_over_listener(
 
     # this shouldn't change
     assert len(pathfinding_service.token_networks.keys()) == 2
+
+
+def test_pfs_restores_state_snapshot(
+    contracts_manager: ContractManager,
+    token_networks: List[TokenNetwork],  # just used for addresses
+    addresses: List[Address],
+    tmpdir,
+):
+    token_network_address = token_networks[0].address
+
+    def create_pathfinding_service() -> PathfindingService:
+        return PathfindingService(
+            contracts_manager,
+            transport=Mock(),
+            token_network_listener=BlockchainListenerMock(),
+            follow_networks=[token_network_address],
+            state_dir=str(tmpdir),
+        )
+
+    opened_event = dict(
+        address=token_network_address,
+        name='ChannelOpened',
+        blockNumber=10,
+        args=dict(
+            channel_identifier=1,
+            participant1=addresses[0],
+            participant2=addresses[1]
+        )
+    )
+
+    pathfinding_service = create_pathfinding_service()
+    network_listener = pathfinding_service.token_network_listener
+    network_listener.emit_event(opened_event)
+    network_listener.emit_event(dict(
+        address=token_network_address,
+        name='ChannelNewDeposit',
+        blockNumber=11,
+        args=dict(
+            channel_identifier=1,
+            participant=addresses[0],
+            deposit=100
+        )
+    ))
+    token_network = pathfinding_service.token_networks[token_network_address]
+    token_network.update_balance(1, addresses[0], 1, 30, 0)
+    token_network.update_fee(1, addresses[1], 1, 0.002)
+    pathfinding_service.stop()
+
+    # the new service restores the state, including the balance proof and fee info
+    pathfinding_service = create_pathfinding_service()
+    network_listener = pathfinding_service.token_network_listener
+    token_network = pathfinding_service.token_networks[token_network_address]
+    assert token_network.channel_id_to_addresses == {1: (addresses[0], addresses[1])}
+    view = token_network.G[addresses[0]][addresses[1]]['view']
+    assert view.capacity == 70
+    assert view.balance_proof_nonce == 1
+    assert token_network.G[addresses[1]][addresses[0]]['view'].fee_info_nonce == 1
+    assert token_network.max_percentage_fee == 0.002
+
+    # events of restored blocks are skipped, later ones applied
+    network_listener.emit_event(opened_event)
+    network_listener.emit_event(dict(
+        address=token_network_address,
+        name='ChannelNewDeposit',
+        blockNumber=12,
+        args=dict(
+            channel_identifier=1,
+            participant=addresses[1],
+            deposit=50
+        )
+    ))
+    assert token_network.G[addresses[0]][addresses[1]]['view'].capacity == 70
+    assert token_network.G[addresses[1]][addresses[0]]['view'].capacity == 80
+    assert pathfinding_service.last_event == (12, 0)
+
+
+def test_pfs_saves_listener_checkpoints(
+    contracts_manager: ContractManager,
+    token_networks: List[TokenNetwork],  # just used for addresses
+    addresses: List[Address],
+    tmpdir,
+):
+    token_network_address = token_networks[0].address
+
+    def create_pathfinding_service() -> PathfindingService:
+        return PathfindingService(
+            contracts_manager,
+            transport=Mock(),
+            token_network_listener=BlockchainListenerMock(),
+            token_network_registry_listener=BlockchainListenerMock(),
+            state_dir=str(tmpdir),
+        )
+
+    pathfinding_service = create_pathfinding_service()
+    pathfinding_service.token_network_registry_listener.emit_event(dict(
+        name='TokenNetworkCreated',
+        blockNumber=5,
+        args=dict(
+            token_network_address=token_network_address
+        )
+    ))
+    pathfinding_service.token_network_listener.emit_event(dict(
+        address=token_network_address,
+        name='ChannelOpened',
+        blockNumber=10,
+        args=dict(
+            channel_identifier=1,
+            participant1=addresses[0],
+            participant2=addresses[1]
+        )
+    ))
+    pathfinding_service.stop()
+    checkpoints = load_checkpoints(str(tmpdir))
+    # the last blocks with events may not be complete yet
+    assert checkpoints == {
+        'token_network': 9,
+        'token_network_registry': 4,
+        'token_networks': {token_network_address: 9},
+    }
+    # networks registered after the registry checkpoint need their events since then
+    assert token_network_resume_block(str(tmpdir), checkpoints, []) == 4
+
+    # the resumed registry listener does not report the network again
+    pathfinding_service = create_pathfinding_service()
+    token_network = pathfinding_service.token_networks[token_network_address]
+    assert token_network.channel_id_to_addresses == {1: (addresses[0], addresses[1])}
+
+
+def test_pfs_saves_state_within_block(
+    contracts_manager: ContractManager,
+    token_networks: List[TokenNetwork],  # just used for addresses
+    addresses: List[Address],
+    tmpdir,
+):
+    token_network_address = token_networks[0].address
+
+    def create_pathfinding_service() -> PathfindingService:
+        return PathfindingService(
+            contracts_manager,
+            transport=Mock(),
+            token_network_listener=BlockchainListenerMock(),
+            follow_networks=[token_network_address],
+            state_dir=str(tmpdir),
+        )
+
+    events = [
+        dict(
+            address=token_network_address,
+            name='ChannelOpened',
+            blockNumber=10,
+            logIndex=0,
+            args=dict(
+                channel_identifier=1,
+                participant1=addresses[0],
+                participant2=addresses[1]
+            )
+        ),
+        dict(
+            address=token_network_address,
+            name='ChannelNewDeposit',
+            blockNumber=10,
+            logIndex=1,
+            args=dict(
+                channel_identifier=1,
+                participant=addresses[0],
+                deposit=100
+            )
+        ),
+        dict(
+            address=token_network_address,
+            name='ChannelOpened',
+            blockNumber=10,
+            logIndex=2,
+            args=dict(
+                channel_identifier=2,
+                participant1=addresses[1],
+                participant2=addresses[2]
+            )
+        ),
+    ]
+
+    # the state is saved after the first two events of the block
+    pathfinding_service = create_pathfinding_service()
+    for event in events[:2]:
+        pathfinding_service.token_network_listener.emit_event(event)
+    pathfinding_service.save_state()
+    assert load_checkpoints(str(tmpdir))['token_network'] == 9
+    pathfinding_service.stop()
+
+    # the whole block is synced again, only the remaining event is applied
+    pathfinding_service = create_pathfinding_service()
+    for event in events:
+        pathfinding_service.token_network_listener.emit_event(event)
+    token_network = pathfinding_service.token_networks[token_network_address]
+    assert token_network.channel_id_to_addresses == {
+        1: (addresses[0], addresses[1]),
+        2: (addresses[1], addresses[2]),
+    }
+    assert token_network.G[addresses[0]][addresses[1]]['view'].capacity == 100
+
+
+def test_pfs_resumes_additional_token_network(
+    contracts_manager: ContractManager,
+    token_networks: List[TokenNetwork],  # just used for addresses
+    addresses: List[Address],
+    tmpdir,
+):
+    followed_addresses = [token_networks[0].address]
+
+    def create_pathfinding_service() -> PathfindingService:
+        return PathfindingService(
+            contracts_manager,
+            transport=Mock(),
+            token_network_listener=BlockchainListenerMock(),
+            follow_networks=followed_addresses,
+            state_dir=str(tmpdir),
+        )
+
+    def opened_event(token_network_address: Address, block: int) -> dict:
+        return dict(
+            address=token_network_address,
+            name='ChannelOpened',
+            blockNumber=block,
+            args=dict(
+                channel_identifier=1,
+                participant1=addresses[0],
+                participant2=addresses[1]
+            )
+        )
+
+    pathfinding_service = create_pathfinding_service()
+    pathfinding_service.token_network_listener.emit_event(
+        opened_event(token_networks[0].address, 10)
+    )
+    pathfinding_service.stop()
+    assert token_network_resume_block(
+        str(tmpdir), load_checkpoints(str(tmpdir)), followed_addresses
+    ) == 9
+
+    # the additional network has no saved state, the listener syncs from the first block
+    followed_addresses.append(token_networks[1].address)
+    assert token_network_resume_block(
+        str(tmpdir), load_checkpoints(str(tmpdir)), followed_addresses
+    ) == 0
+    pathfinding_service = create_pathfinding_service()
+    for token_network_address, block in [
+        (token_networks[1].address, 5),
+        (token_networks[0].address, 10),
+    ]:
+        pathfinding_service.token_network_listener.emit_event(
+            opened_event(token_network_address, block)
+        )
+    for token_network_address in followed_addresses:
+        token_network = pathfinding_service.token_networks[token_network_address]
+        assert token_network.channel_id_to_addresses == {1: (addresses[0], addresses[1])}
+    pathfinding_service.stop()
+    assert token_network_resume_block(
+        str(tmpdir), load_checkpoints(str(tmpdir)), followed_addresses
+    ) == 9
+
+    # a network whose state snapshot is missing is synced from the first block again
+    os.remove(state_snapshot_path(str(tmpdir), token_networks[1].address))
+    assert token_network_resume_block(
+        str(tmpdir), load_checkpoints(str(tmpdir)), followed_addresses
+    ) == 0
+
+
+def test_pfs_coalesces_balance_proofs(
+    contracts_manager: ContractManager,
+    token_networks: List[TokenNetwork],  # just used for addresses
+    addresses: List[Address],
+    private_keys: List[str],
+):
+    token_network_address = token_networks[0].address
+    pathfinding_service = PathfindingService(
+        contracts_manager,
+        transport=Mock(),
+        token_network_listener=BlockchainListenerMock(),
+        follow_networks=[token_network_address],
+        coalesce_interval=0.01,
+    )
+    pathfinding_service.token_network_listener.emit_event(dict(
+        address=token_network_address,
+        name='ChannelOpened',
+        args=dict(
+            channel_identifier=1,
+            participant1=addresses[0],
+            participant2=addresses[1]
+        )
+    ))
+    token_network = pathfinding_service.token_networks[token_network_address]
+    updates = []
+    token_network.add_mutation_listener(lambda method, args: updates.append(args))
+
+    for nonce in [1, 3, 2, 4]:
+        balance_proof = BalanceProof(
+            channel_identifier=1,
+            token_network_address=token_network_address,
+            nonce=nonce,
+            chain_id=321,
+            locksroot="0x%064x" % 0,
+            transferred_amount=0,
+            locked_amount=0,
+            additional_hash="0x%064x" % 0,
+        )
+        balance_proof.signature = encode_hex(
+            sign_data(private_keys[0], balance_proof.serialize_bin())
+        )
+        pathfinding_service.on_message_event(balance_proof)
+
+    ingestion = pathfinding_service.ingestion
+    assert ingestion is not None
+    ingestion.start()
+    gevent.sleep(0.1)
+    ingestion.stop()
+
+    # only the latest balance proof is applied
+    assert len(updates) == 1
+    assert updates[0][:3] == (1, addresses[0], 4)
+    assert ingestion.stats()['superseded'] == 3
@@ -1,13 +1,19 @@
+import json
+import time
 from typing import List, Dict
 from unittest import mock
 
+import pytest
 import requests
+from flask_restful import reqparse
 from eth_utils import to_normalized_address, encode_hex, is_same_address
 from raiden_libs.utils.signing import sign_data, private_key_to_address
 from raiden_libs.messages import FeeInfo, BalanceProof
 from raiden_libs.types import Address, ChannelIdentifier
 
-from pathfinder.api.rest import ServiceApi
+from pathfinder.api.encoding import dumps
+from pathfinder.api.rest import PATHS_ARGUMENTS, ServiceApi, parse_query_args
+from pathfinder.config import API_PATH
 from pathfinder.model import TokenNetwork
 
 
@@ -174,6 +180,66 @@ def test_put_balance_validation(
     assert response.json()['error'] == "'balance_hash' is a required property"
 
 
+def test_post_balance_batch(
+    api_sut: ServiceApi,
+    api_url: str,
+    token_networks: List[TokenNetwork],
+    token_network_addresses: List[Address],
+    addresses: List[Address],
+    private_keys: List[str],
+):
+    url = api_url + '/{}/balance/batch'.format(token_network_addresses[0])
+
+    def balance_proof_body(nonce: int, token_network_address: Address) -> Dict:
+        balance_proof = BalanceProof(
+            channel_identifier=0,
+            token_network_address=token_network_address,
+            nonce=nonce,
+            chain_id=321,
+            locksroot="0x%064x" % 0,
+            transferred_amount=30,
+            locked_amount=0,
+            additional_hash="0x%064x" % 0,
+        )
+        balance_proof.signature = encode_hex(
+            sign_data(private_keys[0], balance_proof.serialize_bin())
+        )
+        return balance_proof.serialize_full()
+
+    response = requests.post(url, json=[
+        balance_proof_body(2, token_network_addresses[0]),
+        balance_proof_body(1, token_network_addresses[0]),
+        balance_proof_body(3, token_network_addresses[1]),
+        'notamessage',
+    ])
+    assert response.status_code == 200
+    results = response.json()['result']
+    assert results[0] == {'status': 'ok'}
+    assert results[1] == {'error': 'Outdated balance proof.'}
+    assert results[2]['error'].startswith('The token network address from the message')
+    assert results[3]['error'] == 'Message must be an object: notamessage'
+    view = token_networks[0].G[addresses[0]][addresses[1]]['view']
+    assert view.balance_proof_nonce == 2
+    assert view.transferred_amount == 30
+
+    # one message per line
+    body = json.dumps(balance_proof_body(3, token_network_addresses[0]))
+    response = requests.post(
+        url,
+        data='{}\n\nnotjson\n'.format(body),
+        headers={'Content-Type': 'application/x-ndjson'},
+    )
+    assert response.status_code == 200
+    results = response.json()['result']
+    assert len(results) == 2
+    assert results[0] == {'status': 'ok'}
+    assert results[1]['error'].startswith('Invalid JSON')
+    assert view.balance_proof_nonce == 3
+
+    response = requests.post(url, json={'messages': []})
+    assert response.status_code == 400
+
+
 #
 # tests for /fee endpoint
 #
@@ -215,6 +281,40 @@ def test_put_fee(
     assert fee == 0.02
 
 
+def test_post_fee_batch(
+    api_sut: ServiceApi,
+    api_url: str,
+    token_networks: List[TokenNetwork],
+    token_network_addresses: List[Address],
+    addresses: List[Address],
+    private_keys: List[str],
+):
+    url = api_url + '/{}/fee/batch'.format(token_network_addresses[0])
+
+    fee_infos = []
+    for signer_index, nonce in [(0, 2), (1, 1), (7, 2)]:
+        fee_info = FeeInfo(
+            token_network_address=token_network_addresses[0],
+            channel_identifier=0,
+            chain_id=1,
+            nonce=nonce,
+            percentage_fee=0.02
+        )
+        fee_info.signature = encode_hex(
+            sign_data(private_keys[signer_index], fee_info.serialize_bin())
+        )
+        fee_infos.append(fee_info.serialize_full())
+
+    response = requests.post(url, json=fee_infos)
+    assert response.status_code == 200
+    assert response.json()['result'] == [
+        {'status': 'ok'},
+        {'error': 'Outdated fee info.'},
+        {'error': 'Fee update signature does not match any of the participants.'},
+    ]
+    assert token_networks[0].G[addresses[0]][addresses[1]]['view'].percentage_fee == 0.02
+
+
 def test_put_fee_sync_check(
     api_sut: ServiceApi,
     api_url: str,
@@ -389,6 +489,14 @@ def test_get_paths_validation(
     assert response.status_code == 400
     assert response.json()['error'] == 'Payment value must be non-negative: -10'
 
+    url = base_url + '?from={}&to={}&value=ten&num_paths=3'.format(
+        initiator_address,
+        target_address
+    )
+    response = requests.get(url)
+    assert response.status_code == 400
+    assert response.json()['error'] == 'Invalid value for value: ten'
+
     url = base_url + '?from={}&to={}&value=10&num_paths=-1'.format(
         initiator_address,
         target_address
@@ -397,6 +505,22 @@ def test_get_paths_validation(
     assert response.status_code == 400
     assert response.json()['error'] == 'Number of paths must be positive: -1'
 
+    url = base_url + '?from={}&to={}&value=10&num_paths=3&strategy=fastest'.format(
+        initiator_address,
+        target_address
+    )
+    response = requests.get(url)
+    assert response.status_code == 400
+    assert response.json()['error'] == 'Unknown path strategy: fastest'
+
+    url = base_url + '?from={}&to={}&value=10&num_paths=3&max_time_ms=0'.format(
+        initiator_address,
+        target_address
+    )
+    response = requests.get(url)
+    assert response.status_code == 400
+    assert response.json()['error'] == 'Time budget must be positive: 0'
+
 
 def test_get_paths_path_validation(
     api_sut: ServiceApi,
@@ -444,6 +568,7 @@ def test_get_paths(
     )
     response = requests.get(url)
     assert response.status_code == 200
+    assert response.json()['partial'] is False
     paths = response.json()['result']
     assert len(paths) == 2
     assert paths == [
@@ -465,3 +590,236 @@ def test_get_paths(
     response = requests.get(url)
     assert response.status_code == 400
     assert response.json()['error'].startswith('No suitable path found for transfer from')
+
+    # 10 has no channels in this token network
+    url = base_url + '?from={}&to={}&value=10&num_paths=3'.format(
+        addresses[10],
+        addresses[0]
+    )
+    response = requests.get(url)
+    assert response.status_code == 400
+    assert response.json()['error'] == 'Initiator address has no channels: {}'.format(
+        addresses[10]
+    )
+
+
+def test_get_paths_etag(
+    api_sut: ServiceApi,
+    api_url: str,
+    addresses: List[Address],
+    token_networks: List[TokenNetwork],
+    token_network_addresses: List[Address]
+):
+    url = api_url + '/{}/paths?from={}&to={}&value=10&num_paths=3'.format(
+        token_network_addresses[0],
+        addresses[0],
+        addresses[2]
+    )
+    response = requests.get(url)
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+
+    # the network did not change
+    response = requests.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert response.content == b''
+
+    # a change of a channel outside of the paths gives a new tag for the same result
+    token_networks[0].update_fee(6, addresses[5], 100, 0.0030)
+    response = requests.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] != etag
+    etag = response.headers['ETag']
+
+    # a change of a channel on the paths changes the result
+    token_networks[0].update_fee(1, addresses[1], 100, 0.0009)
+    response = requests.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert response.json()['result'][0]['estimated_fee'] == 0.0019
+    etag = response.headers['ETag']
+
+    # tags of another process are only accepted if the result is unchanged
+    response = requests.get(url, headers={'If-None-Match': '"other-{}"'.format(
+        etag.strip('"').split('-', 1)[1]
+    )})
+    assert response.status_code == 304
+
+    # a restarted network reaches the version of the tag again, but in a new epoch
+    token_networks[0].update_fee(1, addresses[1], 101, 0.0010)
+    token_networks[0].epoch += 1
+    token_networks[0].version = int(etag.strip('"').split('-')[1])
+    response = requests.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.json()['result'][0]['estimated_fee'] == 0.0020
+
+
+def test_get_paths_stream(
+    api_sut: ServiceApi,
+    api_url: str,
+    addresses: List[Address],
+    token_networks: List[TokenNetwork],
+    token_network_addresses: List[Address]
+):
+    base_url = api_url + '/{}/paths/stream'.format(token_network_addresses[0])
+
+    url = base_url + '?from={}&to={}&value=10&num_paths=3'.format(
+        addresses[0],
+        addresses[2]
+    )
+    response = requests.get(url, stream=True)
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.iter_lines()]
+    assert lines == [
+        {
+            'path': [addresses[0], addresses[1], addresses[2]],
+            'estimated_fee': 0.0018
+        },
+        {
+            'path': [addresses[0], addresses[1], addresses[4], addresses[3], addresses[2]],
+            'estimated_fee': 0.0131
+        },
+        {'partial': False},
+    ]
+
+    # errors are found before the first path
+    url = base_url + '?from={}&to={}&value=10&num_paths=3'.format(
+        addresses[0],
+        addresses[5]
+    )
+    response = requests.get(url)
+    assert response.status_code == 400
+    assert response.json()['error'].startswith('No suitable path found for transfer from')
+
+    # failures after the first path end the stream with an error
+    def failing_search(*args, **kwargs):
+        yield {'path': [addresses[0], addresses[2]], 'estimated_fee': 0.0025}
+        raise KeyError(addresses[2])
+
+    url = base_url + '?from={}&to={}&value=10&num_paths=3'.format(
+        addresses[0],
+        addresses[2]
+    )
+    with mock.patch.object(token_networks[0], 'iter_paths', failing_search):
+        response = requests.get(url)
+    assert response.status_code == 200
+    assert [json.loads(line) for line in response.iter_lines()] == [
+        {'path': [addresses[0], addresses[2]], 'estimated_fee': 0.0025},
+        {'error': 'Path search failed'},
+    ]
+
+
+def test_get_paths_batch(
+    api_sut: ServiceApi,
+    api_url: str,
+    addresses: List[Address],
+    token_network_addresses: List[Address]
+):
+    url = api_url + '/{}/paths/batch'.format(token_network_addresses[0])
+
+    response = requests.post(url, json={'queries': [
+        {'from': addresses[0], 'to': addresses[2], 'value': 10, 'num_paths': 3},
+        {'from': addresses[0], 'to': addresses[5], 'value': 10, 'num_paths': 3},
+        {'from': addresses[0], 'to': 'notanaddress', 'value': 10, 'num_paths': 3},
+        {'from': [addresses[0]], 'to': addresses[2], 'value': 10, 'num_paths': 3},
+        {'from': addresses[0], 'to': {'address': addresses[2]}, 'value': 10, 'num_paths': 3},
+    ]})
+    assert response.status_code == 200
+    results = response.json()['result']
+    assert len(results) == 5
+    assert results[0]['result'] == [
+        {
+            'path': [addresses[0], addresses[1], addresses[2]],
+            'estimated_fee': 0.0018
+        },
+        {
+            'path': [addresses[0], addresses[1], addresses[4], addresses[3], addresses[2]],
+            'estimated_fee': 0.0131
+        }
+    ]
+    assert results[1]['error'].startswith('No suitable path found for transfer from')
+    assert results[2]['error'] == 'Invalid target address: notanaddress'
+    assert results[3]['error'] == 'Parameters from and to must be strings'
+    assert results[4]['error'] == 'Parameters from and to must be strings'
+
+    response = requests.post(url, json={'queries': [], 'strategy': 'fastest'})
+    assert response.status_code == 400
+    assert response.json()['error'] == 'Unknown path strategy: fastest'
+
+    response = requests.post(url, json={'paths': []})
+    assert response.status_code == 400
+
+
+def parse_with_reqparse(arguments):
+    """ The argument parsing before `parse_query_args`, with a parser built for every request. """
+    parser = reqparse.RequestParser()
+    for name, argument_type, default in arguments:
+        parser.add_argument(name, type=argument_type, default=default, location='args')
+    return parser.parse_args()
+
+
+def test_parse_query_args(
+    api_sut: ServiceApi,
+    addresses: List[Address],
+    token_network_addresses: List[Address]
+):
+    url = API_PATH + '/{}/paths?from={}&to={}&value=10&num_paths=3&strategy=yen'.format(
+        token_network_addresses[0],
+        addresses[0],
+        addresses[2]
+    )
+    with api_sut.flask_app.test_request_context(url):
+        assert parse_with_reqparse(PATHS_ARGUMENTS) == parse_query_args(PATHS_ARGUMENTS)
+
+
+@pytest.mark.benchmark
+def test_paths_request_benchmark(
+    api_sut: ServiceApi,
+    addresses: List[Address],
+    token_network_addresses: List[Address]
+):
+    app = api_sut.flask_app
+    client = app.test_client()
+    url = API_PATH + '/{}/paths?from={}&to={}&value=10&num_paths=3'.format(
+        token_network_addresses[0],
+        addresses[0],
+        addresses[2]
+    )
+
+    def encode_with_json(data):
+        return (json.dumps(data) + '\n').encode()
+
+    def microseconds_per_call(function, *args, num_calls: int = 10000) -> float:
+        start = time.time()
+        for _ in range(num_calls):
+            function(*args)
+        return (time.time() - start) / num_calls * 1e6
+
+    def requests_per_second(num_requests: int = 500) -> float:
+        start = time.time()
+        for _ in range(num_requests):
+            # buffered responses are closed, which frees their admission slot
+            response = client.get(url, buffered=True)
+            assert response.status_code == 200
+        return num_requests / (time.time() - start)
+
+    with app.test_request_context(url):
+        print('parse args = {:.1f}us before, {:.1f}us after'.format(
+            microseconds_per_call(parse_with_reqparse, PATHS_ARGUMENTS),
+            microseconds_per_call(parse_query_args, PATHS_ARGUMENTS),
+        ))
+
+    response_data = client.get(url, buffered=True).get_json()
+    assert json.loads(dumps(response_data)) == response_data
+    print('encode response = {:.1f}us before, {:.1f}us after'.format(
+        microseconds_per_call(encode_with_json, response_data),
+        microseconds_per_call(dumps, response_data),
+    ))
+
+    after = requests_per_second()
+    with mock.patch('pathfinder.api.rest.parse_query_args', parse_with_reqparse), \
+            mock.patch('pathfinder.api.encoding.orjson', None):
+        before = requests_per_second()
+    print('requests/s = {:.0f} before, {:.0f} after'.format(before, after))
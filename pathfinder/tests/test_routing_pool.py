@@ -0,0 +1,45 @@
+from typing import List
+
+import pytest
+from networkx import NetworkXNoPath
+from raiden_libs.types import Address
+
+from pathfinder.model import TokenNetwork
+from pathfinder.routing_pool import RoutingWorkerPool
+
+
+def test_routing_pool_follows_mutations(
+    token_networks: List[TokenNetwork],
+    populate_token_networks_case_1: None,
+    addresses: List[Address],
+):
+    token_network = token_networks[0]
+    pool = RoutingWorkerPool(2)
+    pool.start()
+    try:
+        # seeded with the populated network
+        pool.add_token_network(token_network)
+        for _ in range(2):
+            paths = pool.get_paths(token_network.address, addresses[0], addresses[4], 10, 3)
+            assert paths == token_network.get_paths(addresses[0], addresses[4], 10, 3)
+            assert paths.partial is False
+
+        # later changes are streamed to the replicas
+        token_network.update_fee(4, addresses[0], 100, 0.0001)
+        token_network.handle_channel_closed_event(3)
+        for _ in range(2):
+            paths = pool.get_paths(token_network.address, addresses[0], addresses[4], 10, 3)
+            assert paths == token_network.get_paths(addresses[0], addresses[4], 10, 3)
+
+        with pytest.raises(NetworkXNoPath):
+            pool.get_paths(token_network.address, addresses[0], addresses[5], 10, 3)
+
+        batch = pool.get_paths_batch(
+            token_network.address,
+            [(addresses[0], addresses[4], 10, 3), (addresses[0], addresses[5], 10, 3)],
+        )
+        assert batch[0] == token_network.get_paths(addresses[0], addresses[4], 10, 3)
+        assert isinstance(batch[1], NetworkXNoPath)
+        assert all(worker.load == 0 for worker in pool.workers)
+    finally:
+        pool.stop()
@@ -0,0 +1,45 @@
+from typing import List
+
+from eth_utils import encode_hex
+from raiden_libs.messages import BalanceProof
+from raiden_libs.types import Address
+from raiden_libs.utils.signing import sign_data
+
+from pathfinder.signature_pool import SignatureWorkerPool
+
+
+def test_signature_pool_recovers_signers(
+    token_network_addresses: List[Address],
+    addresses: List[Address],
+    private_keys: List[str],
+):
+    balance_proofs = []
+    for index in range(3):
+        balance_proof = BalanceProof(
+            channel_identifier=123,
+            token_network_address=token_network_addresses[0],
+            nonce=1,
+            chain_id=321,
+            locksroot="0x%064x" % 0,
+            transferred_amount=1,
+            locked_amount=0,
+            additional_hash="0x%064x" % 0,
+        )
+        balance_proof.signature = encode_hex(
+            sign_data(private_keys[index], balance_proof.serialize_bin())
+        )
+        balance_proofs.append(balance_proof)
+    balance_proofs[2].signature = '0x' + '00' * 65
+
+    pool = SignatureWorkerPool(2)
+    pool.start()
+    try:
+        signers = pool.recover_signers(balance_proofs + balance_proofs[:1])
+        assert signers == [addresses[0], addresses[1], None, addresses[0]]
+        assert pool.stats()['recovered'] == 3
+
+        # resent messages are answered from the cache
+        assert pool.recover_signers(balance_proofs[1:2]) == [addresses[1]]
+        assert pool.stats() == dict(cache_size=3, cache_hits=1, recovered=3, in_flight=0)
+    finally:
+        pool.stop()
@@ -0,0 +1,54 @@
+import gevent
+import pytest
+
+from pathfinder.utils.single_flight import SingleFlight
+
+
+def test_single_flight_shares_concurrent_calls():
+    single_flight = SingleFlight()
+    computed = []
+
+    def compute(value):
+        computed.append(value)
+        gevent.sleep(0.01)
+        if value < 0:
+            raise ValueError(value)
+        return value * 2
+
+    calls = [gevent.spawn(single_flight.run, key, compute, key) for key in [1, 1, 2, 1]]
+    gevent.joinall(calls)
+    assert [call.value for call in calls] == [(2, False), (2, True), (4, False), (2, True)]
+    assert computed == [1, 2]
+    assert single_flight.stats() == dict(calls=4, joined=2, in_flight=0)
+
+    # a finished computation is not reused
+    assert single_flight.run(1, compute, 1) == (2, False)
+
+    failing = [gevent.spawn(single_flight.run, -1, compute, -1) for _ in range(2)]
+    gevent.joinall(failing)
+    assert all(isinstance(call.exception, ValueError) for call in failing)
+    assert computed == [1, 2, 1, -1]
+    with pytest.raises(ValueError):
+        single_flight.run(-1, compute, -1)
+
+
+def test_single_flight_survives_killed_call():
+    single_flight = SingleFlight()
+    computed = []
+
+    def compute(value):
+        computed.append(value)
+        gevent.sleep(0.01)
+        return value * 2
+
+    leader = gevent.spawn(single_flight.run, 1, compute, 1)
+    gevent.sleep(0)
+    waiters = [gevent.spawn(single_flight.run, 1, compute, 1) for _ in range(2)]
+    gevent.sleep(0)
+
+    # e.g. the client of the first call disconnected, one of the waiters computes instead
+    leader.kill()
+    gevent.joinall(waiters)
+    assert [waiter.value for waiter in waiters] == [(2, False), (2, True)]
+    assert computed == [1, 1]
+    assert single_flight.stats() == dict(calls=3, joined=1, in_flight=0)
@@ -0,0 +1,140 @@
+from typing import Callable, List
+from unittest import mock
+
+import pytest
+from _pytest.monkeypatch import MonkeyPatch
+from networkx import NetworkXError, NetworkXNoPath
+from raiden_libs.types import Address, ChannelIdentifier
+
+import pathfinder.model.snapshot
+from pathfinder.model import TokenNetwork
+from pathfinder.model.snapshot import load_snapshot, snapshot_path, write_snapshot
+from pathfinder.pathfinding_service import PathfindingService
+from pathfinder.snapshot_service import SnapshotPathfindingService
+
+
+def test_snapshot_paths_match_token_network(
+    token_networks: List[TokenNetwork],
+    populate_token_networks_case_1: None,
+    addresses: List[Address],
+    tmpdir,
+):
+    token_network = token_networks[0]
+    # beyond the int64 capacities of the arrays
+    token_network.handle_channel_new_deposit_event(6, addresses[5], 2 ** 255)
+    path = snapshot_path(str(tmpdir), token_network.address)
+    write_snapshot(token_network, path)
+    snapshot = load_snapshot(path)
+
+    assert snapshot.address == token_network.address
+    assert snapshot.version == token_network.version
+    assert snapshot.epoch == token_network.epoch
+    assert snapshot.max_percentage_fee == token_network.max_percentage_fee
+    for source, target, value in [(0, 4, 10), (0, 2, 40), (4, 0, 10), (5, 6, 2 ** 254)]:
+        for strategy in ('diversity', 'yen'):
+            assert snapshot.get_paths(
+                addresses[source], addresses[target], value, 3, strategy=strategy
+            ) == token_network.get_paths(
+                addresses[source], addresses[target], value, 3, strategy=strategy
+            )
+
+    with pytest.raises(NetworkXNoPath):
+        snapshot.get_paths(addresses[0], addresses[5], 10, 3)
+    with pytest.raises(NetworkXError):
+        snapshot.G.remove_edge(addresses[0], addresses[1])
+
+
+def test_snapshot_written_while_network_changes(
+    token_networks: List[TokenNetwork],
+    populate_token_networks_case_1: None,
+    addresses: List[Address],
+    tmpdir,
+    monkeypatch: MonkeyPatch
+):
+    token_network = token_networks[0]
+    path = snapshot_path(str(tmpdir), token_network.address)
+
+    # changes applied by other greenlets while the writer yields
+    changes: List[Callable[[], None]] = []
+
+    def sleep(seconds: float):
+        while changes:
+            changes.pop()()
+
+    monkeypatch.setattr(pathfinder.model.snapshot, 'SNAPSHOT_CHUNK_SIZE', 1)
+    monkeypatch.setattr(pathfinder.model.snapshot.gevent, 'sleep', sleep)
+
+    # a fee update does not stop the writer, the snapshot gets the version from before
+    version = token_network.version
+    changes.append(lambda: token_network.update_fee(
+        ChannelIdentifier(1), addresses[1], 100, 0.005
+    ))
+    assert write_snapshot(token_network, path)
+    assert not changes
+    assert load_snapshot(path).version == version
+    assert token_network.version > version
+
+    # a closed channel does, the previous snapshot is kept
+    changes.append(lambda: token_network.handle_channel_closed_event(ChannelIdentifier(3)))
+    assert not write_snapshot(token_network, path)
+    assert not changes
+    assert load_snapshot(path).version == version
+
+
+def test_snapshot_service_follows_publications(
+    pathfinding_service_full_mock: PathfindingService,
+    populate_token_networks_case_1: None,
+    addresses: List[Address],
+    tmpdir,
+):
+    pathfinding_service_full_mock.snapshot_dir = str(tmpdir)
+    snapshot_service = SnapshotPathfindingService(str(tmpdir), refresh_interval=0)
+    assert snapshot_service.token_networks == {}
+
+    pathfinding_service_full_mock.publish_snapshots()
+    token_network_address, token_network = next(
+        iter(pathfinding_service_full_mock.token_networks.items())
+    )
+    assert snapshot_service.follows_token_network(token_network_address)
+    snapshot = snapshot_service.token_networks[token_network_address]
+    assert snapshot.version == token_network.version
+    # unchanged networks are neither republished nor reloaded
+    pathfinding_service_full_mock.publish_snapshots()
+    assert snapshot_service.token_networks[token_network_address] is snapshot
+
+    token_network.handle_channel_closed_event(3)
+    pathfinding_service_full_mock.publish_snapshots()
+    updated_snapshot = snapshot_service.token_networks[token_network_address]
+    assert updated_snapshot.version == token_network.version
+    assert snapshot_service.get_paths(
+        updated_snapshot, addresses[0], addresses[4], 10, 3
+    ) == token_network.get_paths(addresses[0], addresses[4], 10, 3)
+    # the replaced version stays usable
+    assert snapshot.get_paths(addresses[0], addresses[4], 10, 3)
+
+
+def test_snapshot_service_refresh_interval(
+    pathfinding_service_full_mock: PathfindingService,
+    populate_token_networks_case_1: None,
+    tmpdir,
+):
+    pathfinding_service_full_mock.snapshot_dir = str(tmpdir)
+    pathfinding_service_full_mock.publish_snapshots()
+    token_network_address, token_network = next(
+        iter(pathfinding_service_full_mock.token_networks.items())
+    )
+    snapshot_service = SnapshotPathfindingService(str(tmpdir), refresh_interval=60)
+    snapshot = snapshot_service.token_networks[token_network_address]
+
+    # within the interval, the snapshot directory is not checked again
+    token_network.handle_channel_closed_event(3)
+    pathfinding_service_full_mock.publish_snapshots()
+    with mock.patch('pathfinder.snapshot_service.os.listdir') as listdir:
+        assert snapshot_service.token_networks[token_network_address] is snapshot
+        assert snapshot_service.follows_token_network(token_network_address)
+    assert listdir.call_count == 0
+
+    snapshot_service.refresh()
+    assert snapshot_service.token_networks[token_network_address].version == (
+        token_network.version
+    )
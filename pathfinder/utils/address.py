@@ -0,0 +1,64 @@
+""" Address handling without repeated keccak hashes.
+
+Checksumming an address or verifying its checksum hashes it with keccak. The same few thousand
+participant addresses show up in every event, message and path query, so the results are
+cached.
+"""
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+import eth_utils
+from raiden_libs.types import Address
+
+from pathfinder.config import ADDRESS_CACHE_SIZE
+from pathfinder.utils.exceptions import InvalidAddressChecksumError
+
+
+@lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def is_checksum_address(value) -> bool:
+    return eth_utils.is_checksum_address(value)
+
+
+@lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def is_address(value) -> bool:
+    return eth_utils.is_address(value)
+
+
+@lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def to_checksum_address(value) -> Address:
+    return Address(eth_utils.to_checksum_address(value))
+
+
+class AddressTable:
+    """ Interns checksum addresses to compact, consecutive integer ids.
+
+    Addresses are validated once when they are interned, afterwards they are only handled by
+    id until they are converted back with `address`.
+    """
+
+    def __init__(self) -> None:
+        self.ids: Dict[Address, int] = {}
+        self.addresses: List[Address] = []
+
+    def __len__(self) -> int:
+        return len(self.addresses)
+
+    def __contains__(self, address: Address) -> bool:
+        return address in self.ids
+
+    def intern(self, address: Address) -> int:
+        """ Returns the id of `address`, assigning the next free one to new addresses. """
+        address_id = self.ids.get(address)
+        if address_id is None:
+            if not is_checksum_address(address):
+                raise InvalidAddressChecksumError('Not a checksum address: {}'.format(address))
+            address_id = len(self.addresses)
+            self.ids[address] = address_id
+            self.addresses.append(address)
+        return address_id
+
+    def get(self, address: Address) -> Optional[int]:
+        return self.ids.get(address)
+
+    def address(self, address_id: int) -> Address:
+        return self.addresses[address_id]
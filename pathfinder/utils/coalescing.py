@@ -0,0 +1,33 @@
+from typing import Any, Dict, Hashable, List, Tuple
+
+
+class CoalescingQueue:
+    """ Keeps only the item with the highest nonce put for every key until they are taken.
+
+    Items replaced by or older than a pending item with the same key are dropped and counted
+    in `dropped`. Pending items are taken in the order their keys were first put.
+    """
+
+    def __init__(self) -> None:
+        self.pending: Dict[Hashable, Tuple[int, Any]] = {}
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.pending
+
+    def put(self, key: Hashable, nonce: int, item: Any):
+        current = self.pending.get(key)
+        if current is not None:
+            self.dropped += 1
+            if current[0] >= nonce:
+                return
+        self.pending[key] = (nonce, item)
+
+    def take(self) -> List[Any]:
+        """ Removes and returns all pending items. """
+        items = [item for _, item in self.pending.values()]
+        self.pending = {}
+        return items
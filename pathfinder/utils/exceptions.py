@@ -1,3 +1,8 @@
 class InvalidAddressChecksumError(ValueError):
     def __init__(self, *args: object) -> None:
         ValueError.__init__(self, *args)
+
+
+class RoutingWorkerError(RuntimeError):
+    def __init__(self, *args: object) -> None:
+        RuntimeError.__init__(self, *args)
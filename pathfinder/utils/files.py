@@ -0,0 +1,16 @@
+import os
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator
+
+
+@contextmanager
+def atomic_write(path: str) -> Iterator[BinaryIO]:
+    """ Writes to a temporary file that replaces `path` once it is complete and synced to disk.
+
+    Readers of `path` see either the old or the new content, never a partial write. """
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'wb') as temporary_file:
+        yield temporary_file
+        temporary_file.flush()
+        os.fsync(temporary_file.fileno())
+    os.replace(temporary_path, path)
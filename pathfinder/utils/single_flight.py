@@ -0,0 +1,62 @@
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+from gevent.event import AsyncResult
+
+# result of a computation whose greenlet was killed
+_ABANDONED = object()
+
+
+class SingleFlight:
+    """ Runs concurrent calls with the same key only once.
+
+    The first call with a key computes the result. Calls with the same key arriving while it
+    runs wait for it and get the same result or exception, they are counted in `joined`. Once
+    the computation finished, the next call with the key computes it again.
+
+    If the computing greenlet is killed, e.g. because its client disconnected, the waiters do
+    not share its `GreenletExit`. The first of them takes over the computation instead.
+    """
+
+    def __init__(self) -> None:
+        self.in_flight: Dict[Hashable, AsyncResult] = {}
+        self.calls = 0
+        self.joined = 0
+
+    def __len__(self) -> int:
+        return len(self.in_flight)
+
+    def run(self, key: Hashable, function: Callable, *args, **kwargs) -> Tuple[Any, bool]:
+        """ Returns the result of `function(*args, **kwargs)` and whether it was computed by
+        another call. """
+        self.calls += 1
+        pending = self.in_flight.get(key)
+        while pending is not None:
+            result = pending.get()
+            if result is not _ABANDONED:
+                self.joined += 1
+                return result, True
+            pending = self.in_flight.get(key)
+
+        pending = AsyncResult()
+        self.in_flight[key] = pending
+        try:
+            result = function(*args, **kwargs)
+        except Exception as error:
+            pending.set_exception(error)
+            raise
+        except BaseException:
+            # the computing greenlet was killed, which is no reason for the waiters to fail
+            pending.set(_ABANDONED)
+            raise
+        else:
+            pending.set(result)
+            return result, False
+        finally:
+            del self.in_flight[key]
+
+    def stats(self) -> Dict[str, int]:
+        return dict(
+            calls=self.calls,
+            joined=self.joined,
+            in_flight=len(self.in_flight),
+        )
@@ -23,6 +23,11 @@ setup_requirements = ['pytest-runner', ]
 
 test_requirements = ['pytest', ]
 
+extras_requirements = {
+    # faster JSON encoding of the REST API responses, see `pathfinder.api.encoding`
+    'fast-json': ['orjson'],
+}
+
 setup(
     author="Brainbot Labs Est.",
     author_email='contact@brainbot.li',
@@ -34,6 +39,7 @@ setup(
         'Programming Language :: Python :: 3.6',
     ],
     description="Pathfinding service for the Raiden Network",
+    extras_require=extras_requirements,
     entry_points={
         'console_scripts': [
             'pathfinder=pathfinder.cli:main',